@@ -1,90 +1,453 @@
+import contextlib
 import csv
-from datetime import datetime
-
-def categorize_blood_pressure(bp_value):
-    """Catégoriser la tension artérielle selon les critères AHA."""
-    try:
-        systolic, diastolic = map(int, bp_value.split("/"))
-    except:
-        return "Unknown"
-
-    if systolic > 180 or diastolic > 120:
-        return "Hypertensive Crisis"
-    elif systolic >= 140 or diastolic >= 90:
-        return "Hypertension Stage 2"
-    elif systolic >= 130 or diastolic >= 80:
-        return "Hypertension Stage 1"
-    elif systolic >= 120 and diastolic < 80:
-        return "Elevated"
-    elif systolic < 120 and diastolic < 80:
-        return "Normal"
-    else:
-        return "Unknown"
-
-
-def transform_data(old_csv_file_name, new_csv_file_name):
-    with open(old_csv_file_name, "r", encoding="utf-8", newline="") as infile:
-        reader = csv.reader(infile)
-        header = next(reader)
-        data = list(reader)
-
-    # indices utiles
-    idx_gender = header.index("Gender")
-    idx_reg_date = header.index("User_Registration_Date")
-    idx_reg_time = header.index("User_Registration_Time")
-    idx_checkup_date = header.index("Last_Checkup_Date")
-    idx_checkup_time = header.index("Last_Checkup_Time")
-    idx_no_of_checkups = header.index("No_of_Checkups")
-    idx_no_of_missed_checkup = header.index("No_of_Missed_Checkups")
-    idx_bp = header.index("Blood_Pressure")
+import io
+import mmap
+import multiprocessing
+from itertools import islice
+
+from .blood_pressure import blood_pressure_category, categorize_blood_pressure
+from .columnar import ColumnarWriter, write_columnar
+from .dates import correct_dates, date_indices, merge_reports, new_report, print_report
+from .metrics import stage
+from .validation import (FIELD_COUNT, QuarantineWriter, RowValidator, is_int, new_validation_report,
+                         print_validation_report)
+
+def _prepare_header(header):
+    """Calculer les indices utiles et le nouveau header à partir du header d'origine."""
+    indices = date_indices(header)
+    indices.update({
+        "no_of_checkups": header.index("No_of_Checkups"),
+        "no_of_missed_checkup": header.index("No_of_Missed_Checkups"),
+        "bp": header.index("Blood_Pressure"),
+    })
+    # règles de l'étape de validation (voir validation.py)
+    indices["validator"] = RowValidator(header)
 
     # colonnes à supprimer
     drop_cols = {"Reminder_Date", "Gender", "No_of_Checkups", "No_of_Missed_Checkups"}
-    keep_indices = [i for i, col in enumerate(header) if col not in drop_cols]
+    indices["keep"] = [i for i, col in enumerate(header) if col not in drop_cols]
 
     # nouveau header
-    new_header = [header[i] for i in keep_indices]
+    new_header = [header[i] for i in indices["keep"]]
     new_header.append("Checkup")
     new_header.append("BP_Category")
 
-    new_data = []
-    for row in data:
-        # corriger dates pour les femmes
-        reg_date, chk_date = row[idx_reg_date], row[idx_checkup_date]
-
-        try:
-            reg_dt = datetime.fromisoformat(reg_date)
-            chk_dt = datetime.fromisoformat(chk_date)
-        except:
-            reg_dt, chk_dt = reg_date, chk_date
-
-        try:
-            if reg_dt > chk_dt:
-                row[idx_reg_date], row[idx_checkup_date] = row[idx_checkup_date], row[idx_reg_date]
-                row[idx_reg_time], row[idx_checkup_time] = row[idx_checkup_time], row[idx_reg_time]
-        except:
-            if reg_date > chk_date:
-                row[idx_reg_date], row[idx_checkup_date] = row[idx_checkup_date], row[idx_reg_date]
-                row[idx_reg_time], row[idx_checkup_time] = row[idx_checkup_time], row[idx_reg_time]
-
-        # calculer Checkup
-        try:
-            checkup_done = int(row[idx_no_of_checkups]) - int(row[idx_no_of_missed_checkup])
-        except:
-            checkup_done = ""
-
-        # catégoriser BP
-        bp_value = row[idx_bp]
-        bp_category = categorize_blood_pressure(bp_value)
-
-        # construire ligne finale
-        final_row = [row[i] for i in keep_indices]
-        final_row.append(str(checkup_done))
-        final_row.append(bp_category)
-        new_data.append(final_row)
+    return new_header, indices
+
+
+def _transform_row(row, indices):
+    """Transformer une ligne du CSV d'origine en ligne du nouveau CSV.
+
+    Les dates doivent déjà avoir été corrigées par lot (voir dates.correct_dates).
+    Chaque valeur est vérifiée : voir _transform_valid_row pour les lignes
+    déjà validées.
+    """
+    # calculer Checkup (vide si l'un des nombres est invalide)
+    checkups, missed_checkups = row[indices["no_of_checkups"]], row[indices["no_of_missed_checkup"]]
+    checkup_done = int(checkups) - int(missed_checkups) if is_int(checkups) and is_int(missed_checkups) else ""
+
+    # catégoriser BP
+    bp_value = row[indices["bp"]]
+    bp_category = categorize_blood_pressure(bp_value)
+
+    # construire ligne finale
+    final_row = [row[i] for i in indices["keep"]]
+    final_row.append(str(checkup_done))
+    final_row.append(bp_category)
+    return final_row
+
+
+def _transform_valid_row(row, indices):
+    """Version rapide de _transform_row pour une ligne validée par
+    validation.RowValidator : aucun test ni try/except."""
+    systolic, diastolic = row[indices["bp"]].split("/")
+    final_row = [row[i] for i in indices["keep"]]
+    final_row.append(str(int(row[indices["no_of_checkups"]]) - int(row[indices["no_of_missed_checkup"]])))
+    final_row.append(blood_pressure_category(int(systolic), int(diastolic)))
+    return final_row
+
+
+def _pad_short_rows(rows, invalid, indices):
+    """Compléter en place par des champs vides les lignes invalides trop
+    courtes (règle field_count), comme le fait read_csv, pour les
+    transformer comme les autres lignes invalides."""
+    nb_fields = indices["validator"].nb_fields
+    for position, reasons in invalid.items():
+        if FIELD_COUNT in reasons and len(rows[position]) < nb_fields:
+            rows[position].extend([""] * (nb_fields - len(rows[position])))
+
+
+def _transform_batch(batch, indices, report=None, validation=None, drop_invalid=False):
+    """Valider, corriger les dates et transformer un lot de lignes.
+
+    Les lignes valides passent par _transform_valid_row. Les lignes
+    invalides sont retirées si drop_invalid (pour la quarantaine), sinon
+    transformées par _transform_row, comme avant l'étape de validation
+    (complétées par des champs vides si elles sont trop courtes).
+
+    Returns
+    -------
+    tuple
+        Les lignes transformées, et les lignes invalides (voir
+        validation.RowValidator.validate).
+    """
+    invalid = indices["validator"].validate(batch, validation)
+    if not invalid:
+        correct_dates(batch, indices, report)
+        return [_transform_valid_row(row, indices) for row in batch], invalid
+
+    if drop_invalid:
+        batch = [row for position, row in enumerate(batch) if position not in invalid]
+        correct_dates(batch, indices, report)
+        return [_transform_valid_row(row, indices) for row in batch], invalid
+
+    _pad_short_rows(batch, invalid, indices)
+    correct_dates(batch, indices, report)
+    return [_transform_row(row, indices) if position in invalid else _transform_valid_row(row, indices)
+            for position, row in enumerate(batch)], invalid
+
+
+def skip_blank_rows(rows):
+    """Ignorer les lignes vides du CSV (csv.reader les lit comme des listes
+    sans champ) au lieu de les compléter en lignes de champs vides, comme
+    read_csv : le numéro d'une ligne dans la quarantaine est le même pour
+    tous les moteurs."""
+    return filter(None, rows)
+
+
+def transform_rows(reader, header, report=None, batch_size=1000, validation=None, quarantine=None):
+    """Générateur qui transforme les lignes d'un reader CSV une par une
+    (les lignes sont validées et les dates corrigées par lots de batch_size
+    lignes).
+
+    Les lignes vides (sans aucun champ) sont ignorées et ne sont pas
+    numérotées, comme dans tous les moteurs (voir skip_blank_rows).
+
+    Parameters
+    ----------
+    reader
+        Itérable de lignes (listes de chaînes) sans le header.
+    header
+        Header du CSV d'origine.
+    report
+        Si précisé, rapport de correction des dates mis à jour (voir dates.py).
+    batch_size
+        Nombre de lignes par lot.
+    validation
+        Si précisé, rapport de validation mis à jour (voir validation.py).
+    quarantine
+        Si précisé, validation.QuarantineWriter où écrire les lignes
+        invalides, qui ne sont alors pas transformées.
+
+    Yields
+    ------
+    list
+        Le nouveau header, puis chaque ligne transformée.
+    """
+    new_header, indices = _prepare_header(header)
+    yield new_header
+    reader = skip_blank_rows(reader)
+    first_row = 1
+    while True:
+        batch = list(islice(reader, batch_size))
+        if not batch:
+            break
+        new_rows, invalid = _transform_batch(batch, indices, report, validation, quarantine is not None)
+        if quarantine is not None and invalid:
+            quarantine.write_rows(batch, invalid, first_row)
+            if validation is not None:
+                validation["quarantined"] += len(invalid)
+        first_row += len(batch)
+        yield from new_rows
+
+
+def transform_data(old_csv_file_name, new_csv_file_name, columnar_dir=None, report=None,
+                   quarantine_file_name=None, validation=None):
+    # chaque étape est chronométrée dans metrics.METRICS
+    with stage("read") as step:
+        with open(old_csv_file_name, "r", encoding="utf-8", newline="") as infile:
+            reader = csv.reader(infile)
+            header = next(reader)
+            data = list(skip_blank_rows(reader))
+        step.rows = len(data)
+
+    new_header, indices = _prepare_header(header)
+
+    # valider toutes les lignes, une expression régulière par ligne (voir validation.py)
+    with stage("validate", len(data)):
+        validation_report = new_validation_report()
+        invalid = indices["validator"].validate(data, validation_report)
+
+    # lignes invalides mises en quarantaine, si demandé
+    if quarantine_file_name is not None:
+        with QuarantineWriter(quarantine_file_name, header) as quarantine:
+            quarantine.write_rows(data, invalid)
+        validation_report["quarantined"] = len(invalid)
+        data = [row for position, row in enumerate(data) if position not in invalid]
+        invalid = {}
+    print_validation_report(validation_report, quarantine_file_name)
+    if validation is not None:
+        merge_reports(validation, validation_report)
+
+    # lignes trop courtes gardées sans quarantaine : champs manquants vides
+    _pad_short_rows(data, invalid, indices)
+
+    # corriger les dates inversées (registration après checkup)
+    with stage("date_fix", len(data)):
+        dates_report = new_report()
+        correct_dates(data, indices, dates_report)
+    print_report(dates_report)
+    if report is not None:
+        merge_reports(report, dates_report)
+
+    # les lignes valides n'ont besoin d'aucun test
+    with stage("categorize", len(data)):
+        if invalid:
+            new_data = [_transform_row(row, indices) if position in invalid else _transform_valid_row(row, indices)
+                        for position, row in enumerate(data)]
+        else:
+            new_data = [_transform_valid_row(row, indices) for row in data]
 
     # écrire le nouveau CSV
-    with open(new_csv_file_name, "w", encoding="utf-8", newline="") as outfile:
+    with stage("write", len(new_data)):
+        with open(new_csv_file_name, "w", encoding="utf-8", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(new_header)
+            writer.writerows(new_data)
+
+    # cache binaire en colonnes, si demandé
+    if columnar_dir is not None:
+        with stage("write_columnar", len(new_data)):
+            write_columnar(columnar_dir, new_header, new_data)
+
+
+def stream_transform_data(old_csv_file_name, new_csv_file_name, batch_size=10000, columnar_dir=None, report=None,
+                          quarantine_file_name=None, validation=None):
+    """Version en flux de transform_data : lit, transforme et écrit le CSV
+    par lots de batch_size lignes, sans jamais charger tout le fichier en mémoire.
+    Le fichier produit est identique octet par octet à celui de transform_data.
+
+    Parameters
+    ----------
+    old_csv_file_name
+        Nom du fichier CSV à transformer.
+    new_csv_file_name
+        Nom du nouveau fichier CSV.
+    batch_size
+        Nombre maximal de lignes gardées en mémoire avant écriture.
+    columnar_dir
+        Si précisé, dossier où écrire aussi le jeu de données au format
+        binaire en colonnes (voir columnar.py).
+    report
+        Si précisé, rapport de correction des dates mis à jour (voir dates.py).
+    quarantine_file_name
+        Si précisé, fichier CSV où écrire les lignes invalides (avec leur
+        numéro et les règles non respectées) au lieu de les transformer.
+    validation
+        Si précisé, rapport de validation mis à jour (voir validation.py).
+
+    Returns
+    -------
+    int
+        Nombre de lignes de données écrites.
+    """
+    count = 0
+    dates_report = new_report()
+    validation_report = new_validation_report()
+    # lecture, transformation et écriture sont entrelacées : une seule étape.
+    # Tous les fichiers sont fermés par l'ExitStack, même en cas d'erreur.
+    with stage("stream_transform") as step, contextlib.ExitStack() as files:
+        infile = files.enter_context(open(old_csv_file_name, "r", encoding="utf-8", newline=""))
+        outfile = files.enter_context(open(new_csv_file_name, "w", encoding="utf-8", newline=""))
+        reader = csv.reader(infile)
         writer = csv.writer(outfile)
+        header = next(reader)
+        quarantine = None
+        if quarantine_file_name is not None:
+            quarantine = files.enter_context(QuarantineWriter(quarantine_file_name, header))
+        rows = transform_rows(reader, header, dates_report, validation=validation_report, quarantine=quarantine)
+        new_header = next(rows)
         writer.writerow(new_header)
-        writer.writerows(new_data)
+        columnar = files.enter_context(ColumnarWriter(columnar_dir, new_header)) if columnar_dir is not None else None
+
+        # écrire par lots bornés
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            writer.writerows(batch)
+            if columnar is not None:
+                columnar.write_rows(batch)
+            count += len(batch)
+        step.rows = count
+
+    print_validation_report(validation_report, quarantine_file_name)
+    if validation is not None:
+        merge_reports(validation, validation_report)
+    print_report(dates_report)
+    if report is not None:
+        merge_reports(report, dates_report)
+    return count
+
+
+def _next_record_end(mm, pos, in_quotes=False):
+    """Renvoyer la position juste après la fin d'enregistrement qui suit pos.
+
+    Un saut de ligne ne termine un enregistrement que s'il est hors des
+    guillemets : on suit la parité des '"' pour ne pas couper un champ.
+    """
+    while True:
+        nl = mm.find(b"\n", pos)
+        if nl == -1:
+            return len(mm)
+        in_quotes ^= mm[pos:nl].count(b'"') % 2 == 1
+        pos = nl + 1
+        if not in_quotes:
+            return pos
+
+
+def _complete_records_end(mm, pos, max_records=None):
+    """Renvoyer la position juste après le dernier enregistrement complet
+    (terminé par un saut de ligne hors guillemets) qui suit pos, en en
+    prenant au plus max_records, et le nombre d'enregistrements pris.
+
+    Un enregistrement final sans saut de ligne, ou dont un champ entre
+    guillemets n'est pas fermé, n'est pas complet.
+    """
+    end, count, in_quotes = pos, 0, False
+    while max_records is None or count < max_records:
+        nl = mm.find(b"\n", pos)
+        if nl == -1:
+            break
+        in_quotes ^= mm[pos:nl].count(b'"') % 2 == 1
+        pos = nl + 1
+        if not in_quotes:
+            end = pos
+            count += 1
+    return end, count
+
+
+def _shard_boundaries(mm, data_start, shard_size):
+    """Découper [data_start, fin du fichier] en plages d'octets d'environ
+    shard_size octets, alignées sur des fins d'enregistrement."""
+    boundaries = [data_start]
+    size = len(mm)
+    pos = data_start
+    in_quotes = False
+    while boundaries[-1] + shard_size < size:
+        target = boundaries[-1] + shard_size
+        in_quotes ^= mm[pos:target].count(b'"') % 2 == 1
+        pos = _next_record_end(mm, target, in_quotes)
+        in_quotes = False
+        if pos >= size:
+            break
+        boundaries.append(pos)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _transform_shard(args):
+    """Transformer une plage d'octets du CSV d'origine (exécuté dans un worker).
+
+    Les lignes invalides à mettre en quarantaine sont renvoyées avec leur
+    position dans la plage : seul le processus principal connaît leur numéro
+    dans le fichier.
+    """
+    old_csv_file_name, start, end, header, drop_invalid = args
+    with open(old_csv_file_name, "rb") as infile:
+        infile.seek(start)
+        text = infile.read(end - start).decode("utf-8")
+
+    _, indices = _prepare_header(header)
+    rows = list(skip_blank_rows(csv.reader(io.StringIO(text, newline=""))))
+    report, validation_report = new_report(), new_validation_report()
+    new_rows, invalid = _transform_batch(rows, indices, report, validation_report, drop_invalid)
+
+    output = io.StringIO(newline="")
+    writer = csv.writer(output)
+    writer.writerows(new_rows)
+    if not drop_invalid:
+        return output.getvalue(), report, validation_report, {}, {}
+    return output.getvalue(), report, validation_report, {position: rows[position] for position in invalid}, invalid
+
+
+def parallel_transform_data(old_csv_file_name, new_csv_file_name, workers=None, shard_size=16 * 1024 * 1024,
+                            report=None, quarantine_file_name=None, validation=None):
+    """Version multi-processus de transform_data.
+
+    Le fichier est découpé en plages d'octets alignées sur les fins
+    d'enregistrement (en tenant compte des champs entre guillemets), chaque
+    plage est transformée dans un pool de processus et les résultats sont
+    écrits dans l'ordre d'origine. Le fichier produit est identique à celui
+    de transform_data.
+
+    Parameters
+    ----------
+    old_csv_file_name
+        Nom du fichier CSV à transformer.
+    new_csv_file_name
+        Nom du nouveau fichier CSV.
+    workers
+        Nombre de processus (par défaut, le nombre de cœurs).
+    shard_size
+        Taille approximative, en octets, de chaque plage.
+    report
+        Si précisé, rapport de correction des dates mis à jour (voir dates.py).
+    quarantine_file_name
+        Si précisé, fichier CSV où écrire les lignes invalides (voir
+        stream_transform_data).
+    validation
+        Si précisé, rapport de validation mis à jour (voir validation.py).
+
+    Returns
+    -------
+    int
+        Nombre de plages traitées.
+    """
+    with open(old_csv_file_name, "rb") as infile:
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data_start = _next_record_end(mm, 0)
+            header = next(csv.reader(io.StringIO(mm[:data_start].decode("utf-8"), newline="")))
+            shards = _shard_boundaries(mm, data_start, shard_size)
+
+    new_header, _ = _prepare_header(header)
+    tasks = [(old_csv_file_name, start, end, header, quarantine_file_name is not None) for start, end in shards]
+    dates_report, validation_report = new_report(), new_validation_report()
+    quarantine = None
+
+    def write_shard(chunk, shard_report, shard_validation, quarantined, invalid):
+        outfile.write(chunk)
+        if quarantine is not None:
+            # les plages arrivent dans l'ordre : les lignes déjà validées
+            # donnent le numéro de la première ligne de celle-ci
+            quarantine.write_rows(quarantined, invalid, validation_report["rows"] + 1)
+            shard_validation["quarantined"] = len(invalid)
+        merge_reports(dates_report, shard_report)
+        merge_reports(validation_report, shard_validation)
+
+    # les fichiers sont fermés par l'ExitStack, même en cas d'erreur
+    with stage("parallel_transform") as step, contextlib.ExitStack() as files:
+        outfile = files.enter_context(open(new_csv_file_name, "w", encoding="utf-8", newline=""))
+        if quarantine_file_name is not None:
+            quarantine = files.enter_context(QuarantineWriter(quarantine_file_name, header))
+        csv.writer(outfile).writerow(new_header)
+
+        # un seul morceau : pas besoin de démarrer un pool
+        if len(tasks) <= 1 or workers == 1:
+            for result in map(_transform_shard, tasks):
+                write_shard(*result)
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                # imap conserve l'ordre des plages
+                for result in pool.imap(_transform_shard, tasks):
+                    write_shard(*result)
+        step.rows = dates_report["rows"]
+
+    print_validation_report(validation_report, quarantine_file_name)
+    if validation is not None:
+        merge_reports(validation, validation_report)
+    print_report(dates_report)
+    if report is not None:
+        merge_reports(report, dates_report)
+    return len(tasks)
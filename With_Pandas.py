@@ -1,82 +1,443 @@
+import io
+import mmap
+import os
 import sqlite3
-import utils
+import time
 import csv
 from datetime import datetime
 
+# pandas et numpy ne sont importés que dans les fonctions qui s'en servent :
+# create_database, les requêtes et la CLI n'en paient pas le coût.
+from .CSV import _complete_records_end, _next_record_end, skip_blank_rows
+from .blood_pressure import BP_CATEGORIES, BP_RULES, UNKNOWN_CATEGORY, categorize_blood_pressure
+from .columnar import write_columnar
+from .connection import get_db_connexion, close_db_connexion
+from .dates import correct_dates_dataframe, merge_reports, new_report, print_report
+from .metrics import stage
+from .summaries import SUMMARY_QUERIES, SUMMARY_TABLES, SUMMARY_TRIGGERS
+from .validation import (INT_DIGITS_PATTERN, REASON_SEPARATOR, QuarantineWriter, is_int, new_validation_report,
+                         print_validation_report, validate_dataframe)
 
-def get_db_connexion():
-    # Loads the app config into the dictionary app_config.
-    app_config = utils.load_config()
+# validation.BP_PATTERN, avec les chiffres de chaque côté du "/" capturés
+BP_PATTERN = rf"^\s*({INT_DIGITS_PATTERN})\s*/\s*({INT_DIGITS_PATTERN})\s*$"
 
-    if not app_config:
-        print("Error: while loading the app configuration")
-        return None
 
-    # From the configuration, gets the path to the database file.
-    db_file = app_config["db"]
+def split_blood_pressure(bp_series):
+    """Split a "systolic/diastolic" Series into two numeric Series.
 
-    # Open a connection to the database.
-    conn = sqlite3.connect(db_file)
-    conn.row_factory = sqlite3.Row
+    Parameters
+    ----------
+    bp_series
+        The Blood_Pressure column.
 
-    return conn
+    Returns
+    -------
+    tuple of Series
+        The systolic and diastolic values, NaN where the value is malformed.
+    """
+    parts = bp_series.astype(str).str.extract(BP_PATTERN)
+    systolic = parts[0].str.replace("_", "", regex=False).astype(float)
+    diastolic = parts[1].str.replace("_", "", regex=False).astype(float)
+    return systolic, diastolic
 
 
-def close_db_connexion(cursor, conn):
-    """Close a database connexion and the cursor.
+def categorize_blood_pressure_series(bp_series):
+    """Vectorized version of categorize_blood_pressure.
 
     Parameters
     ----------
-    cursor
-        The object used to query the database.
-    conn
-        The object used to manage the database connection.
+    bp_series
+        The Blood_Pressure column.
+
+    Returns
+    -------
+    Series
+        The AHA category of each value, "Unknown" for malformed values.
     """
-    cursor.close()
-    conn.close()
+    import numpy as np
+    import pandas as pd
 
-import pandas as pd
-from datetime import datetime
+    systolic, diastolic = split_blood_pressure(bp_series)
+    systolic, diastolic = systolic.to_numpy(), diastolic.to_numpy()
+
+    # NaN ne vérifie aucune règle : les valeurs invalides tombent sur "Unknown"
+    conditions = [rule(systolic, diastolic) for _, rule in BP_RULES]
+    labels = [label for label, _ in BP_RULES]
+    categories = np.select(conditions, labels, default=UNKNOWN_CATEGORY)
+    return pd.Series(categories, index=bp_series.index)
+
+
+# Schéma d'ingestion : types explicites des colonnes du CSV (d'origine ou
+# transformé). Les colonnes absentes du fichier sont ignorées, les autres
+# gardent le type déduit par pandas.
+
+# "24 weeks" -> 24, "147 bpm" -> 147
+UNIT_COLUMNS = {"Gestational_Age": "Int16", "Fetal_Heart_Rate": "Int16"}
+
+# Yes/No, Concerns/Stable -> 1/0
+FLAG_COLUMNS = {
+    "Anomaly": {"No": 0, "Yes": 1},
+    "Maternal_Mental_Health": {"Stable": 0, "Concerns": 1},
+}
+
+CATEGORY_COLUMNS = ["Hospital_Name", "Mother_Blood_Type", "Delivery_Type", "Baby_Gender", "BP_Category"]
+
+DATE_COLUMNS = ["Date_of_Birth", "Last_Checkup_Date", "User_Registration_Date", "Delivery_Date", "Reminder_Date"]
+
+NUMERIC_COLUMNS = {
+    "Age": "Int8",
+    "Weight(kg)": "float64",
+    "No_of_Checkups": "Int16",
+    "No_of_Missed_Checkups": "Int16",
+    "Checkup": "Int16",
+}
+
+
+# Tables de codes des colonnes de type énuméré : id (code stocké) -> label.
+# Les valeurs listées ont des codes fixes (leur position + 1), les autres
+# sont ajoutées au chargement, dans l'ordre de première apparition.
+LOOKUP_TABLES = {
+    "BPCategory": BP_CATEGORIES,
+    "BloodType": [],
+    "DeliveryType": [],
+    "Gender": [],
+}
+
+
+# Tables Woman, Pregnancy et Checkup des bases créées avant les tables *Data,
+# recopiées par create_database : table -> (colonnes à coder dans les
+# tables de codes, copie des lignes dans la table *Data). Les tensions qui
+# ne s'écrivent pas exactement "systolic/diastolic" restent en texte dans
+# blood_pressure_raw.
+LEGACY_TABLES = {
+    "Woman": ([("BloodType", "blood_type")], """
+        INSERT INTO WomanData(id, name, birth_date, blood_type_id, hospital_id)
+        SELECT Woman.id, Woman.name, Woman.birth_date, BloodType.id, Woman.hospital_id
+        FROM Woman
+        LEFT JOIN BloodType ON BloodType.label = Woman.blood_type;
+    """),
+
+    "Pregnancy": ([("Gender", "baby_gender"), ("DeliveryType", "delivery_type")], """
+        INSERT INTO PregnancyData(id, woman_id, analyst_id, first_registration_date, delivery_date,
+            baby_gender_id, delivery_type_id, number_of_checkups, number_of_missed_checkups)
+        SELECT Pregnancy.id, Pregnancy.woman_id, Pregnancy.analyst_id, Pregnancy.first_registration_date,
+            Pregnancy.delivery_date, Gender.id, DeliveryType.id, Pregnancy.number_of_checkups,
+            Pregnancy.number_of_missed_checkups
+        FROM Pregnancy
+        LEFT JOIN Gender ON Gender.label = Pregnancy.baby_gender
+        LEFT JOIN DeliveryType ON DeliveryType.label = Pregnancy.delivery_type;
+    """),
+
+    "Checkup": ([("BPCategory", "bp_category")], """
+        INSERT INTO CheckupData(id, pregnancy_id, date, time, weight, systolic, diastolic, blood_pressure_raw,
+            gestational_age, fetal_heart_rate, anomaly_presence, maternal_mental_health, bp_category_id)
+        SELECT id, pregnancy_id, date, time, weight,
+            CASE WHEN blood_pressure IS systolic || '/' || diastolic THEN systolic END,
+            CASE WHEN blood_pressure IS systolic || '/' || diastolic THEN diastolic END,
+            CASE WHEN blood_pressure IS NOT systolic || '/' || diastolic THEN blood_pressure END,
+            gestational_age, fetal_heart_rate, anomaly_presence, maternal_mental_health, bp_category_id
+        FROM (
+            SELECT Checkup.*, BPCategory.id AS bp_category_id,
+                CASE WHEN instr(blood_pressure, '/') > 0
+                    THEN CAST(substr(blood_pressure, 1, instr(blood_pressure, '/') - 1) AS INTEGER)
+                END AS systolic,
+                CAST(substr(blood_pressure, instr(blood_pressure, '/') + 1) AS INTEGER) AS diastolic
+            FROM Checkup
+            LEFT JOIN BPCategory ON BPCategory.label = Checkup.bp_category
+        );
+    """),
+}
+
+
+def _legacy_tables(cursor):
+    """Return the tables of LEGACY_TABLES the database still has as tables
+    (not as views), in the order of LEGACY_TABLES.
+
+    Raises
+    ------
+    RuntimeError
+        If the database also has rows in the *Data tables.
+    """
+    tables = {name for (name,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    legacy = [table for table in LEGACY_TABLES if table in tables]
+    filled = [f"{table}Data" for table in LEGACY_TABLES
+              if f"{table}Data" in tables and cursor.execute(f"SELECT 1 FROM {table}Data LIMIT 1").fetchone()]
+    if legacy and filled:
+        raise RuntimeError(f"The database has both the legacy tables {', '.join(legacy)} and rows in "
+                           f"{', '.join(filled)}: it can't be migrated, rebuild it from the CSV files")
+    return legacy
+
+
+def _migrate_legacy_tables(cursor, legacy):
+    """Copy the rows of the legacy tables into the *Data tables, drop the
+    legacy tables (with their indexes and triggers) and recompute the
+    summary tables. Run in the transaction of create_database, before the
+    views, indexes and triggers are created."""
+    for table in legacy:
+        lookups, copy = LEGACY_TABLES[table]
+        for lookup, column in lookups:
+            # Labels absents des codes fixes, dans l'ordre de première apparition
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO {lookup}(label)
+                SELECT NULLIF({column}, '') AS label FROM {table}
+                WHERE label IS NOT NULL
+                GROUP BY label
+                ORDER BY MIN(id)
+            """)
+        print(f"Migrating table {table} to {table}Data...", end=" ")
+        cursor.execute(copy)
+        print("OK")
+    for table in reversed(legacy):
+        cursor.execute(f"DROP TABLE {table}")
+    for table, sql in SUMMARY_QUERIES.items():
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"INSERT INTO {table} {sql}")
+
+
+def read_typed_csv(csv_file_name):
+    """Read a pregnancies CSV file with the ingest schema.
+
+    Units and Yes/No flags are parsed into small integer dtypes, the
+    low-cardinality text columns become categoricals and the dates become
+    datetime64. Values that can't be parsed become missing values (<NA> or
+    NaT) instead of raising.
+
+    Parameters
+    ----------
+    csv_file_name
+        Name of the CSV file (or a file-like object).
+
+    Returns
+    -------
+    DataFrame
+        The typed DataFrame.
+    """
+    import pandas as pd
+
+    return _apply_schema(pd.read_csv(csv_file_name, dtype=_ingest_dtypes()))
+
+
+def iter_typed_csv(csv_file_name, chunk_size=100000):
+    """Read a pregnancies CSV file with the ingest schema, chunk_size rows at a time.
+
+    Parameters
+    ----------
+    csv_file_name
+        Name of the CSV file (or a file-like object).
+    chunk_size
+        Number of rows of each DataFrame.
+
+    Yields
+    ------
+    DataFrame
+        The typed DataFrames (see read_typed_csv).
+    """
+    import pandas as pd
+
+    with pd.read_csv(csv_file_name, dtype=_ingest_dtypes(), chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield _apply_schema(chunk)
+
+
+def _ingest_dtypes():
+    """dtypes given to read_csv: the columns parsed afterwards are read as text."""
+    text_columns = [*UNIT_COLUMNS, *FLAG_COLUMNS, *DATE_COLUMNS, *NUMERIC_COLUMNS]
+    dtypes = {col: "category" for col in CATEGORY_COLUMNS}
+    dtypes.update({col: "string" for col in text_columns})
+    return dtypes
+
+
+def _to_numeric(values, dtype):
+    """Parse text values into dtype, <NA> where they can't be parsed.
+
+    For the integer dtypes, values that are not integers (25.5) or do not
+    fit in the dtype (300 for Int8) also become <NA>, instead of being
+    truncated or wrapped around by astype.
+    """
+    import numpy as np
+    import pandas as pd
+
+    numbers = pd.to_numeric(values, errors="coerce")
+    if pd.api.types.is_integer_dtype(dtype):
+        info = np.iinfo(dtype.lower())
+        valid = ((numbers % 1 == 0) & numbers.between(info.min, info.max)).fillna(False).astype(bool)
+        numbers = numbers.where(valid)
+    return numbers.astype(dtype)
 
-def categorize_blood_pressure(bp_value):
-    try:
-        systolic, diastolic = map(int, str(bp_value).split("/"))
-    except:
-        return "Unknown"
-
-    if systolic > 180 or diastolic > 120:
-        return "Hypertensive Crisis"
-    elif systolic >= 140 or diastolic >= 90:
-        return "Hypertension Stage 2"
-    elif systolic >= 130 or diastolic >= 80:
-        return "Hypertension Stage 1"
-    elif systolic >= 120 and diastolic < 80:
-        return "Elevated"
-    elif systolic < 120 and diastolic < 80:
-        return "Normal"
-    else:
-        return "Unknown"
-
-def transform_data(old_csv_file_name, new_csv_file_name):
-    # Lire le CSV
-    df = pd.read_csv(old_csv_file_name)
 
+def _apply_schema(df):
+    """Parse the text columns of a DataFrame read with _ingest_dtypes()."""
+    import pandas as pd
+
+    for col, dtype in UNIT_COLUMNS.items():
+        if col in df:
+            number = df[col].str.extract(r"^\s*(\d+)", expand=False)
+            df[col] = _to_numeric(number, dtype)
+
+    for col, codes in FLAG_COLUMNS.items():
+        if col in df:
+            df[col] = df[col].str.strip().map(codes).astype("Int8")
+
+    for col in DATE_COLUMNS:
+        if col in df:
+            df[col] = pd.to_datetime(df[col], format="%Y-%m-%d", errors="coerce")
+
+    for col, dtype in NUMERIC_COLUMNS.items():
+        if col in df:
+            df[col] = _to_numeric(df[col], dtype)
+
+    return df
+
+
+def checkup_column(checkups, missed_checkups):
+    """Compute No_of_Checkups - No_of_Missed_Checkups.
+
+    Numeric columns (see read_typed_csv) are simply subtracted. Text columns
+    (read as is by transform_data) give the text of the difference, or ""
+    where one of the values is not an integer for int(), like the CSV
+    engine.
+
+    Returns
+    -------
+    Series
+        The Checkup column.
+    """
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(checkups) and pd.api.types.is_numeric_dtype(missed_checkups):
+        return checkups - missed_checkups
+
+    checkups, missed_checkups = checkups.fillna("").astype(str), missed_checkups.fillna("").astype(str)
+    # Cas courant vectorisé : des chiffres seulement, sans débordement de int64
+    simple = (checkups.str.fullmatch(r"\d{1,18}") & missed_checkups.str.fullmatch(r"\d{1,18}")).to_numpy()
+    result = pd.Series("", index=checkups.index, dtype=object)
+    result[simple] = (checkups[simple].astype("int64") - missed_checkups[simple].astype("int64")).astype(str)
+
+    # Les autres valeurs (signes, espaces, "_"...) passent par int(), si elles
+    # sont valides (voir validation.py) : pas d'exception par valeur invalide
+    for position in (~simple).nonzero()[0]:
+        checkup, missed_checkup = checkups.iat[position], missed_checkups.iat[position]
+        if is_int(checkup) and is_int(missed_checkup):
+            result.iat[position] = str(int(checkup) - int(missed_checkup))
+    return result
+
+
+def transform_dataframe(df, report=None, stages=None):
+    """Apply the transformation of transform_data to a DataFrame read from the
+    original CSV file.
+
+    Parameters
+    ----------
+    df
+        The DataFrame of the original CSV file.
+    report
+        If given, a date correction report updated with the counts (see
+        dates.py).
+    stages
+        If given, dict where the time of each stage is added (see
+        metrics.stage).
+
+    Returns
+    -------
+    DataFrame
+        The transformed DataFrame.
+    """
     # Calculer la colonne Checkup
-    df["Checkup"] = df["No_of_Checkups"] - df["No_of_Missed_Checkups"]
+    df["Checkup"] = checkup_column(df["No_of_Checkups"], df["No_of_Missed_Checkups"])
 
     # Supprimer les colonnes inutiles
     df = df.drop(columns=["Reminder_Date", "Gender", "No_of_Checkups", "No_of_Missed_Checkups"])
 
     # Corriger les dates si User_Registration_Date > Last_Checkup_Date
-    wrong_dates_mask = df["User_Registration_Date"] > df["Last_Checkup_Date"]
-    df.loc[wrong_dates_mask, ["User_Registration_Date", "Last_Checkup_Date"]] = df.loc[wrong_dates_mask, ["Last_Checkup_Date", "User_Registration_Date"]].values
-    df.loc[wrong_dates_mask, ["User_Registration_Time", "Last_Checkup_Time"]] = df.loc[wrong_dates_mask, ["Last_Checkup_Time", "User_Registration_Time"]].values
+    dates_report = new_report()
+    with stage("date_fix", len(df), stages):
+        correct_dates_dataframe(df, dates_report)
+    print_report(dates_report)
+    if report is not None:
+        merge_reports(report, dates_report)
 
     # Ajouter la colonne BP_Category
-    df["BP_Category"] = df["Blood_Pressure"].apply(categorize_blood_pressure)
+    with stage("categorize", len(df), stages):
+        df["BP_Category"] = categorize_blood_pressure_series(df["Blood_Pressure"])
+
+    return df
+
+
+def read_text_csv(csv_file_name):
+    """Read a raw export as text, every value as is ("n/a" stays "n/a").
+
+    The records are split by csv.reader, like in the CSV engines, rather
+    than by read_csv, which raises ParserError on a row with more fields
+    than the header: the rows with too few fields are padded with empty
+    strings, the rows with too many fields are truncated and the blank lines
+    are skipped, as CSV.transform_data does.
+
+    Parameters
+    ----------
+    csv_file_name
+        Name of the raw CSV file.
+
+    Returns
+    -------
+    tuple
+        The DataFrame, and a dict position -> row as read of the rows whose
+        number of fields differs from the header.
+    """
+    import pandas as pd
+
+    with open(csv_file_name, "r", encoding="utf-8", newline="") as infile:
+        reader = csv.reader(infile)
+        header = next(reader)
+        rows = list(skip_blank_rows(reader))
+
+    nb_fields = len(header)
+    ragged = {position: row for position, row in enumerate(rows) if len(row) != nb_fields}
+    for position, row in ragged.items():
+        rows[position] = (row + [""] * nb_fields)[:nb_fields]
+    return pd.DataFrame(rows, columns=header, dtype=str), ragged
+
+
+def transform_data(old_csv_file_name, new_csv_file_name, columnar_dir=None, report=None,
+                   quarantine_file_name=None, validation=None):
+    # Lire le CSV en texte, sans valeurs manquantes : chaque valeur est
+    # réécrite telle quelle ("n/a" reste "n/a", 10 ne devient pas 10.0), et le
+    # fichier produit est identique à celui de CSV.transform_data.
+    with stage("read") as step:
+        df, ragged = read_text_csv(old_csv_file_name)
+        step.rows = len(df)
+
+    # Valider toutes les lignes avec des masques vectorisés (voir validation.py)
+    with stage("validate", len(df)):
+        validation_report = new_validation_report()
+        reasons = validate_dataframe(df, validation_report, list(ragged))
+
+    # Mettre les lignes invalides en quarantaine, si demandé, avec le même
+    # writer que CSV.transform_data (les lignes irrégulières telles que lues)
+    if quarantine_file_name is not None:
+        invalid = (reasons != "").to_numpy()
+        positions = invalid.nonzero()[0].tolist()
+        rows = dict(zip(positions, df[invalid].itertuples(index=False, name=None)))
+        rows.update((position, row) for position, row in ragged.items() if position in rows)
+        with QuarantineWriter(quarantine_file_name, list(df.columns)) as quarantine:
+            quarantine.write_rows(rows, {position: reasons.iat[position].split(REASON_SEPARATOR)
+                                         for position in positions})
+        validation_report["quarantined"] = len(positions)
+        df = df[~invalid].reset_index(drop=True)
+    print_validation_report(validation_report, quarantine_file_name)
+    if validation is not None:
+        merge_reports(validation, validation_report)
+
+    df = transform_dataframe(df, report)
 
     # Sauvegarder le CSV
-    df.to_csv(new_csv_file_name, index=False)
+    with stage("write", len(df)):
+        df.to_csv(new_csv_file_name, index=False, lineterminator="\r\n")
+
+    # Cache binaire en colonnes, si demandé (valeurs texte, comme dans le CSV)
+    if columnar_dir is not None:
+        with stage("write_columnar", len(df)):
+            rows = df.astype(object).where(df.notna(), "").astype(str).itertuples(index=False, name=None)
+            write_columnar(columnar_dir, list(df.columns), rows)
 
 def create_database(cursor, conn):
     """Creates the Pregnancies 2023 database
@@ -88,11 +449,22 @@ def create_database(cursor, conn):
     conn
         The object used to manage the database connection.
 
+    The tables Woman, Pregnancy and Checkup of a database created before
+    the *Data tables are migrated: their rows are copied into the *Data
+    tables and the tables are replaced by the views of the same name.
+
     Returns
     -------
     bool
         True if the database could be created, False otherwise.
+
+    Raises
+    ------
+    RuntimeError
+        If the database holds both legacy tables and rows in the *Data
+        tables: neither can be trusted, the file must be rebuilt.
     """
+    legacy = _legacy_tables(cursor)
 
     # We open a transaction.
     # A transaction is a sequence of read/write statements that
@@ -141,48 +513,130 @@ def create_database(cursor, conn):
             );
         """,
 
-        "Woman": """
-            CREATE TABLE IF NOT EXISTS Woman(
+        **{
+            table: f"""
+                CREATE TABLE IF NOT EXISTS {table}(
+                    id INTEGER PRIMARY KEY,
+                    label TEXT UNIQUE NOT NULL
+                );
+            """
+            for table in LOOKUP_TABLES
+        },
+
+        "WomanData": """
+            CREATE TABLE IF NOT EXISTS WomanData(
                 id INTEGER PRIMARY KEY,
                 name TEXT,
                 birth_date TEXT,
-                blood_type TEXT,
+                blood_type_id INTEGER,
                 hospital_id INTEGER,
+                FOREIGN KEY(blood_type_id) REFERENCES BloodType(id),
                 FOREIGN KEY(hospital_id) REFERENCES Hospital(id)
             );
         """,
 
-        "Pregnancy": """
-            CREATE TABLE IF NOT EXISTS Pregnancy(
+        "PregnancyData": """
+            CREATE TABLE IF NOT EXISTS PregnancyData(
                 id INTEGER PRIMARY KEY,
                 woman_id INTEGER,
                 analyst_id INTEGER,
                 first_registration_date TEXT,
                 delivery_date TEXT,
-                baby_gender TEXT,
-                delivery_type TEXT,
+                baby_gender_id INTEGER,
+                delivery_type_id INTEGER,
                 number_of_checkups INTEGER,
                 number_of_missed_checkups INTEGER,
-                FOREIGN KEY(woman_id) REFERENCES Woman(id),
-                FOREIGN KEY(analyst_id) REFERENCES Analyst(id)
+                FOREIGN KEY(woman_id) REFERENCES WomanData(id),
+                FOREIGN KEY(analyst_id) REFERENCES Analyst(id),
+                FOREIGN KEY(baby_gender_id) REFERENCES Gender(id),
+                FOREIGN KEY(delivery_type_id) REFERENCES DeliveryType(id)
             );
         """,
 
-        "Checkup": """
-            CREATE TABLE IF NOT EXISTS Checkup(
+        # La tension est stockée en deux entiers. blood_pressure_raw ne garde
+        # le texte d'origine que s'il diffère de "systolic/diastolic"
+        # (valeur mal formée ou mal écrite), il est NULL sinon.
+        "CheckupData": """
+            CREATE TABLE IF NOT EXISTS CheckupData(
                 id INTEGER PRIMARY KEY,
                 pregnancy_id INTEGER,
                 date TEXT,
                 time TEXT,
                 weight REAL,
-                blood_pressure TEXT,
+                systolic INTEGER,
+                diastolic INTEGER,
+                blood_pressure_raw TEXT,
                 gestational_age INTEGER,
                 fetal_heart_rate INTEGER,
                 anomaly_presence INTEGER,
                 maternal_mental_health INTEGER,
-                FOREIGN KEY(pregnancy_id) REFERENCES Pregnancy(id)
+                bp_category_id INTEGER,
+                FOREIGN KEY(pregnancy_id) REFERENCES PregnancyData(id),
+                FOREIGN KEY(bp_category_id) REFERENCES BPCategory(id)
+            );
+        """,
+
+        # Suivi de l'ingestion incrémentale : octet jusqu'où chaque export a été lu
+        "Ingestion": """
+            CREATE TABLE IF NOT EXISTS Ingestion(
+                source TEXT PRIMARY KEY,
+                byte_offset INTEGER,
+                ingested_at TEXT
             );
-        """
+        """,
+
+        # Agrégats maintenus par des triggers (voir summaries.py)
+        **SUMMARY_TABLES,
+    }
+
+    # Indexes of the foreign keys used by the joins and lookups of the
+    # application (see queries.QUERIES). The index on WomanData(hospital_id)
+    # also covers the per-hospital pregnancy count, with the rowid as WomanData.id.
+    indexes = {
+        "idx_woman_hospital": "CREATE INDEX IF NOT EXISTS idx_woman_hospital ON WomanData(hospital_id);",
+        "idx_pregnancy_woman": "CREATE INDEX IF NOT EXISTS idx_pregnancy_woman ON PregnancyData(woman_id);",
+        "idx_pregnancy_analyst": "CREATE INDEX IF NOT EXISTS idx_pregnancy_analyst ON PregnancyData(analyst_id);",
+        "idx_checkup_pregnancy": "CREATE INDEX IF NOT EXISTS idx_checkup_pregnancy ON CheckupData(pregnancy_id);",
+        "idx_checkup_bp_category": "CREATE INDEX IF NOT EXISTS idx_checkup_bp_category ON CheckupData(bp_category_id);",
+        "idx_checkup_systolic": "CREATE INDEX IF NOT EXISTS idx_checkup_systolic ON CheckupData(systolic);",
+    }
+
+    # The former tables Woman, Pregnancy and Checkup are views over the
+    # *Data tables, with the text columns of the former schema ("120/80",
+    # "Normal", "A+", ...) for the code that reads them. The writes go to the
+    # *Data tables.
+    views = {
+        "Woman": """
+            CREATE VIEW IF NOT EXISTS Woman AS
+            SELECT WomanData.id, WomanData.name, WomanData.birth_date, BloodType.label AS blood_type,
+                WomanData.hospital_id
+            FROM WomanData
+            LEFT JOIN BloodType ON BloodType.id = WomanData.blood_type_id;
+        """,
+
+        "Pregnancy": """
+            CREATE VIEW IF NOT EXISTS Pregnancy AS
+            SELECT PregnancyData.id, PregnancyData.woman_id, PregnancyData.analyst_id,
+                PregnancyData.first_registration_date, PregnancyData.delivery_date,
+                Gender.label AS baby_gender, DeliveryType.label AS delivery_type,
+                PregnancyData.number_of_checkups, PregnancyData.number_of_missed_checkups
+            FROM PregnancyData
+            LEFT JOIN Gender ON Gender.id = PregnancyData.baby_gender_id
+            LEFT JOIN DeliveryType ON DeliveryType.id = PregnancyData.delivery_type_id;
+        """,
+
+        # bp_category en dernière colonne, après celles de l'ancienne table
+        "Checkup": """
+            CREATE VIEW IF NOT EXISTS Checkup AS
+            SELECT CheckupData.id, CheckupData.pregnancy_id, CheckupData.date, CheckupData.time,
+                CheckupData.weight,
+                COALESCE(CheckupData.blood_pressure_raw, CheckupData.systolic || '/' || CheckupData.diastolic)
+                    AS blood_pressure,
+                CheckupData.gestational_age, CheckupData.fetal_heart_rate, CheckupData.anomaly_presence,
+                CheckupData.maternal_mental_health, BPCategory.label AS bp_category
+            FROM CheckupData
+            LEFT JOIN BPCategory ON BPCategory.id = CheckupData.bp_category_id;
+        """,
     }
 
     try:
@@ -195,6 +649,31 @@ def create_database(cursor, conn):
             cursor.execute(tables[tablename])
             print("OK")
 
+        # Codes fixes des tables de codes
+        for table, labels in LOOKUP_TABLES.items():
+            cursor.executemany(f"INSERT OR IGNORE INTO {table}(id, label) VALUES(?,?)",
+                               list(enumerate(labels, start=1)))
+
+        # Anciennes tables remplacées par les vues, avant la création des
+        # index, dont certains portaient déjà leur nom
+        if legacy:
+            _migrate_legacy_tables(cursor, legacy)
+
+        for indexname in indexes:
+            print(f"Creating index {indexname}...", end=" ")
+            cursor.execute(indexes[indexname])
+            print("OK")
+
+        for viewname in views:
+            print(f"Creating view {viewname}...", end=" ")
+            cursor.execute(views[viewname])
+            print("OK")
+
+        for triggername in SUMMARY_TRIGGERS:
+            print(f"Creating trigger {triggername}...", end=" ")
+            cursor.execute(SUMMARY_TRIGGERS[triggername])
+            print("OK")
+
     ###################################################################
 
     # Exception raised when something goes wrong while creating the tables.
@@ -213,9 +692,231 @@ def create_database(cursor, conn):
     return True
 
 
-def populate_database(cursor, conn, csv_file_name):
+def _insert_batches(cursor, query, rows, batch_size):
+    """Insert rows with executemany, batch_size rows at a time.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    query
+        The INSERT statement, with one placeholder per column.
+    rows
+        The list of tuples to insert.
+    batch_size
+        Number of rows sent to each executemany call.
+
+    Returns
+    -------
+    int
+        Number of rows inserted.
+    """
+    for start in range(0, len(rows), batch_size):
+        cursor.executemany(query, rows[start:start + batch_size])
+    return len(rows)
+
+
+def _next_id(cursor, table):
+    """Return the first free id of a table."""
+    return cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+
+def _column(df, name):
+    """Return a DataFrame column as a list of Python values (NaN -> None).
+
+    Dates are converted back to ISO "YYYY-MM-DD" strings, as stored in the
+    database.
+    """
+    import pandas as pd
+
+    column = df[name]
+    if pd.api.types.is_datetime64_any_dtype(column):
+        column = column.dt.strftime("%Y-%m-%d")
+    return column.astype(object).where(column.notna(), None).tolist()
+
+
+def _lookup_codes(cursor, table, labels):
+    """Get the codes of labels in a lookup table, adding the missing labels.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    table
+        The lookup table, a key of LOOKUP_TABLES.
+    labels
+        The list of labels (None for a missing value).
+
+    Returns
+    -------
+    list
+        The code of each label (None for a missing value).
+    """
+    codes = {label: id for id, label in cursor.execute(f"SELECT id, label FROM {table}")}
+    next_code = _next_id(cursor, table)
+    new_labels = []
+    for label in dict.fromkeys(labels):
+        if label is not None and label not in codes:
+            codes[label] = next_code
+            new_labels.append((next_code, label))
+            next_code += 1
+    cursor.executemany(f"INSERT INTO {table}(id, label) VALUES(?,?)", new_labels)
+    return [codes.get(label) for label in labels]
+
+
+def _blood_pressure_columns(bp_series):
+    """Split a Blood_Pressure column into the values stored in CheckupData.
+
+    Returns
+    -------
+    tuple of lists
+        The systolic and diastolic integers (None if malformed) and the raw
+        text, kept only where it differs from "systolic/diastolic".
+    """
+    systolic, diastolic = (values.astype("Int64") for values in split_blood_pressure(bp_series))
+    canonical = systolic.astype(str) + "/" + diastolic.astype(str)
+    raw = bp_series.where(systolic.isna() | (bp_series.astype(str) != canonical))
+    return (
+        systolic.astype(object).where(systolic.notna(), None).tolist(),
+        diastolic.astype(object).where(diastolic.notna(), None).tolist(),
+        raw.astype(object).where(raw.notna(), None).tolist(),
+    )
+
+
+def _load_dataframe(cursor, df, batch_size, stages=None):
+    """Insert the rows of a transformed DataFrame in the database.
+
+    Hospital names are deduplicated up front, the ids of the new rows are
+    assigned in memory and each table is filled with batched executemany
+    calls. Blood pressures are split into integers and the enum-like
+    columns are stored as codes of the lookup tables. The caller is
+    responsible for the transaction.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    df
+        The transformed DataFrame.
+    batch_size
+        Number of rows sent to the database in each executemany call.
+    stages
+        If given, dict where the time of the insertion in each table is
+        added (see metrics.stage).
+
+    Returns
+    -------
+    dict
+        The number of rows inserted in each table.
+    """
+    import pandas as pd
+
+    nb_rows = len(df)
+
+    # --- Hospital --- : noms dédupliqués, ids attribués en mémoire
+    hospital_ids = {name: id for id, name in cursor.execute("SELECT id, name FROM Hospital")}
+    next_hospital_id = _next_id(cursor, "Hospital")
+    new_hospitals = []
+    for hospital_name in pd.unique(df["Hospital_Name"]).tolist():
+        if hospital_name not in hospital_ids:
+            hospital_ids[hospital_name] = next_hospital_id
+            new_hospitals.append((next_hospital_id, hospital_name))
+            next_hospital_id += 1
+
+    # Une femme, une grossesse et un checkup par ligne : ids consécutifs
+    first_woman_id = _next_id(cursor, "WomanData")
+    first_pregnancy_id = _next_id(cursor, "PregnancyData")
+    first_checkup_id = _next_id(cursor, "CheckupData")
+    woman_ids = range(first_woman_id, first_woman_id + nb_rows)
+    pregnancy_ids = range(first_pregnancy_id, first_pregnancy_id + nb_rows)
+    checkup_ids = range(first_checkup_id, first_checkup_id + nb_rows)
+
+    # --- Woman ---
+    women = list(zip(
+        woman_ids,
+        _column(df, "Name"),
+        _column(df, "Date_of_Birth"),
+        _lookup_codes(cursor, "BloodType", _column(df, "Mother_Blood_Type")),
+        [hospital_ids[name] for name in df["Hospital_Name"].tolist()],
+    ))
+
+    # --- Pregnancy ---
+    analyst_id = 1  # simplification si un seul analyst
+    pregnancies = list(zip(
+        pregnancy_ids,
+        woman_ids,
+        [analyst_id] * nb_rows,
+        _column(df, "User_Registration_Date"),
+        _column(df, "Delivery_Date"),
+        _lookup_codes(cursor, "Gender", _column(df, "Baby_Gender")),
+        _lookup_codes(cursor, "DeliveryType", _column(df, "Delivery_Type")),
+        _column(df, "Checkup"),
+    ))
+
+    # --- Checkup ---
+    systolic, diastolic, blood_pressure_raw = _blood_pressure_columns(df["Blood_Pressure"])
+    checkups = list(zip(
+        checkup_ids,
+        pregnancy_ids,
+        _column(df, "Last_Checkup_Date"),
+        _column(df, "Last_Checkup_Time"),
+        _column(df, "Weight(kg)"),
+        systolic,
+        diastolic,
+        blood_pressure_raw,
+        _column(df, "Gestational_Age"),
+        _column(df, "Fetal_Heart_Rate"),
+        _column(df, "Anomaly"),
+        _column(df, "Maternal_Mental_Health"),
+        _lookup_codes(cursor, "BPCategory", _column(df, "BP_Category")),
+    ))
+
+    inserts = [
+        ("hospitals", "Hospital", "INSERT INTO Hospital(id, name) VALUES(?,?)", new_hospitals),
+        ("women", "WomanData", """
+            INSERT INTO WomanData(id, name, birth_date, blood_type_id, hospital_id)
+            VALUES(?,?,?,?,?)
+        """, women),
+        ("pregnancies", "PregnancyData", """
+            INSERT INTO PregnancyData(
+                id, woman_id, analyst_id, first_registration_date, delivery_date,
+                baby_gender_id, delivery_type_id, number_of_checkups
+            )
+            VALUES(?,?,?,?,?,?,?,?)
+        """, pregnancies),
+        ("checkups", "CheckupData", """
+            INSERT INTO CheckupData(
+                id, pregnancy_id, date, time, weight, systolic, diastolic, blood_pressure_raw,
+                gestational_age, fetal_heart_rate, anomaly_presence, maternal_mental_health, bp_category_id
+            )
+            VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)
+        """, checkups),
+    ]
+    counts = {}
+    for name, table, query, rows in inserts:
+        with stage(f"insert.{table}", len(rows), stages):
+            counts[name] = _insert_batches(cursor, query, rows, batch_size)
+    return counts
+
+
+def _ingest_report(report, nb_rows, start_time, stages=None):
+    """Complete a load report with the number of rows, the throughput and
+    the time of each stage."""
+    elapsed = time.perf_counter() - start_time
+    report["rows"] = nb_rows
+    report["seconds"] = elapsed
+    report["rows_per_second"] = nb_rows / elapsed if elapsed > 0 else float("inf")
+    if stages is not None:
+        report["stages"] = stages
+    return report
+
+
+def populate_database(cursor, conn, csv_file_name, batch_size=10000):
     """Populate the database with data in a CSV file.
 
+    The whole file is loaded in one transaction with batched executemany
+    calls (see _load_dataframe).
+
     Parameters
     ----------
     cursor
@@ -224,94 +925,225 @@ def populate_database(cursor, conn, csv_file_name):
         The object used to manage the database connection.
     csv_file_name
         Name of the CSV file where the data are.
+    batch_size
+        Number of rows sent to the database in each executemany call.
 
     Returns
     -------
-    bool
-        True if the database is correctly populated, False otherwise.
+    dict or bool
+        A report with the number of rows inserted per table, the elapsed time,
+        the throughput and the time and rows of each stage ("stages") if the
+        database is correctly populated, False otherwise.
     """
+    start_time = time.perf_counter()
+    stages = {}
     try:
-        df = pd.read_csv(csv_file_name)
-
-        # Dictionnaire pour stocker hospital_name -> id
-        hospital_ids = {}
-
-        for _, row in df.iterrows():
-            # --- Hospital ---
-            hospital_name = row["Hospital_Name"]
-            if hospital_name not in hospital_ids:
-                cursor.execute("INSERT OR IGNORE INTO Hospital(name) VALUES(?)", (hospital_name,))
-                hospital_ids[hospital_name] = cursor.lastrowid or cursor.execute("SELECT id FROM Hospital WHERE name=?", (hospital_name,)).fetchone()[0] #on récupère l'ID pour en faire une clé étrangère
-
-            hospital_id = hospital_ids[hospital_name]
-
-            # --- Woman ---
-            cursor.execute("""
-                INSERT INTO Woman(name, birth_date, blood_type, hospital_id)
-                VALUES(?,?,?,?)
-            """, (row["Name"], row["Date_of_Birth"], row["Mother_Blood_Type"], hospital_id))
-            woman_id = cursor.lastrowid
-
-            # --- Pregnancy ---
-            analyst_id = 1  # simplification si un seul analyst
-            cursor.execute("""
-                INSERT INTO Pregnancy(
-                    woman_id, analyst_id, first_registration_date, delivery_date,
-                    baby_gender, delivery_type, number_of_checkups
-                )
-                VALUES(?,?,?,?,?,?,?)
-            """, (
-                woman_id, analyst_id,
-                row["User_Registration_Date"],
-                row["Delivery_Date"],
-                row["Baby_Gender"],
-                row["Delivery_Type"],
-                row["Checkup"]
-            ))
-            pregnancy_id = cursor.lastrowid
-
-            # --- Checkup ---
-            cursor.execute("""
-                INSERT INTO Checkup(
-                    pregnancy_id, date, time, weight, blood_pressure,
-                    gestational_age, fetal_heart_rate, anomaly_presence, maternal_mental_health, bp_category
-                )
-                VALUES(?,?,?,?,?,?,?,?,?,?)
-            """, (
-                pregnancy_id,
-                row["Last_Checkup_Date"],
-                row["Last_Checkup_Time"],
-                row["Weight(kg)"],
-                row["Blood_Pressure"],
-                row["Gestational_Age"],
-                row["Fetal_Heart_Rate"],
-                int(row["Anomaly"]),
-                int(row["Maternal_Mental_Health"]),
-                row["BP_Category"]
-            ))
+        with stage("read", stages=stages) as step:
+            df = read_typed_csv(csv_file_name)
+            step.rows = len(df)
 
+        cursor.execute("BEGIN")
+        report = _load_dataframe(cursor, df, batch_size, stages)
         conn.commit()
-        return True
+
+        # Mettre à jour les statistiques utilisées par le planificateur
+        cursor.execute("ANALYZE")
 
     except Exception as e:
         print("Error populating database:", e)
         conn.rollback()
         return False
 
-def init_database():
+    return _ingest_report(report, len(df), start_time, stages)
+
+
+def ingest_incremental(cursor, conn, raw_csv_file_name, batch_size=10000):
+    """Ingest only the rows appended to a raw export since the last run.
+
+    The byte offset up to which each source file has been ingested is kept
+    in the Ingestion table. Only the complete records after this offset are
+    transformed and inserted, and the new offset is saved in the same
+    transaction as the rows, so a failed run can simply be restarted.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    conn
+        The object used to manage the database connection.
+    raw_csv_file_name
+        Name of the original (not transformed) CSV file.
+    batch_size
+        Number of rows sent to the database in each executemany call.
+
+    Returns
+    -------
+    dict or bool
+        A report like the one of populate_database, with the new byte
+        offset, or False if an error occurred.
+    """
+    start_time = time.perf_counter()
+    stages = {}
+    source = os.path.abspath(raw_csv_file_name)
+    try:
+        row = cursor.execute("SELECT byte_offset FROM Ingestion WHERE source = ?", (source,)).fetchone()
+
+        with open(raw_csv_file_name, "rb") as infile:
+            header = infile.readline()
+            offset = row[0] if row else infile.tell()
+            if offset > os.path.getsize(raw_csv_file_name):
+                print(f"Error: {raw_csv_file_name} is smaller than the ingested offset {offset}")
+                return False
+            infile.seek(offset)
+            delta = infile.read()
+
+        # On ne garde que les enregistrements complets (un saut de ligne dans
+        # un champ entre guillemets ne termine rien) : un enregistrement en
+        # cours d'écriture sera ingéré au prochain passage.
+        delta = delta[:_complete_records_end(delta, 0)[0]]
+        new_offset = offset + len(delta)
+
+        cursor.execute("BEGIN")
+        if delta:
+            with stage("read", stages=stages) as step:
+                df = read_typed_csv(io.BytesIO(header + delta))
+                step.rows = len(df)
+            df = transform_dataframe(df, stages=stages)
+            report = _load_dataframe(cursor, df, batch_size, stages)
+            nb_rows = len(df)
+        else:
+            report, nb_rows = {}, 0
+        cursor.execute("""
+            INSERT INTO Ingestion(source, byte_offset, ingested_at) VALUES(?,?,?)
+            ON CONFLICT(source) DO UPDATE SET byte_offset = excluded.byte_offset, ingested_at = excluded.ingested_at
+        """, (source, new_offset, datetime.now().isoformat(timespec="seconds")))
+        conn.commit()
+
+        # Statistiques du planificateur, recalculées seulement si nécessaire
+        cursor.execute("PRAGMA optimize")
+
+    except Exception as e:
+        print("Error during incremental ingestion:", e)
+        conn.rollback()
+        return False
+
+    report["byte_offset"] = new_offset
+    return _ingest_report(report, nb_rows, start_time, stages)
+
+
+def ingest_raw_csv(cursor, conn, raw_csv_file_name, chunk_size=100000, batch_size=10000, progress=None):
+    """Transform and load a raw export, chunk_size rows at a time.
+
+    Only one chunk is in memory at a time. The chunks are cut on record
+    boundaries (a quoted field may hold a newline). Each chunk is loaded in
+    its own transaction, with the byte offset reached in the Ingestion table
+    (as in ingest_incremental), so other writers get the database between
+    two chunks, and an ingestion that failed keeps the chunks already
+    committed: running it again resumes after them.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    conn
+        The object used to manage the database connection.
+    raw_csv_file_name
+        Name of the original (not transformed) CSV file.
+    chunk_size
+        Number of rows transformed at a time.
+    batch_size
+        Number of rows sent to the database in each executemany call.
+    progress
+        If given, function called after each chunk with the number of rows
+        loaded so far.
+
+    Returns
+    -------
+    dict
+        A report like the one of populate_database, with the counts of the
+        date correction (see dates.py) and the new byte offset.
+
+    Raises
+    ------
+    sqlite3.Error, OSError, ValueError
+        If the file can't be read or loaded; the transaction of the current
+        chunk is rolled back.
+    """
+    start_time = time.perf_counter()
+    report, dates_report, stages, nb_rows = {}, new_report(), {}, 0
+    source = os.path.abspath(raw_csv_file_name)
+    try:
+        row = cursor.execute("SELECT byte_offset FROM Ingestion WHERE source = ?", (source,)).fetchone()
+        with open(raw_csv_file_name, "rb") as infile, mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end = _next_record_end(mm, 0)
+            header = mm[:header_end]
+            offset = row[0] if row else header_end
+            while True:
+                with stage("read", stages=stages) as step:
+                    end, nb_records = _complete_records_end(mm, offset, chunk_size)
+                    if nb_records < chunk_size:
+                        # Fin du fichier : le dernier enregistrement peut ne pas finir par un saut de ligne
+                        end = len(mm)
+                    chunk = read_typed_csv(io.BytesIO(header + mm[offset:end])) if end > offset else None
+                    step.rows = 0 if chunk is None else len(chunk)
+                if chunk is None:
+                    break
+                df = transform_dataframe(chunk, dates_report, stages)
+
+                # Une transaction par chunk : le verrou d'écriture est rendu entre deux
+                cursor.execute("BEGIN")
+                counts = _load_dataframe(cursor, df, batch_size, stages)
+                cursor.execute("""
+                    INSERT INTO Ingestion(source, byte_offset, ingested_at) VALUES(?,?,?)
+                    ON CONFLICT(source) DO UPDATE SET byte_offset = excluded.byte_offset, ingested_at = excluded.ingested_at
+                """, (source, end, datetime.now().isoformat(timespec="seconds")))
+                conn.commit()
+                offset = end
+
+                for table, count in counts.items():
+                    report[table] = report.get(table, 0) + count
+                nb_rows += len(chunk)
+                if progress is not None:
+                    progress(nb_rows)
+            new_offset = offset
+    except BaseException:
+        conn.rollback()
+        raise
+
+    # Statistiques du planificateur, recalculées seulement si nécessaire
+    cursor.execute("PRAGMA optimize")
+
+    report.update(swapped_dates=dates_report["swapped"], malformed_dates=dates_report["malformed_dates"],
+                  byte_offset=new_offset)
+    return _ingest_report(report, nb_rows, start_time, stages)
+
+
+def init_database(incremental=False):
     """Initialise the database by creating the database
     and populating it.
+
+    Parameters
+    ----------
+    incremental
+        If True, only the rows appended to ./data/pregnancies.csv since the
+        last run are ingested (see ingest_incremental). Otherwise the whole
+        transformed file ./data/new_pregnancies.csv is loaded.
     """
     try:
-        conn = get_db_connexion()
+        # Profil de connexion prévu pour les chargements massifs
+        conn = get_db_connexion("bulk-load")
         cursor = conn.cursor()
 
         # Création des tables
         create_database(cursor, conn)
 
-        # Populer la base avec le CSV modifié
-        csv_file = "./data/new_pregnancies.csv"  # ou le chemin vers ton CSV transformé
-        populate_database(cursor, conn, csv_file)
+        if incremental:
+            # Ingérer seulement les nouvelles lignes de l'export brut
+            ingest_incremental(cursor, conn, "./data/pregnancies.csv")
+        else:
+            # Populer la base avec le CSV modifié
+            csv_file = "./data/new_pregnancies.csv"  # ou le chemin vers ton CSV transformé
+            populate_database(cursor, conn, csv_file)
 
         # Fermeture de la connexion
         close_db_connexion(cursor, conn)
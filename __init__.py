@@ -1,100 +1,32 @@
-import sqlite3
-import utils
-
-
-def get_db_connexion():
-    # Loads the app config into the dictionary app_config.
-    app_config = utils.load_config()
-
-    if not app_config:
-        print("Error: while loading the app configuration")
-        return None
-
-    # From the configuration, gets the path to the database file.
-    db_file = app_config["db"]
+import time
 
-    # Open a connection to the database.
-    conn = sqlite3.connect(db_file)
-    conn.row_factory = sqlite3.Row
+# Début de l'import du package : python -m db --timings compte l'import dans
+# le temps de démarrage (voir __main__.py)
+_IMPORT_STARTED = time.perf_counter()
 
-    return conn
-
-
-def close_db_connexion(cursor, conn):
-    """Close a database connexion and the cursor.
+import sqlite3
 
-    Parameters
-    ----------
-    cursor
-        The object used to query the database.
-    conn
-        The object used to manage the database connection.
-    """
-    cursor.close()
-    conn.close()
+from .connection import get_db_connexion, close_db_connexion
 
 
 def transform_csv(old_csv_file_name, new_csv_file_name):
     """Write a new CSV file based on the input CSV file by adding
     new columns to obtain a CSV file that is easier to read.
 
+    The file is written by transform.transform() with the engine chosen for
+    the input, so it is the same as the file of every other engine.
+
     Parameters
     ----------
-    csv_file_name
+    old_csv_file_name
         Name of the CSV file to transform
     new_csv_file_name
         Name of the new CSV file
     """
-    with open(old_csv_file_name, "r", encoding="utf-8") as infile:
-        lines = [line.strip() for line in infile.readlines()]
-
-    # mettre en forme les données
-    header = lines[0].split(",")
-    data = [line.split(",") for line in lines[1:]]
-
-    # Indices des colonnes
-    idx_gender = header.index("Gender")
-    idx_reg_date = header.index("User_Registration_Date")
-    idx_reg_time = header.index("User_Registration_Time")
-    idx_checkup_date = header.index("Last_Checkup_Date")
-    idx_checkup_time = header.index("Last_Checkup_Time")
-    idx_no_of_checkups = header.index("No_of_Checkups")
-    idx_no_of_missed_checkup = header.index("No_of_Missed_Checkups")
-
-    # Colonnes à supprimer
-    drop_cols = {"Reminder_Date", "Gender", "No_of_Checkups", "No_of_Missed_Checkups"}
-    keep_indices = [i for i, col in enumerate(header) if col not in drop_cols]
-
-    # Nouveau header
-    new_header = [header[i] for i in keep_indices]
-    new_header.append("Checkup")  # ajouter la nouvelle colonne à la fin
-
-    # Construire les lignes finales
-    new_data = []
-    for row in data:
-        # Corriger les dates pour les femmes
-        gender = row[idx_gender].strip().lower()
-        if gender == "female" and row[idx_reg_date] > row[idx_checkup_date]:
-            row[idx_reg_date], row[idx_checkup_date] = row[idx_checkup_date], row[idx_reg_date]
-            row[idx_reg_time], row[idx_checkup_time] = row[idx_checkup_time], row[idx_reg_time]
-
-        # Calculer la colonne Checkup
-        try:
-            checkup_done = int(row[idx_no_of_checkups]) - int(row[idx_no_of_missed_checkup])
-        except:
-            checkup_done = ""
-
-        # Filtrer les colonnes à garder
-        final_row = [row[i] for i in keep_indices]
-        final_row.append(str(checkup_done))  # ajouter la colonne Checkup
-
-        new_data.append(final_row)
-
-    # Écrire le nouveau CSV
-    with open(new_csv_file_name, "w", encoding="utf-8") as outfile:
-        outfile.write(",".join(new_header) + "\n")
-        for row in new_data:
-            outfile.write(",".join(row) + "\n")
+    # Import local : le nom transform désigne le sous-module dans le package
+    from .transform import transform
+
+    transform(old_csv_file_name, new_csv_file_name)
 
 
 def create_database(cursor, conn):
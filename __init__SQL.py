@@ -1,170 +1,318 @@
+import csv
 import sqlite3
-import utils
+import time
 
+from .CSV import skip_blank_rows
+from .blood_pressure import bp_category_sql
+from .connection import get_db_connexion
+from .dates import merge_reports, print_report
+from .metrics import stage
+from .With_Pandas import DATE_COLUMNS, FLAG_COLUMNS, NUMERIC_COLUMNS, UNIT_COLUMNS, create_database
 
-def get_db_connexion():
-    # Loads the app config into the dictionary app_config.
-    app_config = utils.load_config()
 
-    if not app_config:
-        print("Error: while loading the app configuration")
-        return None
+# Colonnes supprimées par la transformation, comme dans CSV.transform_data
+DROP_COLUMNS = {"Reminder_Date", "Gender", "No_of_Checkups", "No_of_Missed_Checkups"}
 
-    # From the configuration, gets the path to the database file.
-    db_file = app_config["db"]
+# Valeurs manquantes par défaut de pandas.read_csv (voir With_Pandas.read_typed_csv)
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>",
+    "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
 
-    # Open a connection to the database.
-    conn = sqlite3.connect(db_file)
-    conn.row_factory = sqlite3.Row
+# Bornes des types entiers du schéma d'ingestion
+INT_RANGES = {"Int8": (-128, 127), "Int16": (-32768, 32767)}
 
-    return conn
+# Espaces retirés par \s et str.strip() dans With_Pandas._apply_schema
+WHITESPACE_SQL = "' ' || char(9, 10, 11, 12, 13)"
 
 
-def close_db_connexion(cursor, conn):
-    """Close a database connexion and the cursor.
+def _quote(name):
+    """Quote a column name of the CSV file to use it in a SQL statement."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _int_sql(expression):
+    """SQL expression converting a text to an integer, NULL if it is not one.
+
+    Like int() in Python, a sign, surrounding spaces and single underscores
+    between digits ("1_000") are accepted.
+    """
+    trimmed = f"trim({expression})"
+    unsigned = f"ltrim({trimmed}, '+-')"
+    digits = f"replace({unsigned}, '_', '')"
+    return (
+        f"CASE WHEN {digits} <> '' AND {digits} NOT GLOB '*[^0-9]*' "
+        f"AND length({trimmed}) - length({unsigned}) <= 1 "
+        f"AND {unsigned} NOT GLOB '_*' AND {unsigned} NOT GLOB '*_' AND {unsigned} NOT GLOB '*__*' "
+        f"THEN CAST(replace({trimmed}, '_', '') AS INTEGER) END"
+    )
+
+
+def _date_sql(expression):
+    """SQL expression reading a YYYY-MM-DD date (month and day may have one
+    digit) as "YYYY-MM-DD", NULL if it is not a valid date, like
+    pd.to_datetime(format="%Y-%m-%d")."""
+    rest = f"substr({expression}, 6)"
+    month = f"substr({rest}, 1, instr({rest}, '-') - 1)"
+    day = f"substr({rest}, instr({rest}, '-') + 1)"
+    padded = f"substr({expression}, 1, 5) || substr('0' || {month}, -2) || '-' || substr('0' || {day}, -2)"
+    return (
+        f"CASE WHEN {expression} GLOB '[0-9][0-9][0-9][0-9]-*' "
+        f"AND ({month} GLOB '[0-9]' OR {month} GLOB '[0-9][0-9]') "
+        f"AND ({day} GLOB '[0-9]' OR {day} GLOB '[0-9][0-9]') "
+        # Le modificateur normalise les jours hors du mois (2023-02-30 -> 2023-03-02)
+        f"AND date({padded}, '+0 days') = {padded} THEN {padded} END"
+    )
+
+
+def _in_range_sql(expression, dtype):
+    """SQL expression keeping an integer that fits in dtype, NULL otherwise."""
+    low, high = INT_RANGES[dtype]
+    return f"CASE WHEN typeof({expression}) = 'integer' AND {expression} BETWEEN {low} AND {high} THEN {expression} END"
+
+
+def apply_schema(cursor, header):
+    """Parse the columns of raw_data like With_Pandas._apply_schema does,
+    so that the SQL and pandas loaders store the same values.
+
+    raw_data must have been loaded with the types of staging_types(): the
+    numeric columns have already been converted by their affinity where
+    they are well-formed numbers. The missing values of read_csv (NA_VALUES)
+    become NULL, the units and flags are parsed, the invalid dates and the
+    numbers that can't be parsed (or do not fit in their integer type)
+    become NULL.
 
     Parameters
     ----------
     cursor
         The object used to query the database.
-    conn
-        The object used to manage the database connection.
+    header
+        The header of the raw CSV file.
     """
-    cursor.close()
-    conn.close()
+    na_values = ", ".join("'" + value.replace("'", "''") + "'" for value in NA_VALUES)
+    assignments = []
+    for col in header:
+        # Les noms d'hôpitaux sont gardés tels quels, comme les clés du chargeur pandas
+        if col == "Hospital_Name":
+            continue
+        value = f"(CASE WHEN {_quote(col)} IN ({na_values}) THEN NULL ELSE {_quote(col)} END)"
+        if col in UNIT_COLUMNS:
+            # "24 weeks" -> 24
+            digits = f"ltrim({value}, {WHITESPACE_SQL})"
+            value = _in_range_sql(f"(CASE WHEN {digits} GLOB '[0-9]*' THEN CAST({digits} AS INTEGER) END)",
+                                  UNIT_COLUMNS[col])
+        elif col in FLAG_COLUMNS:
+            cases = " ".join(f"WHEN '{label}' THEN {code}" for label, code in FLAG_COLUMNS[col].items())
+            value = f"CASE trim({value}, {WHITESPACE_SQL}) {cases} END"
+        elif col in DATE_COLUMNS:
+            value = _date_sql(value)
+        elif col in NUMERIC_COLUMNS and NUMERIC_COLUMNS[col] in INT_RANGES:
+            value = _in_range_sql(value, NUMERIC_COLUMNS[col])
+        elif col in NUMERIC_COLUMNS:
+            value = f"CASE WHEN typeof({value}) IN ('integer', 'real') THEN {value} END"
+        assignments.append(f"{_quote(col)} = {value}")
+    cursor.execute(f"UPDATE raw_data SET {', '.join(assignments)}")
+
+
+def staging_types(header):
+    """Types of the raw_data columns for apply_schema: the affinity of the
+    numeric columns converts their well-formed numbers ("5.0" -> 5, " 68 "
+    -> 68.0), the other columns keep the text as is."""
+    return {col: "REAL" if dtype == "float64" else "NUMERIC"
+            for col, dtype in NUMERIC_COLUMNS.items() if col in header}
+
+
+def load_staging(cursor, csv_file_name, batch_size=10000, types=None):
+    """Load the raw CSV file as is into the temporary table raw_data.
 
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    csv_file_name
+        Name of the CSV file to load.
+    batch_size
+        Number of rows sent to each executemany call.
+    types
+        If given, function returning column -> declared type of raw_data
+        from the header (see staging_types); the other columns have no type.
 
-def transform_csv(old_csv_file_name, new_csv_file_name):
-    """Write a new CSV file based on the input CSV file by adding
-    new columns to obtain a CSV file that is easier to read.
+    Returns
+    -------
+    list
+        The header of the CSV file.
+    """
+    with open(csv_file_name, "r", encoding="utf-8", newline="") as infile:
+        reader = csv.reader(infile)
+        header = next(reader)
+
+        cursor.execute("DROP TABLE IF EXISTS temp.raw_data")
+        column_types = types(header) if types is not None else {}
+        columns = ", ".join(f"{_quote(col)} {column_types.get(col, '')}".rstrip() for col in header)
+        cursor.execute(f"CREATE TEMP TABLE raw_data({columns})")
+
+        # lignes trop courtes complétées par des champs vides, trop longues
+        # tronquées et lignes vides ignorées, comme dans CSV.transform_data
+        rows = skip_blank_rows(reader)
+        nb_fields = len(header)
+        padding = [""] * nb_fields
+        query = f"INSERT INTO raw_data VALUES({', '.join('?' * nb_fields)})"
+        while True:
+            batch = [row if len(row) == nb_fields else (row + padding)[:nb_fields]
+                     for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            cursor.executemany(query, batch)
+
+    return header
+
+
+def transform_csv(cursor, header):
+    """Build the temporary table transformed_data from raw_data, entirely in SQL.
+
+    Like CSV.transform_data, registration and checkup date/time are swapped
+    when the registration date is after the checkup date, the Checkup column
+    is No_of_Checkups - No_of_Missed_Checkups and BP_Category is the AHA
+    category of Blood_Pressure. The columns of DROP_COLUMNS are removed and
+    the integer values of the blood pressure are kept in the systolic and
+    diastolic columns.
 
     Parameters
     ----------
-    csv_file_name
-        Name of the CSV file to transform
-    new_csv_file_name
-        Name of the new CSV file
+    cursor
+        The object used to query the database.
+    header
+        The header of the raw CSV file.
     """
-    query = ''''
-        CREATE TABLE transformed_data AS
+    swapped = {
+        "User_Registration_Date": "Last_Checkup_Date",
+        "Last_Checkup_Date": "User_Registration_Date",
+        "User_Registration_Time": "Last_Checkup_Time",
+        "Last_Checkup_Time": "User_Registration_Time",
+    }
+    columns = []
+    for col in header:
+        if col in DROP_COLUMNS:
+            continue
+        if col in swapped:
+            columns.append(f"CASE WHEN swap THEN {_quote(swapped[col])} ELSE {_quote(col)} END AS {_quote(col)}")
+        else:
+            columns.append(_quote(col))
+
+    # Les deux valeurs de tension sont NULL dès que l'une est invalide, sinon
+    # "abc/130" serait classé par la seule diastolique.
+    query = f"""
+        CREATE TEMP TABLE transformed_data AS
         SELECT
-            User_ID,
-            CASE 
-                WHEN User_Registration_Date > Last_Checkup_Date 
-                THEN Last_Checkup_Date
-                ELSE User_Registration_Date
-            END AS User_Registration_Date,
-            CASE 
-                WHEN User_Registration_Date > Last_Checkup_Date 
-                THEN Last_Checkup_Time
-                ELSE User_Registration_Time
-            END AS User_Registration_Time,
-            CASE 
-                WHEN User_Registration_Date > Last_Checkup_Date 
-                THEN User_Registration_Date
-                ELSE Last_Checkup_Date
-            END AS Last_Checkup_Date,
-            CASE 
-                WHEN User_Registration_Date > Last_Checkup_Date 
-                THEN User_Registration_Time
-                ELSE Last_Checkup_Time
-            END AS Last_Checkup_Time,
-            Other_Column1,
-            Other_Column2
-        FROM raw_data;
-    '''
+            row_id,
+            {", ".join(columns)},
+            {_int_sql("No_of_Checkups")} - {_int_sql("No_of_Missed_Checkups")} AS Checkup,
+            {bp_category_sql("systolic", "diastolic")} AS BP_Category,
+            systolic,
+            diastolic
+        FROM (
+            SELECT *,
+                CASE WHEN systolic_raw IS NOT NULL AND diastolic_raw IS NOT NULL THEN systolic_raw END AS systolic,
+                CASE WHEN systolic_raw IS NOT NULL AND diastolic_raw IS NOT NULL THEN diastolic_raw END AS diastolic
+            FROM (
+                SELECT rowid AS row_id, *,
+                    User_Registration_Date > Last_Checkup_Date AS swap,
+                    {_int_sql("substr(Blood_Pressure, 1, instr(Blood_Pressure, '/') - 1)")} AS systolic_raw,
+                    CASE WHEN instr(Blood_Pressure, '/') > 0
+                        THEN {_int_sql("substr(Blood_Pressure, instr(Blood_Pressure, '/') + 1)")}
+                    END AS diastolic_raw
+                FROM raw_data
+            )
+        )
+    """
+    cursor.execute("DROP TABLE IF EXISTS temp.transformed_data")
     cursor.execute(query)
-    
 
 
-transform_csv("C:/Users/Bonin/Desktop/Centrale Supélec/Première année/SIP/tp_pregnancies_squelette/data/pregnancies.csv","C:/Users/Bonin/Desktop/Centrale Supélec/Première année/SIP/tp_pregnancies_squelette/data/new_pregnancies.csv")
+def transform_data(old_csv_file_name, new_csv_file_name, report=None, batch_size=10000):
+    """Write the CSV file of CSV.transform_data, with the SQL transform.
 
-def create_database(cursor, conn):
-    """Creates the Pregnancies 2023 database
+    The staging tables live in a private temporary database, on disk, so
+    the memory used does not grow with the size of the file.
 
     Parameters
     ----------
-    cursor
-        The object used to query the database.
-    conn
-        The object used to manage the database connection.
+    old_csv_file_name
+        Name of the raw CSV file to transform.
+    new_csv_file_name
+        Name of the new CSV file.
+    report
+        If given, a date correction report updated with the counts (see
+        dates.py).
+    batch_size
+        Number of rows sent to each executemany call of the staging load.
 
     Returns
     -------
     bool
-        True if the database could be created, False otherwise.
+        True to indicate that everything went well.
     """
-
-    # We open a transaction.
-    # A transaction is a sequence of read/write statements that
-    # have a permanent result in the database only if they all succeed.
-    #
-    # More concretely, in this function we create many tables in the database.
-    # The transaction is therefore a sequence of CREATE TABLE statements such as :
-    #
-    # BEGIN
-    # CREATE TABLE XXX
-    # CREATE TABLE YYY
-    # CREATE TABLE ZZZ
-    # ....
-    #
-    # If no error occurs, all the tables are permanently created in the database.
-    # If an error occurs while creating a table (for instance YYY), no table will be created, even those for which
-    # the statement CREATE TABLE has already been executed (in this example, XXX).
-    #
-    # When we start a transaction with the statement BEGIN, we must end it with either COMMIT
-    # or ROLLBACK.
-    #
-    # * COMMIT is called when no error occurs. After calling COMMIT, the result of all the statements in
-    # the transaction is permanetly written to the database. In our example, COMMIT results in actually creating all the tables
-    # (XXX, YYY, ZZZ, ....)
-    #
-    # * ROLLBACK is called when any error occurs in the transaction. Calling ROLLBACK means that
-    # the database is not modified (in our example, no table is created).
-    #
-    #
-    cursor.execute("BEGIN")
-
-    # Create the tables.
-    tables = {
-        "Analyst": """
-            CREATE TABLE IF NOT EXISTS Analyst(
-                username TEXT PRIMARY KEY,
-                password BINARY(256)
-            );
-            """,
-        # TODO: COMPLETE THE CODE HERE TO CREATE THE OTHER TABLES ####
-    }
+    conn = sqlite3.connect("")
+    cursor = conn.cursor()
     try:
-        # To create the tables, we call the function cursor.execute() and we pass it the
-        # CREATE TABLE statement as a parameter.
-        # The function cursor.execute() can raise an exception sqlite3.Error.
-        # That's why we write the code for creating the tables in a try...except block.
-        for tablename in tables:
-            print(f"Creating table {tablename}...", end=" ")
-            cursor.execute(tables[tablename])
-            print("OK")
-
-    ###################################################################
-
-    # Exception raised when something goes wrong while creating the tables.
-    except sqlite3.Error as error:
-        print("An error occurred while creating the tables: {}".format(error))
-        # IMPORTANT : we rollback the transaction! No table is created in the database.
-        conn.rollback()
-        # Return False to indicate that something went wrong.
-        return False
-
-    # If we arrive here, that means that no error occurred.
-    # IMPORTANT : we must COMMIT the transaction, so that all tables are actually created in the database.
-    conn.commit()
-    print("Database created successfully")
-    # Returns True to indicate that everything went well!
+        with stage("read") as step:
+            header = load_staging(cursor, old_csv_file_name, batch_size)
+            step.rows = cursor.execute("SELECT COUNT(*) FROM raw_data").fetchone()[0]
+        with stage("transform", step.rows):
+            transform_csv(cursor, header)
+
+        # Mêmes comptes que dates.correct_dates
+        iso_date = "'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+        rows, swapped, malformed = cursor.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(User_Registration_Date > Last_Checkup_Date), 0),
+                COALESCE(SUM(User_Registration_Date NOT GLOB {iso_date})
+                         + SUM(Last_Checkup_Date NOT GLOB {iso_date}), 0)
+            FROM raw_data
+        """).fetchone()
+        dates_report = {"rows": rows, "swapped": swapped, "malformed_dates": malformed}
+        print_report(dates_report)
+        if report is not None:
+            merge_reports(report, dates_report)
+
+        # row_id et les valeurs entières de la tension ne font pas partie du CSV transformé
+        columns = [description[1] for description in cursor.execute("PRAGMA temp.table_info(transformed_data)")
+                   if description[1] not in ("row_id", "systolic", "diastolic")]
+        with stage("write", step.rows), open(new_csv_file_name, "w", encoding="utf-8", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(columns)
+            cursor.execute(f"SELECT {', '.join(_quote(col) for col in columns)} FROM transformed_data ORDER BY row_id")
+            for row in cursor:
+                writer.writerow(["" if value is None else value for value in row])
+    finally:
+        conn.close()
     return True
 
 
-def populate_database(cursor, conn, csv_file_name):
-    """Populate the database with data in a CSV file.
+def _max_id(cursor, table):
+    """Return the largest id of a table (0 if it is empty)."""
+    return cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+
+
+def _insert_lookup_labels(cursor, table, column):
+    """Add to a lookup table the values of a column of transformed_data it
+    does not contain yet, in the order of first appearance."""
+    cursor.execute(f"""
+        INSERT INTO {table}(label)
+        SELECT NULLIF({_quote(column)}, '') AS label FROM transformed_data
+        WHERE label IS NOT NULL AND label NOT IN (SELECT label FROM {table})
+        GROUP BY label
+        ORDER BY MIN(row_id)
+    """)
+
+
+def populate_database(cursor, conn, csv_file_name, batch_size=10000):
+    """Populate the database with data in a CSV file, without leaving SQLite.
+
+    The raw CSV file is loaded into a staging table, transformed with
+    set-based SQL (see transform_csv) and copied into the tables with
+    INSERT ... SELECT statements, all in one transaction. The ids of
+    WomanData, PregnancyData and CheckupData are derived from the row number
+    of the staging table.
 
     Parameters
     ----------
@@ -173,34 +321,141 @@ def populate_database(cursor, conn, csv_file_name):
     conn
         The object used to manage the database connection.
     csv_file_name
-        Name of the CSV file where the data are.
+        Name of the raw CSV file (not transformed) where the data are.
+    batch_size
+        Number of rows sent to each executemany call of the staging load.
 
     Returns
     -------
-    bool
-        True if the database is correctly populated, False otherwise.
+    dict or bool
+        The number of rows inserted in each table, the elapsed time, the
+        throughput and the time and rows of each stage ("stages") if the
+        database is correctly populated, False otherwise.
     """
-    # TODO
-    return False
+    start_time = time.perf_counter()
+    stages = {}
+    try:
+        cursor.execute("BEGIN")
+        with stage("read", stages=stages) as step:
+            header = load_staging(cursor, csv_file_name, batch_size, staging_types)
+            step.rows = cursor.execute("SELECT COUNT(*) FROM raw_data").fetchone()[0]
+        with stage("transform", step.rows, stages):
+            # Mêmes valeurs que le chargeur pandas (voir With_Pandas._apply_schema)
+            apply_schema(cursor, header)
+            transform_csv(cursor, header)
+
+        report = {}
+
+        # --- Hospital --- : dans l'ordre de première apparition
+        with stage("insert.Hospital", stages=stages) as step:
+            cursor.execute("""
+                INSERT INTO Hospital(name)
+                SELECT Hospital_Name FROM transformed_data
+                WHERE Hospital_Name NOT IN (SELECT name FROM Hospital WHERE name IS NOT NULL)
+                GROUP BY Hospital_Name
+                ORDER BY MIN(row_id)
+            """)
+            report["hospitals"] = cursor.rowcount
+            step.rows = report["hospitals"]
+
+        # --- Tables de codes ---
+        for table, column in [("BloodType", "Mother_Blood_Type"), ("Gender", "Baby_Gender"),
+                              ("DeliveryType", "Delivery_Type"), ("BPCategory", "BP_Category")]:
+            _insert_lookup_labels(cursor, table, column)
+
+        # --- Woman ---
+        with stage("insert.WomanData", stages=stages) as step:
+            cursor.execute("""
+                INSERT INTO WomanData(id, name, birth_date, blood_type_id, hospital_id)
+                SELECT ? + t.row_id, t.Name, t.Date_of_Birth, b.id, h.id
+                FROM transformed_data t
+                LEFT JOIN (SELECT name, MIN(id) AS id FROM Hospital GROUP BY name) h ON h.name = t.Hospital_Name
+                LEFT JOIN BloodType b ON b.label = t.Mother_Blood_Type
+            """, (_max_id(cursor, "WomanData"),))
+            report["women"] = cursor.rowcount
+            step.rows = report["women"]
+            first_woman_id = _max_id(cursor, "WomanData") - report["women"]
+
+        # --- Pregnancy ---
+        with stage("insert.PregnancyData", stages=stages) as step:
+            analyst_id = 1  # simplification si un seul analyst
+            cursor.execute("""
+                INSERT INTO PregnancyData(
+                    id, woman_id, analyst_id, first_registration_date, delivery_date,
+                    baby_gender_id, delivery_type_id, number_of_checkups
+                )
+                SELECT ? + t.row_id, ? + t.row_id, ?, t.User_Registration_Date, t.Delivery_Date,
+                    g.id, d.id, t.Checkup
+                FROM transformed_data t
+                LEFT JOIN Gender g ON g.label = t.Baby_Gender
+                LEFT JOIN DeliveryType d ON d.label = t.Delivery_Type
+            """, (_max_id(cursor, "PregnancyData"), first_woman_id, analyst_id))
+            report["pregnancies"] = cursor.rowcount
+            step.rows = report["pregnancies"]
+            first_pregnancy_id = _max_id(cursor, "PregnancyData") - report["pregnancies"]
+
+        # --- Checkup ---
+        with stage("insert.CheckupData", stages=stages) as step:
+            cursor.execute("""
+                INSERT INTO CheckupData(
+                    id, pregnancy_id, date, time, weight, systolic, diastolic, blood_pressure_raw,
+                    gestational_age, fetal_heart_rate, anomaly_presence, maternal_mental_health, bp_category_id
+                )
+                SELECT ? + t.row_id, ? + t.row_id, t.Last_Checkup_Date, t.Last_Checkup_Time, t."Weight(kg)",
+                    t.systolic, t.diastolic,
+                    CASE WHEN t.systolic IS NULL OR t.Blood_Pressure IS NOT t.systolic || '/' || t.diastolic
+                        THEN NULLIF(t.Blood_Pressure, '')
+                    END,
+                    t.Gestational_Age, t.Fetal_Heart_Rate, t.Anomaly, t.Maternal_Mental_Health,
+                    c.id
+                FROM transformed_data t
+                LEFT JOIN BPCategory c ON c.label = t.BP_Category
+            """, (_max_id(cursor, "CheckupData"), first_pregnancy_id))
+            report["checkups"] = cursor.rowcount
+            step.rows = report["checkups"]
+
+        cursor.execute("DROP TABLE temp.transformed_data")
+        cursor.execute("DROP TABLE temp.raw_data")
+        conn.commit()
+
+        # Mettre à jour les statistiques utilisées par le planificateur
+        cursor.execute("ANALYZE")
+
+    # Exception et pas seulement sqlite3.Error : un export mal encodé lève
+    # UnicodeDecodeError (ValueError) pendant load_staging, BEGIN encore ouvert
+    except Exception as error:
+        print("Error populating database:", error)
+        conn.rollback()
+        return False
+
+    elapsed = time.perf_counter() - start_time
+    report["rows"] = report["checkups"]
+    report["seconds"] = elapsed
+    report["rows_per_second"] = report["rows"] / elapsed if elapsed > 0 else float("inf")
+    report["stages"] = stages
+    return report
 
 
 def init_database():
     """Initialise the database by creating the database
     and populating it.
     """
+    conn = None
     try:
-        conn = get_db_connexion()
+        # Profil de connexion prévu pour les chargements massifs
+        conn = get_db_connexion("bulk-load")
 
         # The cursor is used to execute queries to the database.
         cursor = conn.cursor()
 
-        # Creates the database. THIS IS THE FUNCTION THAT YOU'LL NEED TO MODIFY
+        # Creates the database.
         create_database(cursor, conn)
 
-        # Populates the database.
-        # TODO - add call to populate_database()
-
-        # Closes the connection to the database
-        close_db_connexion(cursor, conn)
+        # Populates the database, directly from the raw CSV file.
+        populate_database(cursor, conn, "./data/pregnancies.csv")
     except Exception as e:
         print("Error: Database cannot be initialised:", e)
+    finally:
+        # Closes the connection to the database, even after an error
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,202 @@
+"""Command line entry point of the db package.
+
+Usage (from the directory that contains the package)::
+
+    python -m db transform data/pregnancies.csv data/new_pregnancies.csv [--engine auto] [--quarantine bad.csv]
+    python -m db init-db
+    python -m db populate data/pregnancies.csv [more exports...]
+    python -m db serve --port 5000 [--app app:create_app]
+
+Meant for short-lived cron jobs: only the modules of the command that runs
+are imported (pandas only for the pandas engine, Flask only for serve), and
+--timings prints the startup time (from the import of the package until the
+command starts, with the time of the imports of the package and of
+.transform) and the time of the command, imports of its modules included,
+on stderr.
+"""
+import argparse
+import importlib
+import sys
+import time
+
+from . import _IMPORT_STARTED
+from .transform import ENGINES as TRANSFORM_ENGINES
+
+_IMPORTED = time.perf_counter()
+
+POPULATE_MODES = ["raw", "transformed", "incremental", "sql"]
+
+
+def _module(name):
+    """Import a module of the package by its name."""
+    return importlib.import_module(f"{__package__}.{name}")
+
+
+def _connect(profile):
+    """Open a connection to the database of the configuration file, or exit."""
+    conn = _module("connection").get_db_connexion(profile)
+    if conn is None:
+        raise SystemExit(1)
+    return conn, conn.cursor()
+
+
+def transform(args):
+    """Transform a raw export into the CSV file read by the pandas loader."""
+    transform_module = _module("transform")
+    if args.dry_run:
+        engines = None if args.engine == "auto" else [args.engine]
+        estimate = transform_module.estimate(args.input, engines, args.sample_rows)
+        print(f"{args.input}: {estimate['input_bytes'] / 2 ** 20:.1f} MiB, about {estimate['estimated_rows']} rows "
+              f"(estimated from {estimate['sample_rows']} rows)")
+        for engine, values in estimate["engines"].items():
+            if "error" in values:
+                print(f"  {engine:<13} error: {values['error']}")
+            else:
+                print(f"  {engine:<13} {values['seconds']:10.1f} s {values['peak_rss_bytes'] / 2 ** 20:10.1f} MiB "
+                      f"identical={values['identical']}")
+        print(f"recommended: {estimate['recommended']}, auto: {transform_module.choose_engine(args.input)}")
+        return 0
+
+    engine = transform_module.choose_engine(args.input) if args.engine == "auto" else args.engine
+    options = {}
+    if engine == "csv-parallel":
+        options["workers"] = args.workers
+    if args.columnar_dir:
+        if engine in ("csv-parallel", "sql"):
+            print(f"Error: the {engine} engine can't write the columnar cache")
+            return 1
+        options["columnar_dir"] = args.columnar_dir
+    validation = {}
+    if engine != "sql":
+        options["validation"] = validation
+    if args.quarantine:
+        if engine == "sql":
+            print("Error: the sql engine can't write the quarantine file")
+            return 1
+        options["quarantine_file_name"] = args.quarantine
+    report = {"rows": 0, "swapped": 0, "malformed_dates": 0}
+    try:
+        transform_module.transform(args.input, args.output, engine, report, **options)
+    except ImportError as e:
+        print("Error:", e)
+        return 1
+    print(f"{args.output}: {report['rows']} rows, {report['swapped']} swapped dates ({engine} engine)")
+    if validation.get("quarantined"):
+        print(f"{args.quarantine}: {validation['quarantined']} invalid rows")
+    return 0
+
+
+def init_db(args):
+    """Create the tables, indexes, views and triggers of the database."""
+    conn, cursor = _connect(args.profile)
+    created = _module("With_Pandas").create_database(cursor, conn)
+    _module("connection").close_db_connexion(cursor, conn)
+    return 0 if created else 1
+
+
+def populate(args):
+    """Load exports into the database."""
+    conn, cursor = _connect(args.profile)
+    try:
+        if args.mode == "raw" and len(args.files) > 1:
+            reports = [_module("parallel_ingest").ingest_files(cursor, conn, args.files, args.workers,
+                                                              args.chunk_size)]
+        elif args.mode == "raw":
+            reports = [_module("With_Pandas").ingest_raw_csv(cursor, conn, args.files[0], args.chunk_size)]
+        else:
+            module_name, function_name = {
+                "transformed": ("With_Pandas", "populate_database"),
+                "incremental": ("With_Pandas", "ingest_incremental"),
+                "sql": ("__init__SQL", "populate_database"),
+            }[args.mode]
+            function = getattr(_module(module_name), function_name)
+            reports = [function(cursor, conn, file_name) for file_name in args.files]
+    except Exception as e:
+        print("Error populating database:", e)
+        conn.close()
+        return 1
+    _module("connection").close_db_connexion(cursor, conn)
+
+    if not all(reports):
+        return 1
+    for report in reports:
+        print(f"{report['rows']} rows in {report['seconds']:.2f} s ({report['rows_per_second']:.0f} rows/s)")
+    return 0
+
+
+def serve(args):
+    """Run the Flask application, with the /metrics and /uploads routes."""
+    module_name, _, factory_name = args.app.partition(":")
+    try:
+        factory = getattr(importlib.import_module(module_name), factory_name or "create_app")
+    except (ImportError, AttributeError, ValueError) as e:
+        print(f"Error: can't load the application factory {args.app}:", e)
+        return 1
+
+    app = factory()
+    # The connection of each request goes back to the pool on teardown
+    _module("connection").init_app(app)
+    _module("metrics").init_app(app)
+    _module("jobs").init_app(app)
+    app.run(host=args.host, port=args.port, debug=args.debug)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog=f"python -m {__package__}", description=__doc__.splitlines()[0])
+    parser.add_argument("--timings", action="store_true", help="print the startup and command times on stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("transform", help=transform.__doc__)
+    command.add_argument("input")
+    command.add_argument("output")
+    command.add_argument("--engine", choices=["auto", *TRANSFORM_ENGINES], default="auto")
+    command.add_argument("--workers", type=int, default=None, help="processes of the csv-parallel engine")
+    command.add_argument("--columnar-dir", default=None, help="also write the columnar cache there")
+    command.add_argument("--quarantine", default=None,
+                         help="write the invalid rows there, with the rules they break, instead of transforming them")
+    command.add_argument("--dry-run", action="store_true",
+                         help="only estimate the time and memory of the engine (of each engine with auto) "
+                              "from a sample")
+    command.add_argument("--sample-rows", type=int, default=20000, help="size of the sample of --dry-run")
+    command.set_defaults(handler=transform)
+
+    command = commands.add_parser("init-db", help=init_db.__doc__)
+    command.add_argument("--profile", default="bulk-load", help="connection profile (see connection.PROFILES)")
+    command.set_defaults(handler=init_db)
+
+    command = commands.add_parser("populate", help=populate.__doc__)
+    command.add_argument("files", nargs="+")
+    command.add_argument("--mode", choices=POPULATE_MODES, default="raw",
+                         help="raw exports (default), transformed CSV files, rows appended since the last "
+                              "incremental run, or raw exports loaded by the SQL engine")
+    command.add_argument("--workers", type=int, default=None, help="parsing processes for several raw exports")
+    command.add_argument("--chunk-size", type=int, default=100000)
+    command.add_argument("--profile", default="bulk-load", help="connection profile (see connection.PROFILES)")
+    command.set_defaults(handler=populate)
+
+    command = commands.add_parser("serve", help=serve.__doc__)
+    command.add_argument("--host", default="127.0.0.1")
+    command.add_argument("--port", type=int, default=5000)
+    command.add_argument("--debug", action="store_true")
+    command.add_argument("--app", default="app:create_app",
+                         help="module:factory, a function without argument returning the Flask application, "
+                              "importable from the current directory (default: app:create_app)")
+    command.set_defaults(handler=serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    started = time.perf_counter()
+    status = args.handler(args)
+    if args.timings:
+        print(f"startup: {(started - _IMPORT_STARTED) * 1000:.1f} ms "
+              f"(imports: {(_IMPORTED - _IMPORT_STARTED) * 1000:.1f} ms), "
+              f"{args.command}: {time.perf_counter() - started:.2f} s", file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,437 @@
+"""Fast paths for the authentication of the analysts.
+
+* TokenCache keeps the payload of the tokens already verified, so that a
+  protected route does not verify the HMAC of the same token on every
+  request. Tokens are keyed by their SHA-256 digest and an entry never
+  outlives the "exp" claim of its token.
+* bcrypt hashes run in a bounded pool of threads (bcrypt releases the GIL
+  while hashing): a burst of logins uses at most hash_workers cores and the
+  other requests keep being served.
+* provision_analysts() creates many analysts at once: the passwords are
+  hashed on every core and the analysts inserted in one transaction. It is
+  also available from the command line:
+  python -m db.auth analysts.csv (a CSV file with username,password columns).
+* The latency of each step is counted in AUTH_LATENCY.
+
+bcrypt is imported on first use, so the module can be imported without it.
+"""
+import argparse
+import collections
+import concurrent.futures
+import csv
+import datetime
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from .connection import close_db_connexion, get_app_config, get_db_connexion
+
+
+class LatencyStats:
+    """Thread-safe counters of the duration of named operations."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, seconds):
+        """Count one operation that took seconds."""
+        with self._lock:
+            stats = self._stats.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["count"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def timer(self, name):
+        """Context manager recording the duration of its block under name."""
+        return _Timer(self, name)
+
+    def snapshot(self):
+        """Return a copy of the counters, with the average duration of each operation."""
+        with self._lock:
+            return {
+                name: {**stats, "avg_seconds": stats["total_seconds"] / stats["count"]}
+                for name, stats in self._stats.items()
+            }
+
+
+class _Timer:
+    """Context manager returned by LatencyStats.timer()."""
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+AUTH_LATENCY = LatencyStats()
+
+
+def _expiration(payload):
+    """Return the "exp" claim of a token payload as a POSIX timestamp (None if absent)."""
+    exp = payload.get("exp")
+    if isinstance(exp, datetime.datetime):
+        return exp.replace(tzinfo=exp.tzinfo or datetime.timezone.utc).timestamp()
+    return float(exp) if exp is not None else None
+
+
+class TokenCache:
+    """A bounded cache of verified tokens.
+
+    Parameters
+    ----------
+    max_size
+        Maximum number of tokens kept, the least recently used are evicted first.
+    ttl
+        Maximum number of seconds a token is trusted without being verified
+        again, even if it expires later.
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token):
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        return hashlib.sha256(token).digest()
+
+    def verify(self, token, decode):
+        """Get the payload of a token, verifying it only if it is not cached.
+
+        Parameters
+        ----------
+        token
+            The token sent by the client.
+        decode
+            Function verifying a token and returning its payload, e.g.
+            lambda token: jwt.decode(token, SECRET_KEY, algorithms=["HS256"]).
+            Its exceptions (expired or invalid token) are propagated and
+            nothing is cached for the token.
+
+        Returns
+        -------
+        dict
+            The payload of the token.
+        """
+        key, now = self._key(token), time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+
+        with AUTH_LATENCY.timer("token_decode"):
+            payload = decode(token)
+
+        expires = now + self.ttl
+        exp = _expiration(payload)
+        if exp is not None:
+            expires = min(expires, exp)
+        if expires > now:
+            with self._lock:
+                self._entries[key] = (expires, payload)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return payload
+
+    def revoke(self, token):
+        """Forget a token, so that it is verified again on its next use."""
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def stats(self):
+        """Return the hit/miss counters and the number of cached tokens."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class PasswordHasher:
+    """Run the bcrypt hashes in a bounded pool of threads.
+
+    Parameters
+    ----------
+    workers
+        Number of hashes computed at the same time.
+    max_pending
+        Number of hashes waiting for a worker above which new requests are
+        refused instead of queued.
+    timeout
+        Number of seconds a caller waits for its hash.
+    """
+
+    def __init__(self, workers=2, max_pending=64, timeout=10):
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def _run(self, name, function, *args):
+        """Run function in the pool and wait for its result."""
+        if not self._slots.acquire(blocking=False):
+            raise RuntimeError("Too many password hashes pending")
+        start = time.perf_counter()
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        finally:
+            AUTH_LATENCY.record(name, time.perf_counter() - start)
+
+    def hash_password(self, plain_password):
+        """Hash a password.
+
+        Returns
+        -------
+        str
+            The bcrypt hash, as stored in the database.
+        """
+        import bcrypt
+
+        if isinstance(plain_password, str):
+            plain_password = plain_password.encode("utf-8")
+        return self._run("hash_password", bcrypt.hashpw, plain_password, bcrypt.gensalt()).decode("utf-8")
+
+    def check_password(self, plain_password, hashed_password):
+        """Check a plain password against its hash.
+
+        Returns
+        -------
+        bool
+            True if hashed_password is the hash of plain_password, False otherwise.
+        """
+        import bcrypt
+
+        if isinstance(plain_password, str):
+            plain_password = plain_password.encode("utf-8")
+        if isinstance(hashed_password, str):
+            hashed_password = hashed_password.encode("utf-8")
+        try:
+            return self._run("check_password", bcrypt.checkpw, plain_password, hashed_password)
+        except ValueError:
+            # Malformed hash in the database
+            return False
+
+    def shutdown(self):
+        """Stop the worker threads once the pending hashes are done."""
+        self._executor.shutdown(wait=True)
+
+
+_token_cache = None
+_hasher = None
+_lock = threading.Lock()
+
+
+def get_token_cache():
+    """Return the token cache of the application, created on first use."""
+    global _token_cache
+    with _lock:
+        if _token_cache is None:
+            _token_cache = TokenCache()
+        return _token_cache
+
+
+def get_password_hasher():
+    """Return the password hasher of the application, created on first use.
+
+    Its number of workers is read from the "hash_workers" entry of the
+    configuration file (2 by default).
+    """
+    global _hasher
+    with _lock:
+        if _hasher is None:
+            app_config = get_app_config() or {}
+            _hasher = PasswordHasher(int(app_config.get("hash_workers", 2)))
+        return _hasher
+
+
+def check_analyst(cursor, username, plain_password):
+    """Authenticate an analyst with a username and a plain password.
+
+    The hash is checked in the pool of get_password_hasher(), with the
+    cursor of the caller instead of a new connection.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    username
+        The analyst username.
+    plain_password
+        The plain password to check.
+
+    Returns
+    -------
+    bool
+        True if the password is associated to the analyst, False otherwise.
+    """
+    with AUTH_LATENCY.timer("check_analyst"):
+        try:
+            row = cursor.execute("SELECT password FROM Analyst WHERE username = ?", (username,)).fetchone()
+        except sqlite3.Error as error:
+            print(f"A database error occurred while fetching the analyst: {error}")
+            return False
+
+        if row is None or row[0] is None:
+            return False
+        return get_password_hasher().check_password(plain_password, row[0])
+
+
+def hash_passwords(plain_passwords, workers=None):
+    """Hash many passwords, on several cores.
+
+    bcrypt releases the GIL while hashing, so a pool of threads keeps
+    workers cores busy without the cost of starting processes.
+
+    Parameters
+    ----------
+    plain_passwords
+        The plain passwords.
+    workers
+        Number of hashes computed at the same time (by default, the number
+        of cores).
+
+    Returns
+    -------
+    list
+        The bcrypt hash of each password, in the same order.
+    """
+    import bcrypt
+
+    def hash_one(plain_password):
+        if isinstance(plain_password, str):
+            plain_password = plain_password.encode("utf-8")
+        return bcrypt.hashpw(plain_password, bcrypt.gensalt()).decode("utf-8")
+
+    plain_passwords = list(plain_passwords)
+    if not plain_passwords:
+        return []
+    with AUTH_LATENCY.timer("hash_passwords"):
+        with concurrent.futures.ThreadPoolExecutor(workers or os.cpu_count() or 1,
+                                                   thread_name_prefix="bcrypt-bulk") as executor:
+            return list(executor.map(hash_one, plain_passwords))
+
+
+def _existing_usernames(cursor, usernames, batch_size=500):
+    """Return the usernames that are already in the Analyst table."""
+    usernames = list(usernames)
+    existing = set()
+    for start in range(0, len(usernames), batch_size):
+        batch = usernames[start:start + batch_size]
+        placeholders = ",".join("?" * len(batch))
+        existing.update(row[0] for row in cursor.execute(
+            f"SELECT username FROM Analyst WHERE username IN ({placeholders})", batch))
+    return existing
+
+
+def provision_analysts(cursor, conn, analysts, workers=None):
+    """Create many analysts at once.
+
+    Usernames that are missing, already taken or repeated in analysts are
+    reported and skipped before hashing, the other passwords are hashed in
+    parallel (see hash_passwords) and the new analysts are inserted with one
+    executemany call in a single transaction.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    conn
+        The object used to manage the database connection.
+    analysts
+        Iterable of dictionaries with the analyst personal data:
+        analyst["username"] and analyst["password"].
+    workers
+        Number of passwords hashed at the same time (by default, the number
+        of cores).
+
+    Returns
+    -------
+    list or None
+        For each analyst, in order, a dict with its username and its status:
+        "created", "duplicate" (the username is already used, in the
+        database or earlier in analysts) or "invalid" (no username or no
+        password). None if a database error occurred, in which case no
+        analyst is created.
+    """
+    results, pending = [], {}
+    for analyst in analysts:
+        username, password = analyst.get("username"), analyst.get("password")
+        result = {"username": username, "status": "created"}
+        if not username or not password:
+            result["status"] = "invalid"
+        elif username in pending:
+            result["status"] = "duplicate"
+        else:
+            pending[username] = (password, result)
+        results.append(result)
+
+    try:
+        # Skip the hashing of the usernames that are already taken
+        for username in _existing_usernames(cursor, pending):
+            pending.pop(username)[1]["status"] = "duplicate"
+
+        hashes = hash_passwords([password for password, _ in pending.values()], workers)
+
+        # Check again under the write lock: an analyst may have been added
+        # by another connection while the passwords were being hashed
+        cursor.execute("BEGIN IMMEDIATE")
+        for username in _existing_usernames(cursor, pending):
+            pending[username][1]["status"] = "duplicate"
+        cursor.executemany("INSERT INTO Analyst (username, password) VALUES (?, ?)", [
+            (username, hashed_password)
+            for (username, (_, result)), hashed_password in zip(pending.items(), hashes)
+            if result["status"] == "created"
+        ])
+        conn.commit()
+    except sqlite3.Error as error:
+        print(f"A database error occurred while inserting the analysts: {error}")
+        conn.rollback()
+        return None
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the analysts listed in a CSV file.")
+    parser.add_argument("csv_file", help="CSV file with username and password columns")
+    parser.add_argument("--workers", type=int, default=None, help="number of passwords hashed at the same time")
+    args = parser.parse_args()
+
+    with open(args.csv_file, newline="", encoding="utf-8-sig") as infile:
+        analysts = list(csv.DictReader(infile))
+
+    conn = get_db_connexion()
+    cursor = conn.cursor()
+    results = provision_analysts(cursor, conn, analysts, args.workers)
+    close_db_connexion(cursor, conn)
+    if results is None:
+        raise SystemExit(1)
+
+    counts = collections.Counter(result["status"] for result in results)
+    for result in results:
+        if result["status"] != "created":
+            print(f"{result['username']!r}: {result['status']}")
+    print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
@@ -0,0 +1,319 @@
+"""Benchmark of the transform engines on synthetic pregnancy exports.
+
+Usage (from the directory that contains the package)::
+
+    python -m db.benchmark --sizes 10000 100000 --output bench.jsonl
+
+Each engine runs in its own process so that its peak RSS is measured
+independently. The peak RSS is that of the engine's process and of the
+processes it starts (the workers of csv-parallel) together, sampled while
+it runs (see _tree_rss_bytes). One JSON object per (size, engine) is appended to the
+output file, so that successive runs can be compared over time.
+"""
+import argparse
+import csv
+import datetime
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import tempfile
+import threading
+import time
+
+from .transform import ENGINES as TRANSFORM_ENGINES
+
+HEADER = [
+    "Name", "Gender", "Age", "Date_of_Birth", "Hospital_Name", "Last_Checkup_Date",
+    "Last_Checkup_Time", "Weight(kg)", "Blood_Pressure", "Anomaly", "User_Registration_Date",
+    "User_Registration_Time", "No_of_Checkups", "Gestational_Age", "Fetal_Heart_Rate",
+    "Maternal_Mental_Health", "Insurance_Information", "Delivery_Date", "No_of_Missed_Checkups",
+    "Baby_Gender", "Delivery_Type", "Mother_Blood_Type", "Reminder_Date",
+]
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+FIRST_NAMES = ["Theresa", "Tara", "Emily", "Sarah", "Laura", "Megan", "Anna", "Julie", "Maria", "Nicole"]
+SURNAMES = ["Garcia", "Martinez", "Johnson", "Baldwin", "Hill", "Swanson", "Park", "Smith", "Lee", "Brown",
+            "Davis", "Miller", "Wilson", "Moore", "Taylor", "Anderson", "Thomas", "Jackson", "White", "Harris"]
+BLOOD_TYPES = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+DELIVERY_TYPES = ["Home delivery", "Hospital delivery", "C-section"]
+
+
+def generate_csv(csv_file_name, nb_rows, seed=0):
+    """Write a synthetic export with the columns of pregnancies.csv.
+
+    The same (nb_rows, seed) always gives the same file. About 1% of the
+    blood pressures are malformed and about half of the rows have their
+    registration and checkup dates inverted, like the real exports.
+
+    Parameters
+    ----------
+    csv_file_name
+        Name of the CSV file to write.
+    nb_rows
+        Number of data rows.
+    seed
+        Seed of the random generator.
+    """
+    rng = random.Random(seed)
+    year_start = datetime.date(2023, 1, 1)
+    hospitals = [f"{rng.choice(SURNAMES)}-{rng.choice(SURNAMES)}" for _ in range(1000)]
+
+    def day(offset):
+        return (year_start + datetime.timedelta(days=offset)).isoformat()
+
+    def clock():
+        return f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}"
+
+    with open(csv_file_name, "w", encoding="utf-8", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(HEADER)
+        for _ in range(nb_rows):
+            age = rng.randint(18, 45)
+            registration, checkup = rng.randint(150, 220), rng.randint(150, 220)
+            no_of_checkups = rng.randint(5, 20)
+            if rng.random() < 0.01:
+                blood_pressure = rng.choice(["", "n/a", "120", "120/80/1"])
+            else:
+                blood_pressure = f"{rng.randint(85, 190)}/{rng.randint(55, 125)}"
+            writer.writerow([
+                rng.choice(FIRST_NAMES), "Female", age,
+                f"{2023 - age}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                rng.choice(hospitals), day(checkup), clock(), rng.randint(45, 95), blood_pressure,
+                rng.choice(["Yes", "No"]), day(registration), clock(), no_of_checkups,
+                f"{rng.randint(8, 40)} weeks", f"{rng.randint(110, 170)} bpm",
+                rng.choice(["Stable", "Concerns"]), rng.choice(SURNAMES), day(rng.randint(230, 300)),
+                rng.randint(0, no_of_checkups), rng.choice(["Male", "Female"]),
+                rng.choice(DELIVERY_TYPES), rng.choice(BLOOD_TYPES), day(rng.randint(230, 300)),
+            ])
+
+
+def _module(name):
+    """Import a module of the package by its name."""
+    return importlib.import_module(f"{__package__}.{name}" if name else __package__)
+
+
+# name -> (module, function): the engines of transform.ENGINES, and "split",
+# the transform_csv function of the package (the engine chosen by
+# transform.choose_engine). The engines are looked up by name in the worker
+# process.
+ENGINES = {name: (module_name, function_name) for name, (module_name, function_name, _) in TRANSFORM_ENGINES.items()}
+ENGINES["split"] = ("", "transform_csv")
+
+REFERENCE_ENGINE = "csv"
+
+# Interval between two samples of the RSS of an engine and of its workers
+RSS_SAMPLE_SECONDS = 0.02
+
+
+def _tree_rss_bytes(pid):
+    """Return the current RSS of a process and of all its descendants
+    together, in bytes, read from /proc (None where /proc is not available).
+
+    The pages the workers share with their parent after a fork are counted
+    once per process: the sum is an upper bound of the memory used.
+    """
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total, pending = 0, [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/statm", "rb") as infile:
+                total += int(infile.read().split()[1]) * page_size
+            # children of every thread of the process (a Pool starts its workers from a thread)
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children", "rb") as infile:
+                    pending.extend(int(child) for child in infile.read().split())
+        except FileNotFoundError:
+            # a process (or a thread) that just ended; no /proc at all for the first one
+            if pid == os.getpid():
+                return None
+        except OSError:
+            return None
+    return total
+
+
+def _sample_peak_rss(stop, peak):
+    """Keep in peak[0] the largest RSS of this process and its descendants,
+    sampled every RSS_SAMPLE_SECONDS until stop is set (run in a thread)."""
+    while True:
+        rss = _tree_rss_bytes(os.getpid())
+        if rss is None:
+            return
+        peak[0] = max(peak[0], rss)
+        if stop.wait(RSS_SAMPLE_SECONDS):
+            return
+
+
+def _engine_worker(engine, old_csv_file_name, new_csv_file_name, results):
+    """Run one engine and send back its wall time and peak RSS (this process
+    and its workers together, see _tree_rss_bytes)."""
+    module_name, function_name = ENGINES[engine]
+    function = getattr(_module(module_name), function_name)
+
+    stop, peak = threading.Event(), [0]
+    sampler = threading.Thread(target=_sample_peak_rss, args=(stop, peak), daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        function(old_csv_file_name, new_csv_file_name)
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+
+    # ru_maxrss (in KiB on Linux) is the peak of a single process, the
+    # largest worker for the children: a lower bound, used when the samples
+    # missed a short peak or /proc is not available
+    peak_kib = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results.put({"seconds": elapsed, "peak_rss_mib": max(peak_kib * 1024, peak[0]) / 1024 / 1024,
+                 "peak_rss_sampled": peak[0] > 0})
+
+
+def run_engine(engine, old_csv_file_name, new_csv_file_name):
+    """Run an engine in a fresh process.
+
+    Returns
+    -------
+    dict
+        The wall time and the peak RSS of the run, or the error.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_engine_worker, args=(engine, old_csv_file_name, new_csv_file_name, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        return {"error": f"exit code {process.exitcode}"}
+    return results.get()
+
+
+def compare_outputs(reference_file_name, csv_file_name):
+    """Compare the output of an engine with the reference output.
+
+    Only the columns present in both files are compared, so that an engine
+    that does not compute BP_Category can still be checked on the others.
+    The two files are read in lockstep, one row at a time, so that the
+    comparison needs no more memory for 10M rows than for 10k.
+
+    Returns
+    -------
+    dict
+        Whether the outputs are identical, the number of rows that differ on
+        the common columns, the first differing row number (1 = first data
+        row) and the columns missing from the output.
+    """
+    with open(reference_file_name, "r", encoding="utf-8", newline="") as reference_file, \
+            open(csv_file_name, "r", encoding="utf-8", newline="") as infile:
+        reference_reader, reader = csv.reader(reference_file), csv.reader(infile)
+        reference_header, header = next(reference_reader, []), next(reader, [])
+        common = [col for col in reference_header if col in header]
+        reference_indices = [reference_header.index(col) for col in common]
+        indices = [header.index(col) for col in common]
+        missing = [col for col in reference_header if col not in header]
+
+        # A row missing from one of the files (None) counts as a mismatch
+        mismatches, first = 0, None
+        for number, (reference_row, row) in enumerate(itertools.zip_longest(reference_reader, reader), start=1):
+            if (reference_row is None or row is None
+                    or [reference_row[i] for i in reference_indices] != [row[i] for i in indices]):
+                mismatches += 1
+                first = first or number
+    return {
+        "identical": mismatches == 0 and not missing,
+        "mismatched_rows": mismatches,
+        "first_mismatch": first,
+        "missing_columns": missing,
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, engines=None, output_file_name="benchmark.jsonl",
+                  work_dir=None, seed=0):
+    """Run every engine on every size and append the results to a JSON lines file.
+
+    Each result is appended as soon as it is measured (and compared with
+    the reference), so that a crash keeps the results already measured.
+
+    Parameters
+    ----------
+    sizes
+        Numbers of rows of the synthetic inputs.
+    engines
+        Names of the engines to run (keys of ENGINES), all by default.
+    output_file_name
+        File the results are appended to, one JSON object per line.
+    work_dir
+        Directory of the generated files (a temporary directory by default).
+    seed
+        Seed of the synthetic generator.
+
+    Returns
+    -------
+    list
+        The results, as written to the output file.
+    """
+    engines = list(engines or ENGINES)
+    run_id = datetime.datetime.now().isoformat(timespec="seconds")
+    results = []
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for size in sizes:
+            input_file_name = os.path.join(tmp, f"pregnancies_{size}.csv")
+            generate_csv(input_file_name, size, seed)
+
+            # The reference runs first, so that each output can be compared
+            # as soon as it is written
+            outputs = {}
+            for engine in sorted(engines, key=lambda name: name != REFERENCE_ENGINE):
+                outputs[engine] = os.path.join(tmp, f"new_pregnancies_{size}_{engine}.csv")
+                result = {
+                    "run": run_id,
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "cpus": os.cpu_count(),
+                    "rows": size,
+                    "engine": engine,
+                    **run_engine(engine, input_file_name, outputs[engine]),
+                }
+                if "seconds" in result:
+                    result["rows_per_second"] = size / result["seconds"] if result["seconds"] else None
+                reference = outputs.get(REFERENCE_ENGINE)
+                if reference and "error" not in result and os.path.exists(reference):
+                    result["equivalence"] = compare_outputs(reference, outputs[engine])
+                # Only the reference output is kept until the next size
+                if engine != REFERENCE_ENGINE and os.path.exists(outputs[engine]):
+                    os.remove(outputs[engine])
+
+                results.append(result)
+                print(json.dumps(result))
+                with open(output_file_name, "a", encoding="utf-8") as outfile:
+                    outfile.write(json.dumps(result) + "\n")
+
+            for output_file in [input_file_name, *outputs.values()]:
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the transform engines.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=None)
+    parser.add_argument("--output", default="benchmark.jsonl")
+    parser.add_argument("--work-dir", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for result in run_benchmark(args.sizes, args.engines, args.output, args.work_dir, args.seed):
+        equivalence = result.get("equivalence", {})
+        print(f"{result['rows']:>10} {result['engine']:<13} "
+              f"{result.get('seconds', float('nan')):8.2f} s "
+              f"{result.get('peak_rss_mib', float('nan')):8.1f} MiB "
+              f"identical={equivalence.get('identical')}")
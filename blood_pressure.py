@@ -0,0 +1,105 @@
+"""Blood pressure categorisation rules shared by every transform engine.
+
+The rules follow the AHA criteria. They are stored as data in
+BP_THRESHOLDS, from which are derived both the Python predicates (usable on
+plain integers by the CSV engine and on whole numpy/pandas arrays by the
+pandas engine) and the SQL CASE expression of the SQLite engine.
+"""
+import operator
+
+from .validation import is_blood_pressure
+
+UNKNOWN_CATEGORY = "Unknown"
+
+# Ordered rule table: the first rule that matches gives the category.
+# (category, (systolic comparison), "or"/"and", (diastolic comparison))
+BP_THRESHOLDS = [
+    ("Hypertensive Crisis", (">", 180), "or", (">", 120)),
+    ("Hypertension Stage 2", (">=", 140), "or", (">=", 90)),
+    ("Hypertension Stage 1", (">=", 130), "or", (">=", 80)),
+    ("Elevated", (">=", 120), "and", ("<", 80)),
+    ("Normal", ("<", 120), "and", ("<", 80)),
+]
+
+COMPARISONS = {">": operator.gt, ">=": operator.ge, "<": operator.lt}
+# "|" and "&" rather than "or" and "and", so that they also work element-wise on arrays.
+COMBINATIONS = {"or": operator.or_, "and": operator.and_}
+
+
+def _make_rule(systolic_test, combination, diastolic_test):
+    """Build the predicate of a line of BP_THRESHOLDS."""
+    systolic_op, systolic_limit = COMPARISONS[systolic_test[0]], systolic_test[1]
+    diastolic_op, diastolic_limit = COMPARISONS[diastolic_test[0]], diastolic_test[1]
+    combine = COMBINATIONS[combination]
+    return lambda systolic, diastolic: combine(systolic_op(systolic, systolic_limit),
+                                               diastolic_op(diastolic, diastolic_limit))
+
+
+BP_RULES = [(label, _make_rule(*tests)) for label, *tests in BP_THRESHOLDS]
+
+BP_CATEGORIES = [label for label, _ in BP_RULES] + [UNKNOWN_CATEGORY]
+
+
+def bp_category_sql(systolic, diastolic):
+    """Build the SQL CASE expression that categorises a blood pressure.
+
+    Parameters
+    ----------
+    systolic
+        SQL expression of the systolic value (NULL if malformed).
+    diastolic
+        SQL expression of the diastolic value (NULL if malformed).
+
+    Returns
+    -------
+    str
+        The CASE expression. NULL values match no rule and give "Unknown".
+    """
+    whens = [
+        f"WHEN ({systolic} {s_op} {s_limit}) {combination.upper()} ({diastolic} {d_op} {d_limit}) THEN '{label}'"
+        for label, (s_op, s_limit), combination, (d_op, d_limit) in BP_THRESHOLDS
+    ]
+    return "CASE " + " ".join(whens) + f" ELSE '{UNKNOWN_CATEGORY}' END"
+
+
+def blood_pressure_category(systolic, diastolic):
+    """Categorise a parsed blood pressure with the AHA criteria.
+
+    Parameters
+    ----------
+    systolic
+        The systolic value.
+    diastolic
+        The diastolic value.
+
+    Returns
+    -------
+    str
+        The category.
+    """
+    for label, rule in BP_RULES:
+        if rule(systolic, diastolic):
+            return label
+    return UNKNOWN_CATEGORY
+
+
+def categorize_blood_pressure(bp_value):
+    """Categorise a blood pressure value such as "126/75" with the AHA criteria.
+
+    Parameters
+    ----------
+    bp_value
+        The blood pressure, as "systolic/diastolic".
+
+    Returns
+    -------
+    str
+        The category, or "Unknown" if the value cannot be parsed.
+    """
+    # Checked with the pattern of the validation stage rather than by
+    # catching the ValueError of int(), which is slow on dirty exports
+    bp_value = str(bp_value)
+    if not is_blood_pressure(bp_value):
+        return UNKNOWN_CATEGORY
+    systolic, diastolic = bp_value.split("/")
+    return blood_pressure_category(int(systolic), int(diastolic))
@@ -0,0 +1,193 @@
+import collections
+import copy
+import functools
+import sqlite3
+import threading
+import time
+
+from .connection import get_app_config
+
+
+class ResponseCache:
+    """A bounded in-process cache of query results, invalidated when the
+    database changes.
+
+    Entries are evicted in least recently used order once max_size is
+    reached, and expire after ttl seconds. Before each lookup, the cache
+    reads PRAGMA data_version on a connection of its own to the database
+    file: the value changes whenever another connection commits (an ingest,
+    an update through the application, another process...), and the entries
+    of that database are then dropped.
+
+    Every caller gets its own deep copy of a cached value, so a caller that
+    modifies its result does not change what the next callers get.
+
+    Parameters
+    ----------
+    max_size
+        Maximum number of entries.
+    ttl
+        Number of seconds an entry stays valid, None for no limit.
+    """
+
+    def __init__(self, max_size=256, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._watchers = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _database_file(cursor):
+        """Return the file of the main database of a cursor ("" if in memory)."""
+        for _, name, file_name in cursor.connection.execute("PRAGMA database_list"):
+            if name == "main":
+                return file_name or ""
+        return ""
+
+    def _check_version(self, db_file):
+        """Drop the entries of db_file if the database changed since the last
+        check. Must be called with the lock held."""
+        watcher, version = self._watchers.get(db_file, (None, None))
+        if watcher is None:
+            watcher = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=False)
+        current = watcher.execute("PRAGMA data_version").fetchone()[0]
+        if version is not None and current != version:
+            self._drop(db_file)
+            self.invalidations += 1
+        self._watchers[db_file] = (watcher, current)
+
+    def _drop(self, db_file=None):
+        """Remove the entries of a database (of every database if None)."""
+        for key in [key for key in self._entries if db_file is None or key[0] == db_file]:
+            del self._entries[key]
+
+    def get_or_compute(self, cursor, key, compute):
+        """Get a cached value, or compute it and cache it.
+
+        Parameters
+        ----------
+        cursor
+            The object used to query the database the value comes from.
+        key
+            A hashable key identifying the value in this database.
+        compute
+            Function without argument computing the value. A None result
+            (the convention of the db helpers for errors) is not cached.
+
+        Returns
+        -------
+        object
+            The value, a copy of the cached one.
+        """
+        db_file = self._database_file(cursor)
+        if not db_file:
+            # In-memory database: private to its connection, nothing to share
+            with self._lock:
+                self.misses += 1
+            return compute()
+
+        full_key = (db_file, key)
+        with self._lock:
+            self._check_version(db_file)
+            entry = self._entries.get(full_key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+
+        value = compute()
+        if value is None:
+            return value
+
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[full_key] = (expires, copy.deepcopy(value))
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def cached(self, function):
+        """Decorator caching the results of a read-only db helper.
+
+        The helper must take the cursor as one of its positional arguments;
+        the other arguments, which must be hashable, make the key.
+        """
+        @functools.wraps(function)
+        def wrapper(*args):
+            return self.call(function, *args)
+        return wrapper
+
+    def call(self, function, *args):
+        """Call a read-only db helper through the cache (see cached())."""
+        cursor = next(arg for arg in args if isinstance(arg, sqlite3.Cursor))
+        key = (function.__qualname__, tuple(arg for arg in args if arg is not cursor))
+        return self.get_or_compute(cursor, key, lambda: function(*args))
+
+    def invalidate(self):
+        """Drop every entry, whether or not the databases changed."""
+        with self._lock:
+            self._drop()
+            self.invalidations += 1
+
+    def stats(self):
+        """Return the hit/miss counters and the number of entries."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
+
+    def close(self):
+        """Drop the entries and close the connections used to watch the databases."""
+        with self._lock:
+            self._drop()
+            for watcher, _ in self._watchers.values():
+                watcher.close()
+            self._watchers = {}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the response cache of the application, created on first use.
+
+    Its size and TTL are read from the "cache_size" (256 by default) and
+    "cache_ttl" (60 seconds by default) entries of the configuration file.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            app_config = get_app_config() or {}
+            _cache = ResponseCache(int(app_config.get("cache_size", 256)),
+                                   float(app_config.get("cache_ttl", 60)))
+        return _cache
+
+
+def get_response_cache_stats():
+    """Return the counters of the response cache of the application (see
+    ResponseCache.stats), or None if it has not been used yet."""
+    with _cache_lock:
+        cache = _cache
+    return None if cache is None else cache.stats()
+
+
+def cached(function):
+    """Decorator caching a read-only db helper in the response cache of the
+    application (see ResponseCache.cached)."""
+    @functools.wraps(function)
+    def wrapper(*args):
+        return get_response_cache().call(function, *args)
+    return wrapper
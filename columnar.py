@@ -0,0 +1,363 @@
+"""Binary columnar cache of the transformed dataset.
+
+A dataset is a directory with one file per column and a meta.json file
+describing them, written last: a directory without meta.json is a dataset
+whose writing did not finish. Every column is fixed-width, so a reader can memory-map a
+single column and use it without parsing anything:
+
+* numbers (Age, Weight(kg), Checkup, Gestational_Age, Fetal_Heart_Rate)
+  are stored as typed integers or floats ("24 weeks" -> 24, "147 bpm" -> 147);
+* dates are stored as the number of days since 1970-01-01 and times as the
+  number of seconds since midnight;
+* the low-cardinality columns (hospital, blood type, delivery type, ...) are
+  dictionary-encoded: the file holds integer codes and meta.json holds the
+  list of distinct values;
+* the other columns (name, insurance, ...), with about one distinct value
+  per row, are stored as text: the file holds the end offset of each value
+  in a second file of UTF-8 bytes, memory-mapped and decoded only when read,
+  so that opening the dataset does not load them.
+
+Missing or unparsable values are stored as the NULL sentinel of the column
+(the smallest value of the integer type, NaN for floats).
+"""
+import array
+import datetime
+import json
+import math
+import mmap
+import os
+import re
+import sys
+
+META_FILE = "meta.json"
+FORMAT_VERSION = 2
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+DICTIONARY_TYPECODE = "i"
+TEXT_TYPECODE = "q"
+
+# column -> (kind, array typecode). Unlisted columns are stored as text.
+COLUMN_TYPES = {
+    "Age": ("int", "h"),
+    "Weight(kg)": ("float", "d"),
+    "Checkup": ("int", "h"),
+    "Gestational_Age": ("int", "h"),
+    "Fetal_Heart_Rate": ("int", "h"),
+    "Date_of_Birth": ("date", "i"),
+    "Last_Checkup_Date": ("date", "i"),
+    "User_Registration_Date": ("date", "i"),
+    "Delivery_Date": ("date", "i"),
+    "Reminder_Date": ("date", "i"),
+    "Last_Checkup_Time": ("time", "i"),
+    "User_Registration_Time": ("time", "i"),
+    **{
+        name: ("dictionary", DICTIONARY_TYPECODE)
+        for name in ["Hospital_Name", "Anomaly", "Maternal_Mental_Health", "Baby_Gender", "Delivery_Type",
+                     "Mother_Blood_Type", "BP_Category"]
+    },
+}
+
+NULLS = {"h": -2 ** 15, "i": -2 ** 31, "d": math.nan}
+
+# An integer, possibly followed by a unit ("24 weeks", "147 bpm") or by ".0"
+INT_PATTERN = re.compile(r"^\s*([+-]?\d+)(?:\.0*)?(?:\s+[A-Za-z]+)?\s*$")
+FLOAT_PATTERN = re.compile(r"^\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*$")
+DATE_PATTERN = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+TIME_PATTERN = re.compile(r"^(\d{2}):(\d{2}):(\d{2})$")
+
+
+def _parse_int(value, null):
+    match = INT_PATTERN.match(value)
+    if not match:
+        return null
+    number = int(match.group(1))
+    return number if -null > number > null else null
+
+
+def _parse_float(value, null):
+    return float(value) if FLOAT_PATTERN.match(value) else null
+
+
+def _parse_date(value, null):
+    match = DATE_PATTERN.match(value)
+    if not match:
+        return null
+    year, month, day = map(int, match.groups())
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return null
+    try:
+        return datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL
+    except ValueError:
+        return null
+
+
+def _parse_time(value, null):
+    match = TIME_PATTERN.match(value)
+    if not match:
+        return null
+    hours, minutes, seconds = map(int, match.groups())
+    if not (hours <= 23 and minutes <= 59 and seconds <= 59):
+        return null
+    return hours * 3600 + minutes * 60 + seconds
+
+
+PARSERS = {"int": _parse_int, "float": _parse_float, "date": _parse_date, "time": _parse_time}
+
+
+class ColumnarWriter:
+    """Write transformed rows to a columnar dataset, batch by batch.
+
+    Parameters
+    ----------
+    path
+        Directory of the dataset (created if needed).
+    header
+        Names of the columns of the rows.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = list(header)
+        self.nb_rows = 0
+        os.makedirs(path, exist_ok=True)
+        # The previous meta.json would describe the column files being rewritten
+        meta_file = os.path.join(path, META_FILE)
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+
+        self.columns = []
+        for position, name in enumerate(self.header):
+            kind, typecode = COLUMN_TYPES.get(name, ("text", TEXT_TYPECODE))
+            self.columns.append({
+                "name": name,
+                "position": position,
+                "kind": kind,
+                "typecode": typecode,
+                "file": f"{position:03d}.bin",
+                "codes": {} if kind == "dictionary" else None,
+                "data_file": f"{position:03d}.utf8" if kind == "text" else None,
+                "size": 0,
+            })
+        self._files = [open(os.path.join(path, column["file"]), "wb") for column in self.columns]
+        self._data_files = {column["position"]: open(os.path.join(path, column["data_file"]), "wb")
+                            for column in self.columns if column["kind"] == "text"}
+
+    def write_rows(self, rows):
+        """Append rows (sequences of strings, in the order of the header)."""
+        rows = rows if isinstance(rows, list) else list(rows)
+        for column, outfile in zip(self.columns, self._files):
+            position, typecode = column["position"], column["typecode"]
+            values = array.array(typecode)
+            if column["kind"] == "dictionary":
+                codes = column["codes"]
+                for row in rows:
+                    value = row[position]
+                    code = codes.get(value)
+                    if code is None:
+                        code = codes[value] = len(codes)
+                    values.append(code)
+            elif column["kind"] == "text":
+                data = [row[position].encode("utf-8") for row in rows]
+                end = column["size"]
+                for value in data:
+                    end += len(value)
+                    values.append(end)
+                self._data_files[position].write(b"".join(data))
+                column["size"] = end
+            else:
+                parse, null = PARSERS[column["kind"]], NULLS[typecode]
+                for row in rows:
+                    values.append(parse(row[position], null))
+            values.tofile(outfile)
+        self.nb_rows += len(rows)
+
+    def _close_files(self):
+        for outfile in [*self._files, *self._data_files.values()]:
+            outfile.close()
+
+    def close(self):
+        """Flush the column files and write meta.json."""
+        self._close_files()
+
+        meta = {
+            "version": FORMAT_VERSION,
+            "byteorder": sys.byteorder,
+            "rows": self.nb_rows,
+            "columns": [
+                {
+                    "name": column["name"],
+                    "kind": column["kind"],
+                    "typecode": column["typecode"],
+                    "file": column["file"],
+                    "dictionary": list(column["codes"]) if column["kind"] == "dictionary" else None,
+                    "data_file": column["data_file"],
+                }
+                for column in self.columns
+            ],
+        }
+        with open(os.path.join(self.path, META_FILE), "w", encoding="utf-8") as outfile:
+            json.dump(meta, outfile, ensure_ascii=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Incomplete dataset: the files are closed, but without meta.json
+            self._close_files()
+        return False
+
+
+def write_columnar(path, header, rows, batch_size=10000):
+    """Write a whole dataset.
+
+    Parameters
+    ----------
+    path
+        Directory of the dataset.
+    header
+        Names of the columns.
+    rows
+        Iterable of rows (sequences of strings).
+    batch_size
+        Number of rows converted at a time.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    with ColumnarWriter(path, header) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                writer.write_rows(batch)
+                batch = []
+        if batch:
+            writer.write_rows(batch)
+    return writer.nb_rows
+
+
+class ColumnarDataset:
+    """Read a columnar dataset written by ColumnarWriter.
+
+    Columns are memory-mapped on first access; column() returns a typed
+    memoryview over the mapping, without any copy. The bytes of a text
+    column are only mapped when one of its values is read.
+
+    Parameters
+    ----------
+    path
+        Directory of the dataset.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as infile:
+            meta = json.load(infile)
+        if meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"Dataset {path} was written with a {meta['byteorder']}-endian byte order")
+        self.nb_rows = meta["rows"]
+        self.meta = {column["name"]: column for column in meta["columns"]}
+        self._maps = {}
+
+    @property
+    def columns(self):
+        """Names of the columns, in the order of the transformed CSV."""
+        return list(self.meta)
+
+    def __len__(self):
+        return self.nb_rows
+
+    def column(self, name):
+        """Get the raw values of a column.
+
+        Returns
+        -------
+        memoryview
+            Typed values (codes for a dictionary-encoded column, end offsets
+            of the values for a text column), backed by the memory-mapped
+            file.
+        """
+        column = self.meta[name]
+        mapping = self._map(column["file"])
+        if mapping is None:
+            return memoryview(array.array(column["typecode"]))
+        return memoryview(mapping).cast(column["typecode"])
+
+    def _map(self, file):
+        """Memory-map a file of the dataset, once (None if it is empty)."""
+        if file not in self._maps:
+            file_name = os.path.join(self.path, file)
+            if os.path.getsize(file_name) == 0:
+                self._maps[file] = None
+            else:
+                with open(file_name, "rb") as infile:
+                    self._maps[file] = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[file]
+
+    def text(self, name, row):
+        """Get one value of a text column, decoding only its bytes."""
+        offsets = self.column(name)
+        start = offsets[row - 1] if row > 0 else 0
+        data = self._map(self.meta[name]["data_file"]) or b""
+        return data[start:offsets[row]].decode("utf-8")
+
+    def dictionary(self, name):
+        """Get the distinct values of a dictionary-encoded column (None otherwise)."""
+        return self.meta[name]["dictionary"]
+
+    def null(self, name):
+        """Get the NULL sentinel of a column that is not dictionary-encoded."""
+        return NULLS[self.meta[name]["typecode"]]
+
+    def numpy(self, name):
+        """Get a column as a numpy array sharing the memory of the mapping."""
+        import numpy as np
+        return np.frombuffer(self.column(name), dtype=self.meta[name]["typecode"])
+
+    def values(self, name):
+        """Get a column decoded back to Python values (this copies the column).
+
+        Dictionary-encoded and text columns give strings, dates
+        datetime.date, times datetime.time and NULL values None.
+        """
+        column = self.meta[name]
+        raw = self.column(name)
+        if column["kind"] == "dictionary":
+            dictionary = column["dictionary"]
+            return [dictionary[code] for code in raw]
+        if column["kind"] == "text":
+            data, start, values = self._map(column["data_file"]) or b"", 0, []
+            for end in raw:
+                values.append(data[start:end].decode("utf-8"))
+                start = end
+            return values
+
+        null = NULLS[column["typecode"]]
+        if column["kind"] == "float":
+            return [None if math.isnan(value) else value for value in raw]
+        if column["kind"] == "date":
+            return [None if value == null else datetime.date.fromordinal(value + EPOCH_ORDINAL) for value in raw]
+        if column["kind"] == "time":
+            return [None if value == null else datetime.time(value // 3600, value // 60 % 60, value % 60)
+                    for value in raw]
+        return [None if value == null else value for value in raw]
+
+    def close(self):
+        """Close the memory mappings. Views returned by column() must be released first."""
+        for mapping in self._maps.values():
+            if mapping is not None:
+                mapping.close()
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
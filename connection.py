@@ -0,0 +1,340 @@
+import atexit
+import sqlite3
+import threading
+
+from .metrics import METRICS, InstrumentedConnection
+
+
+# Named connection profiles: PRAGMAs applied once when the connection opens.
+#
+# * "default" keeps SQLite's defaults.
+# * "bulk-load" is meant for init_database / populate_database: the rollback
+#   journal stays in memory, fsync is disabled and the page cache is large.
+#   A crash during the load can corrupt the file, so only use it for loads
+#   that can be replayed.
+# * "serve" is meant for the Flask application: WAL lets readers run while a
+#   writer commits, busy_timeout waits for the lock instead of failing with
+#   "database is locked" and mmap_size avoids copying pages on reads.
+PROFILES = {
+    "default": {},
+    "bulk-load": {
+        "journal_mode": "MEMORY",
+        "synchronous": "OFF",
+        "cache_size": -262144,  # 256 MiB (negative values are in KiB)
+        "temp_store": "MEMORY",
+    },
+    "serve": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 268435456,  # 256 MiB
+        "cache_size": -65536,  # 64 MiB
+        "temp_store": "MEMORY",
+    },
+}
+
+# PRAGMAs that change the database file and can't be run on a read-only connection.
+WRITE_PRAGMAS = {"journal_mode"}
+
+
+def apply_profile(conn, profile, read_only=False):
+    """Apply the PRAGMAs of a connection profile.
+
+    Parameters
+    ----------
+    conn
+        The object used to manage the database connection.
+    profile
+        Name of the profile, a key of PROFILES.
+    read_only
+        True if the connection was opened in read-only mode.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown connection profile '{profile}', expected one of {sorted(PROFILES)}")
+
+    for pragma, value in PROFILES[profile].items():
+        if read_only and pragma in WRITE_PRAGMAS:
+            continue
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+_app_config = None
+
+
+def get_app_config():
+    """Load the application configuration once and keep it in memory.
+
+    A failed load is not kept: the configuration is read again on the next
+    call.
+
+    Returns
+    -------
+    dict
+        The application configuration (see utils.load_config), or None if
+        it could not be loaded.
+    """
+    global _app_config
+    if not _app_config:
+        # utils imports Flask and the db package: imported on first use, not
+        # at the top, so that importing the package stays cheap and free of
+        # cycles.
+        import utils
+
+        _app_config = utils.load_config() or None
+    return _app_config
+
+
+def reload_app_config():
+    """Forget the cached configuration so that it is read again."""
+    global _app_config
+    _app_config = None
+
+
+def get_db_connexion(profile=None, read_only=False, check_same_thread=True):
+    """Open a connection to the database of the application.
+
+    Parameters
+    ----------
+    profile
+        Name of the connection profile (see PROFILES). If None, the
+        "db_profile" entry of the configuration file is used, or "default".
+    read_only
+        If True, the database is opened in read-only mode.
+    check_same_thread
+        If False, the connection may be used by another thread than the one
+        that opened it (needed by ConnectionPool).
+
+    The time of the statements is recorded in metrics.METRICS. If the
+    "sql_trace" entry of the configuration is set, every statement run by
+    SQLite (triggers included) is also counted there.
+
+    Returns
+    -------
+    conn
+        The object used to manage the database connection, or None if the
+        configuration could not be loaded.
+    """
+    # Loads the app config into the dictionary app_config.
+    app_config = get_app_config()
+
+    if not app_config:
+        print("Error: while loading the app configuration")
+        return None
+
+    # From the configuration, gets the path to the database file.
+    db_file = app_config["db"]
+    if profile is None:
+        profile = app_config.get("db_profile", "default")
+
+    # Open a connection to the database.
+    if read_only:
+        conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=check_same_thread,
+                               factory=InstrumentedConnection)
+    else:
+        conn = sqlite3.connect(db_file, check_same_thread=check_same_thread, factory=InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    if str(app_config.get("sql_trace", "")).lower() in ("1", "true", "yes"):
+        conn.set_trace_callback(METRICS.trace)
+    apply_profile(conn, profile, read_only)
+
+    return conn
+
+
+def close_db_connexion(cursor, conn):
+    """Close a database connexion and the cursor.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    conn
+        The object used to manage the database connection.
+    """
+    cursor.close()
+    conn.close()
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of SQLite connections.
+
+    A thread that already holds a connection gets the same one back when it
+    calls acquire() again, so the db helpers called by a route share the
+    connection of the request. Idle connections are checked with a trivial
+    query before being handed out and replaced if they are broken.
+
+    Parameters
+    ----------
+    max_size
+        Maximum number of connections open at the same time.
+    profile
+        Connection profile of the connections (see PROFILES).
+    read_only
+        If True, the connections are opened in read-only mode.
+    timeout
+        Number of seconds acquire() waits for a free connection.
+    """
+
+    def __init__(self, max_size=8, profile=None, read_only=False, timeout=10):
+        self.max_size = max_size
+        self.profile = profile
+        self.read_only = read_only
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._local = threading.local()
+        self._closed = False
+
+    def _is_healthy(self, conn):
+        """Return True if the connection can still run a query."""
+        try:
+            conn.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def acquire(self):
+        """Get a connection for the current thread.
+
+        Returns
+        -------
+        conn
+            The object used to manage the database connection.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            return conn
+
+        if self._closed:
+            raise RuntimeError("The connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection available after {self.timeout} s")
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    conn = get_db_connexion(self.profile, self.read_only, check_same_thread=False)
+                    if conn is None:
+                        raise RuntimeError("Error: while opening a database connection")
+                elif not self._is_healthy(conn):
+                    conn.close()
+                    conn = None
+        except BaseException:
+            self._slots.release()
+            raise
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, force=False):
+        """Give the connection of the current thread back to the pool.
+
+        An unfinished transaction is rolled back so that the next user gets
+        a clean connection.
+
+        Parameters
+        ----------
+        force
+            If True, the connection is given back even if some nested
+            acquire() were not released (used at the end of a request).
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.depth = 0 if force else self._local.depth - 1
+        if self._local.depth > 0:
+            return
+
+        self._local.conn = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            reusable = True
+        except sqlite3.Error:
+            # Broken (or closed by the caller) connection: do not keep it
+            reusable = False
+
+        with self._lock:
+            if reusable and not self._closed:
+                self._idle.append(conn)
+            else:
+                conn.close()
+        self._slots.release()
+
+    def connection(self):
+        """Context manager that acquires a connection and releases it."""
+        return _PooledConnection(self)
+
+    def close_all(self):
+        """Close the idle connections and refuse new acquisitions.
+
+        Connections still in use are closed when they are released.
+        """
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class _PooledConnection:
+    """Context manager returned by ConnectionPool.connection()."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        return self.pool.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release()
+        return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the connection pool of the application, created on first use
+    with the "serve" profile.
+
+    The size of the pool is read from the "db_pool_size" entry of the
+    configuration file (8 by default).
+
+    Raises
+    ------
+    RuntimeError
+        If the configuration could not be loaded.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            app_config = get_app_config()
+            if not app_config:
+                raise RuntimeError("Error: while loading the app configuration")
+            _pool = ConnectionPool(int(app_config.get("db_pool_size", 8)), profile="serve")
+            atexit.register(_pool.close_all)
+        return _pool
+
+
+def init_app(app):
+    """Release the connection of a request when the Flask application context
+    is torn down.
+
+    Parameters
+    ----------
+    app
+        The Flask application.
+    """
+    pool = get_pool()
+
+    @app.teardown_appcontext
+    def release_db_connexion(exception):
+        # Whatever the helpers forgot to release, the request is over
+        pool.release(force=True)
@@ -0,0 +1,126 @@
+"""Correction of the inverted registration/checkup dates, shared by the engines.
+
+Some exports have User_Registration_Date after Last_Checkup_Date. The dates
+(and the matching times) are then swapped.
+
+Dates are expected in the ISO format YYYY-MM-DD. For such zero-padded
+strings the lexicographic order is the chronological order, so the dates are
+compared as plain strings, without parsing them. The format is checked
+separately, for a whole batch or column at a time, and malformed dates are
+counted in a report instead of changing the way a row is handled.
+"""
+import re
+
+ISO_DATE_PATTERN = r"\d{4}-\d{2}-\d{2}"
+_is_iso_date = re.compile(ISO_DATE_PATTERN).fullmatch
+
+
+def new_report():
+    """Return an empty date correction report."""
+    return {"rows": 0, "swapped": 0, "malformed_dates": 0}
+
+
+def merge_reports(report, other):
+    """Add the counts of other to report."""
+    for key, value in other.items():
+        report[key] = report.get(key, 0) + value
+    return report
+
+
+def print_report(report):
+    """Warn about the malformed dates of a report, if any."""
+    if report["malformed_dates"]:
+        print(f"Warning: {report['malformed_dates']} malformed date(s) in {report['rows']} rows "
+              f"(expected YYYY-MM-DD), compared as text")
+
+
+def date_indices(header):
+    """Get the positions of the date and time columns in a CSV header."""
+    return {
+        "reg_date": header.index("User_Registration_Date"),
+        "reg_time": header.index("User_Registration_Time"),
+        "checkup_date": header.index("Last_Checkup_Date"),
+        "checkup_time": header.index("Last_Checkup_Time"),
+    }
+
+
+def count_malformed(values):
+    """Count the values that are not ISO YYYY-MM-DD dates."""
+    return sum(1 for value in values if not _is_iso_date(value))
+
+
+def correct_dates(rows, indices, report=None):
+    """Swap in place the registration and checkup date/time of the rows where
+    the registration date is after the checkup date.
+
+    Parameters
+    ----------
+    rows
+        A batch of rows (lists of strings).
+    indices
+        Positions of the columns, as returned by date_indices().
+    report
+        If given, a report (see new_report()) updated with the counts.
+
+    Returns
+    -------
+    int
+        Number of rows whose dates were swapped.
+    """
+    reg_date, checkup_date = indices["reg_date"], indices["checkup_date"]
+    reg_time, checkup_time = indices["reg_time"], indices["checkup_time"]
+
+    swapped = 0
+    for row in rows:
+        if row[reg_date] > row[checkup_date]:
+            row[reg_date], row[checkup_date] = row[checkup_date], row[reg_date]
+            row[reg_time], row[checkup_time] = row[checkup_time], row[reg_time]
+            swapped += 1
+
+    if report is not None:
+        report["rows"] += len(rows)
+        report["swapped"] += swapped
+        report["malformed_dates"] += (count_malformed(row[reg_date] for row in rows)
+                                      + count_malformed(row[checkup_date] for row in rows))
+    return swapped
+
+
+def correct_dates_dataframe(df, report=None):
+    """Vectorized version of correct_dates for a pandas DataFrame.
+
+    The date columns may hold ISO strings or datetime64 values (see
+    With_Pandas.read_typed_csv); missing dates never trigger a swap in the
+    datetime64 case, and compare as "" in the text case, like in the CSV
+    engine.
+
+    Parameters
+    ----------
+    df
+        The DataFrame, modified in place.
+    report
+        If given, a report (see new_report()) updated with the counts.
+
+    Returns
+    -------
+    DataFrame
+        The DataFrame.
+    """
+    reg, checkup = df["User_Registration_Date"], df["Last_Checkup_Date"]
+    if reg.dtype.kind == "M":
+        mask = (reg > checkup).to_numpy(dtype=bool)
+        malformed = int(reg.isna().sum() + checkup.isna().sum())
+    else:
+        reg, checkup = reg.fillna("").astype(str), checkup.fillna("").astype(str)
+        mask = (reg > checkup).to_numpy(dtype=bool)
+        malformed = int((~reg.str.fullmatch(ISO_DATE_PATTERN)).sum()
+                        + (~checkup.str.fullmatch(ISO_DATE_PATTERN)).sum())
+
+    if mask.any():
+        df.loc[mask, ["User_Registration_Date", "Last_Checkup_Date"]] = df.loc[mask, ["Last_Checkup_Date", "User_Registration_Date"]].values
+        df.loc[mask, ["User_Registration_Time", "Last_Checkup_Time"]] = df.loc[mask, ["Last_Checkup_Time", "User_Registration_Time"]].values
+
+    if report is not None:
+        report["rows"] += len(df)
+        report["swapped"] += int(mask.sum())
+        report["malformed_dates"] += malformed
+    return df
@@ -0,0 +1,346 @@
+"""Background ingestion of raw exports.
+
+A JobQueue runs ingestion jobs (transform + load of a raw export, see
+With_Pandas.ingest_raw_csv) in a small pool of worker threads, so that a
+Flask route can accept a new export and answer immediately. The state of
+each job (queued, running, done or failed), the number of rows loaded so
+far, the throughput and the errors can be read at any time with get().
+
+init_app() adds the routes of an application to upload an export
+(POST /uploads, answered at once with the id of the job) and to poll the
+status of its job (GET /uploads/<job_id>).
+
+SQLite allows a single writer at a time, so one worker (the default) is
+usually the right size: more jobs are queued, not run side by side. Each
+chunk of an export is committed on its own, so the routes can still write
+between two chunks of a running job.
+"""
+import csv
+import datetime
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .connection import close_db_connexion, get_app_config, get_db_connexion
+from .With_Pandas import ingest_raw_csv
+
+# Columns a raw export must have
+REQUIRED_COLUMNS = {
+    "Name", "Hospital_Name", "Last_Checkup_Date", "Last_Checkup_Time", "Blood_Pressure",
+    "User_Registration_Date", "User_Registration_Time", "No_of_Checkups", "No_of_Missed_Checkups",
+}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def check_header(header):
+    """Check the header of a raw export.
+
+    Returns
+    -------
+    list
+        The required columns missing from the header (empty if it is valid).
+    """
+    return sorted(REQUIRED_COLUMNS - set(header))
+
+
+class JobQueue:
+    """Queue of ingestion jobs run by background threads.
+
+    Parameters
+    ----------
+    upload_dir
+        Directory where the uploaded exports are saved.
+    workers
+        Number of jobs run at the same time.
+    profile
+        Connection profile of the workers (see connection.PROFILES); None for
+        the profile of the configuration file.
+    chunk_size
+        Number of rows transformed and loaded at a time.
+    max_jobs
+        Number of finished jobs whose status is kept.
+    """
+
+    def __init__(self, upload_dir="./data/uploads", workers=1, profile=None, chunk_size=100000, max_jobs=100):
+        self.upload_dir = upload_dir
+        self.profile = profile
+        self.chunk_size = chunk_size
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, raw_csv_file_name, remove=False):
+        """Queue the ingestion of a raw export already on disk.
+
+        Parameters
+        ----------
+        raw_csv_file_name
+            Name of the raw export.
+        remove
+            If True, the file is deleted once the job has succeeded. The
+            file of a failed job is kept, with the offset reached in the
+            Ingestion table, so that retry() resumes where it stopped.
+
+        Returns
+        -------
+        str
+            The id of the job.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "source": raw_csv_file_name,
+            "state": QUEUED,
+            "submitted_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "rows": 0,
+            "rows_per_second": None,
+            "report": None,
+            "errors": [],
+            "remove": remove,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def retry(self, job_id):
+        """Queue again the ingestion of a failed job: it resumes after the
+        last chunk the failed job committed.
+
+        Returns
+        -------
+        str
+            The id of the new job, or None if there is no such failed job.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] != FAILED:
+                return None
+        return self.submit(job["source"], job["remove"])
+
+    def submit_upload(self, stream, filename="upload.csv"):
+        """Save an uploaded raw export and queue its ingestion. The saved
+        file is deleted once the job has succeeded (see submit).
+
+        Parameters
+        ----------
+        stream
+            Binary file-like object of the export (e.g. a werkzeug FileStorage).
+        filename
+            Name of the uploaded file, only kept for information.
+
+        Returns
+        -------
+        str
+            The id of the job.
+
+        Raises
+        ------
+        ValueError
+            If the file is not a CSV export with the required columns.
+        """
+        os.makedirs(self.upload_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(filename))[0] or "upload"
+        path = os.path.join(self.upload_dir, f"{uuid.uuid4().hex}_{stem}.csv")
+
+        with open(path, "wb") as outfile:
+            first_line = stream.readline()
+            try:
+                header = next(csv.reader(io.StringIO(first_line.decode("utf-8-sig"))), [])
+            except UnicodeDecodeError:
+                header = []
+            missing = check_header(header)
+            if missing:
+                outfile.close()
+                os.remove(path)
+                raise ValueError(f"Not a pregnancies export, missing columns: {', '.join(missing)}")
+            outfile.write(first_line)
+            while True:
+                block = stream.read(1024 * 1024)
+                if not block:
+                    break
+                outfile.write(block)
+
+        return self.submit(path, remove=True)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run(self, job_id):
+        """Run a job in a worker thread, then delete its source if it
+        succeeded and the job was submitted with remove."""
+        with self._lock:
+            source, remove = self._jobs[job_id]["source"], self._jobs[job_id]["remove"]
+        start = time.perf_counter()
+        self._update(job_id, state=RUNNING, started_at=_now())
+
+        def progress(nb_rows):
+            elapsed = time.perf_counter() - start
+            self._update(job_id, rows=nb_rows, rows_per_second=nb_rows / elapsed if elapsed > 0 else None)
+
+        conn = None
+        try:
+            conn = get_db_connexion(self.profile)
+            if conn is None:
+                raise RuntimeError("Error: while opening a database connection")
+            cursor = conn.cursor()
+            report = ingest_raw_csv(cursor, conn, source, self.chunk_size, progress=progress)
+            close_db_connexion(cursor, conn)
+            self._update(job_id, state=DONE, finished_at=_now(), report=report,
+                         rows=report["rows"], rows_per_second=report["rows_per_second"])
+            if remove:
+                try:
+                    os.remove(source)
+                except OSError as e:
+                    print(f"Error while deleting {source}:", e)
+        except Exception as e:
+            if conn is not None:
+                conn.close()
+            print(f"Error during the ingestion of {source}:", e)
+            with self._lock:
+                job = self._jobs[job_id]
+                job.update(state=FAILED, finished_at=_now())
+                job["errors"].append(f"{type(e).__name__}: {e}")
+
+    def _forget_old_jobs(self):
+        """Drop the oldest finished jobs beyond max_jobs. Must be called with the lock held."""
+        finished = [job_id for job_id, job in self._jobs.items() if job["state"] in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Get the status of a job.
+
+        Returns
+        -------
+        dict
+            A copy of the job: id, source, state, submission/start/end
+            dates, rows loaded so far, throughput, final report, errors and
+            whether the source is deleted on success, or None if there is no
+            such job.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else {**job, "errors": list(job["errors"])}
+
+    def status(self, job_id):
+        """Get the status of a job as shown to the clients: get() without
+        the path of the export on the server and the remove flag.
+
+        Returns
+        -------
+        dict
+            The status of the job, or None if there is no such job.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            del job["source"], job["remove"]
+        return job
+
+    def list(self):
+        """Get the status of every known job, oldest first."""
+        with self._lock:
+            return [{**job, "errors": list(job["errors"])} for job in self._jobs.values()]
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; if wait, return once the queued jobs are done."""
+        self._executor.shutdown(wait=wait)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the ingestion queue of the application, created on first use.
+
+    The upload directory is read from the "upload_dir" entry of the
+    configuration file (./data/uploads by default).
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            app_config = get_app_config() or {}
+            _queue = JobQueue(app_config.get("upload_dir", "./data/uploads"))
+        return _queue
+
+
+def init_app(app, queue=None):
+    """Add the upload and job status routes to a Flask application.
+
+    * POST /uploads: a raw export, in the "file" field of a multipart form,
+      is saved and its ingestion queued (see JobQueue.submit_upload); the
+      answer (202) gives the id of the job and the URL of its status;
+    * GET /uploads/<job_id>: the status of the job (see JobQueue.status).
+
+    Both routes need an analyst token, checked by utils.token_required like
+    the other protected routes.
+
+    Parameters
+    ----------
+    app
+        The Flask application.
+    queue
+        The JobQueue of the routes (by default, get_job_queue()).
+    """
+    from flask import jsonify, request
+
+    # utils imports Flask and the db package: imported here, not at module level
+    import utils
+
+    def job_queue():
+        return queue if queue is not None else get_job_queue()
+
+    @utils.token_required
+    def upload_export():
+        """Upload a raw export and queue its ingestion.
+
+        Returns
+        -------
+        data
+            The id of the job and the URL of its status, or an error message.
+        status_code
+            202 if the ingestion is queued
+            400 if there is no file or it is not a pregnancies export
+        """
+        upload = request.files.get("file")
+        if upload is None:
+            return "Error: no file in the 'file' field", 400
+        try:
+            job_id = job_queue().submit_upload(upload.stream, upload.filename or "upload.csv")
+        except ValueError as e:
+            return f"Error: {e}", 400
+        return jsonify({"job_id": job_id, "status_url": f"/uploads/{job_id}"}), 202
+
+    @utils.token_required
+    def get_upload_status(job_id):
+        """Get the status of the ingestion job of an upload.
+
+        Returns
+        -------
+        data
+            The status of the job (see JobQueue.status), or an error message.
+        status_code
+            200 if the job is known
+            404 otherwise (unknown id, or finished too long ago)
+        """
+        status = job_queue().status(job_id)
+        if status is None:
+            return "This job does not exist", 404
+        return jsonify(status), 200
+
+    app.route("/uploads", methods=["POST"])(upload_export)
+    app.route("/uploads/<job_id>", methods=["GET"])(get_upload_status)
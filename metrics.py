@@ -0,0 +1,272 @@
+"""Instrumentation of the pipeline, of the SQL queries and of the routes.
+
+Three kinds of measures are collected in the process-wide registry METRICS:
+
+* stages: the duration and row count of each step of the transform and
+  load pipeline ("read", "date_fix", "categorize", "write",
+  "insert.CheckupData", ...), recorded with the stage() context manager;
+* sql: the number of executions and the time spent in each statement,
+  keyed by the statement with its literals replaced by "?". The time is
+  measured around execute/executemany by the connections of
+  InstrumentedConnection (see connection.get_db_connexion); when the
+  "sql_trace" entry of the configuration is set, the trace callback of
+  sqlite3 also counts every statement SQLite runs, including the ones run
+  by triggers;
+* requests: a latency histogram per route, filled by init_app().
+
+snapshot() returns all of them as a dict, which init_app() serves on /metrics
+to the authenticated analysts.
+"""
+import bisect
+import functools
+import math
+import re
+import sqlite3
+import threading
+import time
+
+# Upper bounds, in seconds, of the buckets of the request latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w\"])[+-]?\d+(?:\.\d+)?(?![\w\"])")
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Normalize a statement so that its executions with different values
+    are counted together: literals become "?", lists of placeholders become
+    "(...)" and white space is collapsed."""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(...)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+class Metrics:
+    """Thread-safe registry of the measures of the application."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget every measure."""
+        with self._lock:
+            self._stages = {}
+            self._queries = {}
+            self._statements = {}
+            self._requests = {}
+
+    def record_stage(self, name, seconds, rows=0):
+        """Count one run of a pipeline stage."""
+        with self._lock:
+            stage = self._stages.setdefault(name, {"count": 0, "seconds": 0.0, "rows": 0})
+            stage["count"] += 1
+            stage["seconds"] += seconds
+            stage["rows"] += rows or 0
+
+    def stage(self, name, rows=0, stages=None):
+        """Context manager timing a pipeline stage.
+
+        Parameters
+        ----------
+        name
+            Name of the stage.
+        rows
+            Number of rows processed, can also be set on the returned object
+            (stage.rows = ...) once known.
+        stages
+            If given, dict (e.g. the "stages" entry of an ingest report) where
+            the duration and rows of this run are also added under name.
+        """
+        return _Stage(self, name, rows, stages)
+
+    def record_query(self, sql, seconds):
+        """Count one execution of a statement that took seconds."""
+        key = normalize_sql(sql)
+        with self._lock:
+            query = self._queries.setdefault(key, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            query["count"] += 1
+            query["seconds"] += seconds
+            query["max_seconds"] = max(query["max_seconds"], seconds)
+
+    def trace(self, sql):
+        """Trace callback of sqlite3 (Connection.set_trace_callback): count a statement run by SQLite."""
+        key = normalize_sql(sql)
+        with self._lock:
+            self._statements[key] = self._statements.get(key, 0) + 1
+
+    def record_request(self, route, seconds, status=200):
+        """Count one request of a route in its latency histogram."""
+        with self._lock:
+            histogram = self._requests.setdefault(route, {
+                "count": 0, "seconds": 0.0, "errors": 0, "buckets": [0] * len(LATENCY_BUCKETS),
+            })
+            histogram["count"] += 1
+            histogram["seconds"] += seconds
+            histogram["errors"] += status >= 500
+            histogram["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def snapshot(self):
+        """Return a copy of every measure.
+
+        Returns
+        -------
+        dict
+            "stages" and "sql" (name -> count, total seconds...), sorted by
+            decreasing total time, "sql_statements" (statement -> number of
+            runs seen by the trace callback) and "requests" (route -> count,
+            total seconds, number of 5xx and the histogram as a dict upper
+            bound -> number of requests, cumulative like Prometheus buckets).
+        """
+        with self._lock:
+            requests = {}
+            for route, histogram in self._requests.items():
+                cumulative, buckets = 0, {}
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    cumulative += count
+                    buckets["+Inf" if bound == math.inf else str(bound)] = cumulative
+                requests[route] = {**histogram, "buckets": buckets}
+            return {
+                "stages": dict(sorted(((name, dict(stage)) for name, stage in self._stages.items()),
+                                      key=lambda item: -item[1]["seconds"])),
+                "sql": dict(sorted(((sql, dict(query)) for sql, query in self._queries.items()),
+                                   key=lambda item: -item[1]["seconds"])),
+                "sql_statements": dict(self._statements),
+                "requests": requests,
+            }
+
+
+class _Stage:
+    """Context manager returned by Metrics.stage()."""
+
+    def __init__(self, metrics, name, rows, stages):
+        self.metrics = metrics
+        self.name = name
+        self.rows = rows
+        self.stages = stages
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        self.metrics.record_stage(self.name, seconds, self.rows)
+        if self.stages is not None:
+            stage = self.stages.setdefault(self.name, {"seconds": 0.0, "rows": 0})
+            stage["seconds"] += seconds
+            stage["rows"] += self.rows or 0
+        return False
+
+
+METRICS = Metrics()
+
+
+def stage(name, rows=0, stages=None):
+    """Time a pipeline stage in METRICS (see Metrics.stage)."""
+    return METRICS.stage(name, rows, stages)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor recording the time of its statements in METRICS."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            METRICS.record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            METRICS.record_query(sql, time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            METRICS.record_query(sql_script, time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors are InstrumentedCursor (pass it as the
+    factory argument of sqlite3.connect)."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute() creates its cursor without calling cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def init_app(app):
+    """Record the latency of every route of a Flask application and serve
+    the measures on /metrics.
+
+    /metrics needs an analyst token, checked by utils.token_required like
+    the other protected routes, unless the "metrics_public" entry of the
+    configuration is "1", "true" or "yes" (e.g. for a scraper inside a
+    private network).
+
+    Parameters
+    ----------
+    app
+        The Flask application.
+    """
+    from flask import g, jsonify, request
+
+    from .auth import AUTH_LATENCY
+    from .cache import get_response_cache_stats
+    from .connection import get_app_config
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_latency(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            # The route, not the URL: /<int:pregnancy_id> rather than /42
+            route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            METRICS.record_request(f"{request.method} {route}", time.perf_counter() - start, response.status_code)
+        return response
+
+    def get_metrics():
+        """Get the measures of the application.
+
+        Returns
+        -------
+        data
+            The snapshot of METRICS, the latency of the authentication and
+            the counters of the response cache.
+        status_code
+            200
+        """
+        data = METRICS.snapshot()
+        data["auth"] = AUTH_LATENCY.snapshot()
+        data["cache"] = get_response_cache_stats()
+        return jsonify(data), 200
+
+    app_config = get_app_config() or {}
+    if str(app_config.get("metrics_public", "")).lower() not in ("1", "true", "yes"):
+        # utils imports Flask and the db package: imported here, not at module level
+        import utils
+
+        get_metrics = utils.token_required(get_metrics)
+    app.route("/metrics")(get_metrics)
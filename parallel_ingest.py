@@ -0,0 +1,194 @@
+"""Ingestion of many raw exports at once: parallel parsing, a single writer.
+
+SQLite allows a single writer, but most of the time of an ingestion is spent
+reading and transforming the CSV files, which is independent from one file
+to the next. ingest_files() therefore runs the parsing and the
+transformation (With_Pandas.iter_typed_csv + transform_dataframe) of the
+files in a pool of processes. The typed DataFrames are handed over a bounded
+queue to the calling process, the only one that writes to the database: it
+assigns the ids and inserts the rows (With_Pandas._load_dataframe) in one
+large transaction. When the writer falls behind, the queue fills up and the
+workers block, so at most queue_size chunks are in memory whatever the
+number and the size of the files.
+"""
+import csv
+import multiprocessing
+import os
+import queue
+import time
+
+from .dates import merge_reports, new_report
+from .jobs import check_header
+from .metrics import stage
+from .With_Pandas import _ingest_report, _load_dataframe, iter_typed_csv, transform_dataframe
+
+# Messages sent by the workers to the writer
+_CHUNK, _DONE, _ERROR, _EXIT = "chunk", "done", "error", "exit"
+
+
+def _merge_stages(total, stages):
+    """Add the time and rows of each stage of stages to total."""
+    for name, values in stages.items():
+        stage_total = total.setdefault(name, {"seconds": 0.0, "rows": 0})
+        stage_total["seconds"] += values["seconds"]
+        stage_total["rows"] += values["rows"]
+
+
+def _parse_files(tasks, results, chunk_size):
+    """Parse and transform files until the None sentinel (run in a worker process).
+
+    Each file is read chunk_size rows at a time; every transformed chunk is
+    put on results, which blocks while the queue is full.
+    """
+    for index, raw_csv_file_name in iter(tasks.get, None):
+        start_time = time.perf_counter()
+        dates_report, stages, nb_rows = new_report(), {}, 0
+        try:
+            chunks = iter_typed_csv(raw_csv_file_name, chunk_size)
+            while True:
+                with stage("read", stages=stages) as step:
+                    chunk = next(chunks, None)
+                    step.rows = 0 if chunk is None else len(chunk)
+                if chunk is None:
+                    break
+                df = transform_dataframe(chunk, dates_report, stages)
+                nb_rows += len(df)
+                results.put((_CHUNK, index, df))
+        except Exception as e:
+            results.put((_ERROR, index, f"{type(e).__name__}: {e}"))
+            continue
+        results.put((_DONE, index, (nb_rows, dates_report, stages, time.perf_counter() - start_time)))
+    results.put((_EXIT, None, None))
+
+
+def _read_header(raw_csv_file_name):
+    """Return the header of a CSV file (an empty list if it is empty)."""
+    with open(raw_csv_file_name, newline="", encoding="utf-8-sig") as infile:
+        return next(csv.reader(infile), [])
+
+
+def ingest_files(cursor, conn, raw_csv_file_names, workers=None, chunk_size=100000, batch_size=10000,
+                 queue_size=None, progress=None):
+    """Transform and load many raw exports, parsing them in parallel.
+
+    The files are parsed and transformed by a pool of processes and loaded
+    by the calling process, through cursor, in a single transaction: a
+    failed ingestion leaves the database unchanged.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    conn
+        The object used to manage the database connection.
+    raw_csv_file_names
+        Names of the original (not transformed) CSV files.
+    workers
+        Number of parsing processes (by default, the number of cores, at
+        most one per file).
+    chunk_size
+        Number of rows transformed and handed to the writer at a time.
+    batch_size
+        Number of rows sent to the database in each executemany call.
+    queue_size
+        Maximum number of transformed chunks waiting for the writer (by
+        default, two per worker).
+    progress
+        If given, function called after each chunk with the number of rows
+        loaded so far.
+
+    Returns
+    -------
+    dict
+        A report like the one of With_Pandas.ingest_raw_csv (the stages of
+        the workers are added together), with the number of seconds the
+        writer waited for the workers ("writer_idle_seconds", close to 0 when
+        the writer is the bottleneck) and, in "files", the report of each
+        file: rows and rows inserted per table, date corrections and
+        parsing time.
+
+    Raises
+    ------
+    ValueError
+        If a file is not a pregnancies export.
+    RuntimeError
+        If a file can't be parsed or a worker dies.
+    sqlite3.Error, OSError
+        If the rows can't be loaded; the transaction is rolled back.
+    """
+    start_time = time.perf_counter()
+    raw_csv_file_names = list(raw_csv_file_names)
+
+    # Check the headers before starting anything
+    for raw_csv_file_name in raw_csv_file_names:
+        missing = check_header(_read_header(raw_csv_file_name))
+        if missing:
+            raise ValueError(f"{raw_csv_file_name} is not a pregnancies export, missing columns: {', '.join(missing)}")
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(raw_csv_file_names)))
+    files = [{"file": name, "rows": 0} for name in raw_csv_file_names]
+    report, dates_report, stages, nb_rows, idle = {}, new_report(), {}, 0, 0.0
+
+    context = multiprocessing.get_context()
+    tasks = context.Queue()
+    results = context.Queue(queue_size or 2 * workers)
+    for task in enumerate(raw_csv_file_names):
+        tasks.put(task)
+    for _ in range(workers):
+        tasks.put(None)
+    processes = [context.Process(target=_parse_files, args=(tasks, results, chunk_size), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    try:
+        cursor.execute("BEGIN")
+        running = workers
+        while running:
+            wait_start = time.perf_counter()
+            try:
+                kind, index, payload = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    raise RuntimeError("A parsing process died before the end of the ingestion")
+                continue
+            finally:
+                idle += time.perf_counter() - wait_start
+
+            if kind == _EXIT:
+                running -= 1
+            elif kind == _ERROR:
+                raise RuntimeError(f"Error while parsing {raw_csv_file_names[index]}: {payload}")
+            elif kind == _CHUNK:
+                file_report = files[index]
+                counts = _load_dataframe(cursor, payload, batch_size, stages)
+                for table, count in counts.items():
+                    report[table] = report.get(table, 0) + count
+                    file_report[table] = file_report.get(table, 0) + count
+                file_report["rows"] += len(payload)
+                nb_rows += len(payload)
+                if progress is not None:
+                    progress(nb_rows)
+            else:
+                _, file_dates_report, file_stages, seconds = payload
+                merge_reports(dates_report, file_dates_report)
+                _merge_stages(stages, file_stages)
+                files[index].update(swapped_dates=file_dates_report["swapped"],
+                                    malformed_dates=file_dates_report["malformed_dates"], parse_seconds=seconds)
+
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+
+    # Planner statistics, only recomputed if needed
+    cursor.execute("PRAGMA optimize")
+
+    report.update(swapped_dates=dates_report["swapped"], malformed_dates=dates_report["malformed_dates"],
+                  writer_idle_seconds=idle, files=files)
+    return _ingest_report(report, nb_rows, start_time, stages)
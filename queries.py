@@ -0,0 +1,473 @@
+import json
+import re
+import sqlite3
+
+from .cache import cached
+
+
+# Queries run by the application on the Pregnancies 2023 database, with the
+# tables each of them is allowed to scan entirely. check_query_plans() fails
+# on any other full table scan, so a schema change that drops an index used
+# by one of these access paths is caught. Rows are read through the views of
+# create_database, which give the enum-like columns and the blood pressure
+# as text.
+QUERIES = {
+    # Aggregates read from the summary tables (see summaries.py): one row per group
+    "hospital_pregnancies_count": {
+        "sql": "SELECT NULLIF(hospital_id, 0), pregnancies FROM HospitalSummary WHERE pregnancies > 0",
+        "params": (),
+        "allowed_scans": {"HospitalSummary"},
+    },
+    "hospital_checkups_done": {
+        "sql": """
+            SELECT NULLIF(hospital_id, 0), checkups_done_total, checkups_done_count
+            FROM HospitalSummary
+            WHERE checkups_done_count > 0
+        """,
+        "params": (),
+        "allowed_scans": {"HospitalSummary"},
+    },
+    "bp_category_distribution": {
+        "sql": """
+            SELECT BPCategory.label, BPCategorySummary.checkups, BPCategorySummary.anomalies,
+                BPCategorySummary.anomaly_known
+            FROM BPCategorySummary
+            LEFT JOIN BPCategory ON BPCategory.id = BPCategorySummary.bp_category_id
+            WHERE BPCategorySummary.checkups > 0
+        """,
+        "params": (),
+        "allowed_scans": {"BPCategorySummary"},
+    },
+    # Covering indexes: WomanData(hospital_id) then PregnancyData(woman_id), no table read
+    "hospital_pregnancy_count": {
+        "sql": """
+            SELECT COUNT(*) AS count
+            FROM PregnancyData
+            JOIN WomanData ON WomanData.id = PregnancyData.woman_id
+            WHERE WomanData.hospital_id = ?
+        """,
+        "params": (1,),
+        "allowed_scans": set(),
+    },
+    "pregnancy": {
+        "sql": "SELECT * FROM Pregnancy WHERE id = ?",
+        "params": (1,),
+        "allowed_scans": set(),
+    },
+    "pregnancy_woman": {
+        "sql": """
+            SELECT Woman.*
+            FROM Woman
+            JOIN PregnancyData ON Woman.id = PregnancyData.woman_id
+            WHERE PregnancyData.id = ?
+        """,
+        "params": (1,),
+        "allowed_scans": set(),
+    },
+    "pregnancy_checkups": {
+        "sql": "SELECT * FROM Checkup WHERE pregnancy_id = ?",
+        "params": (1,),
+        "allowed_scans": set(),
+    },
+    "woman_pregnancies": {
+        "sql": "SELECT * FROM Pregnancy WHERE woman_id = ?",
+        "params": (1,),
+        "allowed_scans": set(),
+    },
+    "hospital_women": {
+        "sql": "SELECT * FROM Woman WHERE hospital_id = ?",
+        "params": (1,),
+        "allowed_scans": set(),
+    },
+    "analyst_pregnancies": {
+        "sql": "SELECT * FROM Pregnancy WHERE analyst_id = ?",
+        "params": (1,),
+        "allowed_scans": set(),
+    },
+    "checkups_by_bp_category": {
+        "sql": "SELECT * FROM Checkup WHERE bp_category = ?",
+        "params": ("Normal",),
+        "allowed_scans": set(),
+    },
+    "checkups_by_systolic": {
+        "sql": "SELECT * FROM Checkup WHERE id IN (SELECT id FROM CheckupData WHERE systolic BETWEEN ? AND ?)",
+        "params": (140, 180),
+        "allowed_scans": set(),
+    },
+    "analyst": {
+        "sql": "SELECT * FROM analyst WHERE username = ?",
+        "params": ("hubert",),
+        "allowed_scans": set(),
+    },
+    "pregnancies": {
+        "sql": "SELECT * FROM Pregnancy",
+        "params": (),
+        "allowed_scans": {"PregnancyData"},
+    },
+    "hospitals": {
+        "sql": "SELECT * FROM Hospital",
+        "params": (),
+        "allowed_scans": {"Hospital"},
+    },
+    "checkups": {
+        "sql": "SELECT * FROM Checkup",
+        "params": (),
+        "allowed_scans": {"CheckupData"},
+    },
+    "women": {
+        "sql": "SELECT * FROM Woman",
+        "params": (),
+        "allowed_scans": {"WomanData"},
+    },
+}
+
+# Bulk data sources (/pregnancies, /hospitals, /checkups, /women) -> table or
+# view they are read from, page by page in id order (keyset pagination).
+BULK_SOURCES = {
+    "pregnancies": "Pregnancy",
+    "hospitals": "Hospital",
+    "checkups": "Checkup",
+    "women": "Woman",
+}
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+
+def _page_sql(source):
+    """Keyset pagination query of a bulk data source (LIMIT -1 = no limit)."""
+    return f"SELECT * FROM {BULK_SOURCES[source]} WHERE id > ? ORDER BY id LIMIT ?"
+
+
+QUERIES.update({
+    f"{source}_page": {"sql": _page_sql(source), "params": (0, DEFAULT_PAGE_SIZE), "allowed_scans": set()}
+    for source in BULK_SOURCES
+})
+
+# "SCAN WomanData" is a full table scan, "SCAN WomanData USING COVERING INDEX ..." is not.
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+
+def explain_query_plan(cursor, sql, params=()):
+    """Get the query plan of a query.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    sql
+        The query.
+    params
+        Values of the placeholders of the query.
+
+    Returns
+    -------
+    list
+        The "detail" column of EXPLAIN QUERY PLAN, one string per step.
+    """
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [row[3] for row in cursor.fetchall()]
+
+
+def check_query_plans(cursor, queries=QUERIES):
+    """Check that no query of the application does an unexpected full table scan.
+
+    Run it on a database freshly built by create_database: without ANALYZE
+    statistics the plans only depend on the schema, whereas on loaded data
+    the planner may rightly prefer a scan for a value shared by most rows.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    queries
+        The queries to check, in the format of QUERIES.
+
+    Returns
+    -------
+    dict
+        For each query that scans a table it should not, the list of the
+        offending plan steps. An empty dict means every plan is fine.
+    """
+    problems = {}
+    for name, query in queries.items():
+        try:
+            plan = explain_query_plan(cursor, query["sql"], query["params"])
+        except sqlite3.Error as error:
+            problems[name] = [f"error: {error}"]
+            continue
+
+        scans = []
+        for step in plan:
+            match = FULL_SCAN.match(step)
+            if match and match.group(1) not in query["allowed_scans"]:
+                scans.append(step)
+        if scans:
+            problems[name] = scans
+    return problems
+
+
+@cached
+def get_hospital_pregnancies_count(cursor):
+    """Get the number of pregnancies followed by each hospital.
+
+    The result is kept in the response cache until the database changes.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+
+    Returns
+    -------
+    dict
+        hospital id -> number of pregnancies, or None if an error occurred.
+    """
+    try:
+        cursor.execute(QUERIES["hospital_pregnancies_count"]["sql"])
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    except sqlite3.Error as error:
+        print(f"A database error occurred while counting pregnancies: {error}")
+        return None
+
+
+@cached
+def get_hospital_pregnancy_count(hospital_id, cursor):
+    """Get the number of pregnancies followed by a hospital.
+
+    The result is kept in the response cache until the database changes.
+
+    Parameters
+    ----------
+    hospital_id
+        Id of the hospital.
+    cursor
+        The object used to query the database.
+
+    Returns
+    -------
+    int
+        The number of pregnancies (0 for a hospital without pregnancies),
+        or None if an error occurred.
+    """
+    try:
+        cursor.execute(QUERIES["hospital_pregnancy_count"]["sql"], (hospital_id,))
+        count = cursor.fetchone()[0]
+    except sqlite3.Error as error:
+        print(f"A database error occurred while counting pregnancies: {error}")
+        return None
+    return count
+
+
+def _as_dicts(cursor, rows):
+    """Convert rows fetched by cursor to dictionaries column -> value."""
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def _page_args(source, after_id, limit):
+    """Check the arguments of a bulk read, as they come from a query string.
+
+    Returns
+    -------
+    tuple
+        after_id and limit as integers (limit stays None if it is None).
+
+    Raises
+    ------
+    ValueError
+        If the source is unknown or after_id or limit is not an integer.
+    """
+    if source not in BULK_SOURCES:
+        raise ValueError(f"Unknown data source '{source}', expected one of {sorted(BULK_SOURCES)}")
+    try:
+        return int(after_id), None if limit is None else int(limit)
+    except (TypeError, ValueError):
+        raise ValueError(f"after_id and limit must be integers, got {after_id!r} and {limit!r}") from None
+
+
+def get_page(cursor, source, after_id=0, limit=DEFAULT_PAGE_SIZE):
+    """Get a page of a bulk data source.
+
+    Pages are read by keyset pagination: the rows whose id is greater than
+    after_id, in id order, so every page costs the same whatever its
+    position, and only one page is held in memory.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    source
+        Name of the data source, a key of BULK_SOURCES.
+    after_id
+        Id of the last row of the previous page (0 for the first page).
+    limit
+        Maximum number of rows of the page, capped to MAX_PAGE_SIZE.
+
+    Returns
+    -------
+    dict
+        The rows of the page (as dictionaries) under the name of the source
+        and "next_after_id", the after_id of the next page (None when the
+        page is not full, i.e. there is no next page), or None if an error
+        occurred.
+
+    Raises
+    ------
+    ValueError
+        If the source is unknown or after_id or limit is not an integer (a
+        bad request, unlike the database errors).
+    """
+    after_id, limit = _page_args(source, after_id, limit)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    try:
+        cursor.execute(_page_sql(source), (after_id, limit))
+        rows = _as_dicts(cursor, cursor.fetchall())
+    except sqlite3.Error as error:
+        print(f"A database error occurred while fetching {source}: {error}")
+        return None
+
+    next_after_id = rows[-1]["id"] if len(rows) == limit else None
+    return {source: rows, "next_after_id": next_after_id}
+
+
+def iter_rows(cursor, source, after_id=0, limit=None, batch_size=DEFAULT_PAGE_SIZE):
+    """Iterate over the rows of a bulk data source, batch_size rows at a time.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    source
+        Name of the data source, a key of BULK_SOURCES.
+    after_id
+        Only the rows whose id is greater than after_id are read.
+    limit
+        Maximum number of rows (None for all of them).
+    batch_size
+        Number of rows fetched at a time with fetchmany.
+
+    Returns
+    -------
+    generator
+        The rows, column -> value, in id order.
+
+    Raises
+    ------
+    ValueError
+        If the source is unknown or after_id or limit is not an integer,
+        when iter_rows is called rather than when the first row is read.
+    """
+    after_id, limit = _page_args(source, after_id, limit)
+    return _iter_rows(cursor, source, after_id, limit, batch_size)
+
+
+def _iter_rows(cursor, source, after_id, limit, batch_size):
+    cursor.execute(_page_sql(source), (after_id, -1 if limit is None else limit))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from _as_dicts(cursor, rows)
+
+
+def stream_ndjson(cursor, source, after_id=0, limit=None, batch_size=DEFAULT_PAGE_SIZE):
+    """Encode the rows of a bulk data source as NDJSON, while they are read.
+
+    Rows are encoded batch by batch (see iter_rows), so the memory used does
+    not depend on the size of the table. In a Flask route, wrap the
+    generator with flask.stream_with_context so that the connection of the
+    request stays open until the last row is sent.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    source
+        Name of the data source, a key of BULK_SOURCES.
+    after_id
+        Only the rows whose id is greater than after_id are read.
+    limit
+        Maximum number of rows (None for all of them).
+    batch_size
+        Number of rows fetched and encoded at a time.
+
+    Returns
+    -------
+    generator
+        One chunk of JSON lines per batch. If an error occurs once the
+        response has started, a last line {"error": ...} is sent.
+
+    Raises
+    ------
+    ValueError
+        If the source is unknown or after_id or limit is not an integer,
+        when stream_ndjson is called, i.e. before the response starts.
+    """
+    rows = iter_rows(cursor, source, after_id, limit, batch_size)
+    return _ndjson_chunks(rows, source, batch_size)
+
+
+def _ndjson_chunks(rows, source, batch_size):
+    try:
+        batch = []
+        for row in rows:
+            batch.append(json.dumps(row))
+            if len(batch) == batch_size:
+                yield "\n".join(batch) + "\n"
+                batch = []
+        if batch:
+            yield "\n".join(batch) + "\n"
+    except sqlite3.Error as error:
+        print(f"A database error occurred while streaming {source}: {error}")
+        yield json.dumps({"error": f"Error while fetching {source}"}) + "\n"
+
+
+@cached
+def get_average_checkups_done(cursor):
+    """Get the average number of checkups done per pregnancy, per hospital.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+
+    Returns
+    -------
+    dict
+        hospital id -> average number of checkups done (pregnancies whose
+        number is unknown are ignored), or None if an error occurred.
+    """
+    try:
+        cursor.execute(QUERIES["hospital_checkups_done"]["sql"])
+        return {row[0]: row[1] / row[2] for row in cursor.fetchall()}
+    except sqlite3.Error as error:
+        print(f"A database error occurred while averaging checkups: {error}")
+        return None
+
+
+@cached
+def get_bp_category_distribution(cursor):
+    """Get the number of checkups and the anomaly rate of each BP category.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+
+    Returns
+    -------
+    dict
+        BP category -> {"checkups": number of checkups, "anomaly_rate": share
+        of the checkups with an anomaly, among those where it is known (None
+        if it is never known)}, or None if an error occurred.
+    """
+    try:
+        cursor.execute(QUERIES["bp_category_distribution"]["sql"])
+        return {
+            label: {"checkups": checkups, "anomaly_rate": anomalies / known if known else None}
+            for label, checkups, anomalies, known in cursor.fetchall()
+        }
+    except sqlite3.Error as error:
+        print(f"A database error occurred while counting BP categories: {error}")
+        return None
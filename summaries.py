@@ -0,0 +1,188 @@
+"""Summary tables of the Pregnancies 2023 database.
+
+The aggregates the analysts ask for (pregnancies and average checkups done
+per hospital, checkups and anomalies per BP category) are stored in small
+tables, one row per group, kept current by triggers on WomanData,
+PregnancyData and CheckupData. Every writer (the bulk loaders, the single-row helpers of the
+application, a manual UPDATE...) therefore maintains them, and reading an
+aggregate costs one row per group instead of a scan of the whole table.
+
+A NULL hospital or BP category is stored under the key 0. Rows are never
+deleted by the triggers: a group whose rows are all gone stays with zero
+counts.
+"""
+import sqlite3
+
+SUMMARY_TABLES = {
+    # Pregnancies per hospital of the woman (pregnancies without a woman are not counted)
+    "HospitalSummary": """
+        CREATE TABLE IF NOT EXISTS HospitalSummary(
+            hospital_id INTEGER PRIMARY KEY,
+            pregnancies INTEGER NOT NULL DEFAULT 0,
+            checkups_done_total INTEGER NOT NULL DEFAULT 0,
+            checkups_done_count INTEGER NOT NULL DEFAULT 0
+        );
+    """,
+
+    "BPCategorySummary": """
+        CREATE TABLE IF NOT EXISTS BPCategorySummary(
+            bp_category_id INTEGER PRIMARY KEY,
+            checkups INTEGER NOT NULL DEFAULT 0,
+            anomalies INTEGER NOT NULL DEFAULT 0,
+            anomaly_known INTEGER NOT NULL DEFAULT 0
+        );
+    """,
+}
+
+# Full recompute of each summary table, used to build and check them.
+SUMMARY_QUERIES = {
+    "HospitalSummary": """
+        SELECT COALESCE(WomanData.hospital_id, 0), COUNT(*),
+            COALESCE(SUM(PregnancyData.number_of_checkups), 0), COUNT(PregnancyData.number_of_checkups)
+        FROM PregnancyData
+        JOIN WomanData ON WomanData.id = PregnancyData.woman_id
+        GROUP BY 1
+    """,
+    "BPCategorySummary": """
+        SELECT COALESCE(bp_category_id, 0), COUNT(*),
+            COALESCE(SUM(anomaly_presence = 1), 0), COALESCE(SUM(anomaly_presence IN (0, 1)), 0)
+        FROM CheckupData
+        GROUP BY 1
+    """,
+}
+
+_HOSPITAL_UPSERT = """
+    ON CONFLICT(hospital_id) DO UPDATE SET
+        pregnancies = pregnancies + excluded.pregnancies,
+        checkups_done_total = checkups_done_total + excluded.checkups_done_total,
+        checkups_done_count = checkups_done_count + excluded.checkups_done_count;
+"""
+
+
+def _pregnancy_delta(row, sign):
+    """Statement adding (sign=1) or removing (sign=-1) a PregnancyData row (NEW
+    or OLD) to the summary of the hospital of its woman."""
+    return f"""
+        INSERT INTO HospitalSummary(hospital_id, pregnancies, checkups_done_total, checkups_done_count)
+        SELECT COALESCE(WomanData.hospital_id, 0), {sign}, {sign} * COALESCE({row}.number_of_checkups, 0),
+            {sign} * ({row}.number_of_checkups IS NOT NULL)
+        FROM WomanData WHERE WomanData.id = {row}.woman_id
+        {_HOSPITAL_UPSERT}
+    """
+
+
+def _woman_delta(row, sign):
+    """Statement adding or removing the pregnancies of a WomanData row (NEW or
+    OLD) to the summary of her hospital."""
+    return f"""
+        INSERT INTO HospitalSummary(hospital_id, pregnancies, checkups_done_total, checkups_done_count)
+        SELECT COALESCE({row}.hospital_id, 0), {sign} * COUNT(*), {sign} * COALESCE(SUM(number_of_checkups), 0),
+            {sign} * COUNT(number_of_checkups)
+        FROM PregnancyData WHERE PregnancyData.woman_id = {row}.id
+        GROUP BY PregnancyData.woman_id
+        {_HOSPITAL_UPSERT}
+    """
+
+
+def _checkup_delta(row, sign):
+    """Statement adding or removing a CheckupData row (NEW or OLD) to the
+    summary of its BP category."""
+    return f"""
+        INSERT INTO BPCategorySummary(bp_category_id, checkups, anomalies, anomaly_known)
+        VALUES(COALESCE({row}.bp_category_id, 0), {sign}, {sign} * COALESCE({row}.anomaly_presence = 1, 0),
+            {sign} * COALESCE({row}.anomaly_presence IN (0, 1), 0))
+        ON CONFLICT(bp_category_id) DO UPDATE SET
+            checkups = checkups + excluded.checkups,
+            anomalies = anomalies + excluded.anomalies,
+            anomaly_known = anomaly_known + excluded.anomaly_known;
+    """
+
+
+def _trigger(name, event, body):
+    return f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} FOR EACH ROW BEGIN {' '.join(body)} END;"
+
+
+SUMMARY_TRIGGERS = {
+    "summary_pregnancy_insert": _trigger("summary_pregnancy_insert", "INSERT ON PregnancyData",
+                                         [_pregnancy_delta("NEW", 1)]),
+    "summary_pregnancy_delete": _trigger("summary_pregnancy_delete", "DELETE ON PregnancyData",
+                                         [_pregnancy_delta("OLD", -1)]),
+    "summary_pregnancy_update": _trigger("summary_pregnancy_update",
+                                         "UPDATE OF woman_id, number_of_checkups ON PregnancyData",
+                                         [_pregnancy_delta("OLD", -1), _pregnancy_delta("NEW", 1)]),
+    "summary_woman_insert": _trigger("summary_woman_insert", "INSERT ON WomanData", [_woman_delta("NEW", 1)]),
+    "summary_woman_delete": _trigger("summary_woman_delete", "DELETE ON WomanData", [_woman_delta("OLD", -1)]),
+    "summary_woman_update": _trigger("summary_woman_update", "UPDATE OF id, hospital_id ON WomanData",
+                                     [_woman_delta("OLD", -1), _woman_delta("NEW", 1)]),
+    "summary_checkup_insert": _trigger("summary_checkup_insert", "INSERT ON CheckupData", [_checkup_delta("NEW", 1)]),
+    "summary_checkup_delete": _trigger("summary_checkup_delete", "DELETE ON CheckupData", [_checkup_delta("OLD", -1)]),
+    "summary_checkup_update": _trigger("summary_checkup_update",
+                                       "UPDATE OF bp_category_id, anomaly_presence ON CheckupData",
+                                       [_checkup_delta("OLD", -1), _checkup_delta("NEW", 1)]),
+}
+
+
+def _groups(cursor, sql):
+    """Fetch summary rows as a dict key -> counts, without the empty groups."""
+    return {row[0]: tuple(row[1:]) for row in cursor.execute(sql) if any(row[1:])}
+
+
+def check_summaries(cursor):
+    """Check the summary tables against a full recompute.
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+
+    Returns
+    -------
+    dict
+        For each summary table that is out of date, the list of the groups
+        that differ, as (key, stored counts, expected counts). An empty dict
+        means every summary is consistent.
+    """
+    problems = {}
+    for table, sql in SUMMARY_QUERIES.items():
+        try:
+            stored = _groups(cursor, f"SELECT * FROM {table}")
+            expected = _groups(cursor, sql)
+        except sqlite3.Error as error:
+            problems[table] = [f"error: {error}"]
+            continue
+
+        differences = [(key, stored.get(key), expected.get(key))
+                       for key in sorted(stored.keys() | expected.keys())
+                       if stored.get(key) != expected.get(key)]
+        if differences:
+            problems[table] = differences
+    return problems
+
+
+def rebuild_summaries(cursor, conn):
+    """Recompute the summary tables from scratch (e.g. after check_summaries
+    reported a problem, or on a database created before the triggers).
+
+    Parameters
+    ----------
+    cursor
+        The object used to query the database.
+    conn
+        The object used to manage the database connection.
+
+    Returns
+    -------
+    bool
+        True if the summaries were rebuilt, False otherwise.
+    """
+    try:
+        cursor.execute("BEGIN")
+        for table, sql in SUMMARY_QUERIES.items():
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f"INSERT INTO {table} {sql}")
+        conn.commit()
+    except sqlite3.Error as error:
+        print("Error rebuilding the summary tables:", error)
+        conn.rollback()
+        return False
+    return True
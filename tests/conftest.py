@@ -0,0 +1,13 @@
+"""The repository is the db package (its modules use relative imports):
+import it under that name, wherever it is checked out."""
+import importlib.util
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+if "db" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("db", ROOT / "__init__.py", submodule_search_locations=[str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["db"] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,18 @@
+"""ResponseCache on a database file."""
+import sqlite3
+
+from db.cache import ResponseCache
+
+
+def test_callers_get_their_own_copy(tmp_path):
+    conn = sqlite3.connect(tmp_path / "test.db")
+    cursor = conn.cursor()
+    cache = ResponseCache()
+    first = cache.get_or_compute(cursor, "key", lambda: {"rows": [1, 2]})
+    first["rows"].append(3)
+    second = cache.get_or_compute(cursor, "key", lambda: None)
+    second["rows"].clear()
+    assert cache.get_or_compute(cursor, "key", lambda: None) == {"rows": [1, 2]}
+    assert cache.hits == 2
+    cache.close()
+    conn.close()
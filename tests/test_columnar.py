@@ -0,0 +1,31 @@
+"""Columnar cache of the transformed dataset (columnar.py)."""
+import json
+
+from db.columnar import META_FILE, ColumnarDataset, write_columnar
+
+HEADER = ["Name", "Last_Checkup_Time", "BP_Category"]
+ROWS = [
+    ["Anna", "07:28:18", "Normal"],
+    ["", "25:99:00", "Normal"],
+    ["Émilie\nline two", "23:59:59", "Elevated"],
+]
+
+
+def test_high_cardinality_columns_are_stored_as_text(tmp_path):
+    write_columnar(tmp_path, HEADER, ROWS)
+    meta = {column["name"]: column for column in json.loads((tmp_path / META_FILE).read_text("utf-8"))["columns"]}
+    # the names are not loaded with meta.json, only the low-cardinality values
+    assert meta["Name"]["kind"] == "text" and meta["Name"]["dictionary"] is None
+    assert meta["BP_Category"]["dictionary"] == ["Normal", "Elevated"]
+
+    with ColumnarDataset(tmp_path) as dataset:
+        assert dataset.values("Name") == [row[0] for row in ROWS]
+        assert dataset.text("Name", 2) == "Émilie\nline two"
+        assert dataset.values("BP_Category") == [row[2] for row in ROWS]
+
+
+def test_out_of_range_times_are_null(tmp_path):
+    write_columnar(tmp_path, HEADER, ROWS)
+    with ColumnarDataset(tmp_path) as dataset:
+        times = dataset.values("Last_Checkup_Time")
+    assert [str(time) if time else None for time in times] == ["07:28:18", None, "23:59:59"]
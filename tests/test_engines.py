@@ -0,0 +1,43 @@
+"""Every engine of transform.py writes the same file, on ragged input too."""
+import pytest
+
+from db.benchmark import generate_csv
+from db.transform import available_engines, transform
+
+QUARANTINE_ENGINES = [engine for engine in available_engines() if engine != "sql"]
+
+
+@pytest.fixture
+def ragged(tmp_path):
+    """A raw export with a blank line, a short row and a long row between
+    valid rows."""
+    generated, ragged = tmp_path / "generated.csv", tmp_path / "ragged.csv"
+    generate_csv(generated, 20)
+    lines = generated.read_bytes().splitlines(keepends=True)
+    long_row = lines[1].rstrip(b"\r\n") + b",extra,fields\r\n"
+    ragged.write_bytes(b"".join([*lines[:5], b"\r\n", b"only,three,fields\r\n", long_row, *lines[5:]]))
+    return ragged
+
+
+def test_engines_write_the_same_file(tmp_path, ragged):
+    outputs = {}
+    for engine in available_engines():
+        options = {"validation": {}} if engine in QUARANTINE_ENGINES else {}
+        output = tmp_path / f"{engine}.csv"
+        transform(ragged, output, engine=engine, **options)
+        outputs[engine] = output.read_bytes()
+        if options:
+            assert options["validation"]["field_count"] == 2, engine
+    assert len(set(outputs.values())) == 1
+    # the blank line is skipped, not written as a row of empty fields
+    assert outputs["csv"].count(b"\r\n") == 1 + 20 + 2
+
+
+def test_engines_write_the_same_quarantine(tmp_path, ragged):
+    quarantines = {}
+    for engine in QUARANTINE_ENGINES:
+        quarantine = tmp_path / f"{engine}.quarantine.csv"
+        transform(ragged, tmp_path / f"{engine}.csv", engine=engine, quarantine_file_name=quarantine)
+        quarantines[engine] = quarantine.read_bytes()
+    assert len(set(quarantines.values())) == 1
+    assert b"\r\n5,field_count,only,three,fields\r\n" in quarantines["csv"]
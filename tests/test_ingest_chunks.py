@@ -0,0 +1,55 @@
+"""Chunked ingestion of raw exports whose quoted fields hold newlines."""
+import csv
+import sqlite3
+
+import pytest
+
+from db.With_Pandas import create_database, ingest_incremental, ingest_raw_csv
+from db.benchmark import generate_csv
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    cursor = conn.cursor()
+    assert create_database(cursor, conn)
+    yield cursor
+    conn.close()
+
+
+@pytest.fixture
+def export(tmp_path):
+    """A raw export of 100 rows, one name in 7 written on two lines."""
+    generated, export = tmp_path / "generated.csv", tmp_path / "export.csv"
+    generate_csv(generated, 100)
+    with open(generated, encoding="utf-8", newline="") as infile, \
+            open(export, "w", encoding="utf-8", newline="") as outfile:
+        reader, writer = csv.reader(infile), csv.writer(outfile)
+        writer.writerow(next(reader))
+        for position, row in enumerate(reader):
+            if position % 7 == 0:
+                row[0] += "\nline two"
+            writer.writerow(row)
+    return export
+
+
+def count_women(cursor):
+    return cursor.execute("SELECT COUNT(*), SUM(name LIKE '%line two') FROM WomanData").fetchone()
+
+
+def test_chunks_are_cut_on_record_boundaries(cursor, export):
+    report = ingest_raw_csv(cursor, cursor.connection, export, chunk_size=9)
+    assert report["rows"] == 100
+    assert report["byte_offset"] == export.stat().st_size
+    assert count_women(cursor) == (100, 15)
+
+
+def test_incremental_keeps_a_record_cut_inside_a_quoted_field(cursor, export, tmp_path):
+    data = export.read_bytes()
+    growing = tmp_path / "growing.csv"
+    growing.write_bytes(data[:data.index(b"\nline two", len(data) // 2) + 3])
+    first = ingest_incremental(cursor, cursor.connection, growing)
+    growing.write_bytes(data)
+    second = ingest_incremental(cursor, cursor.connection, growing)
+    assert first["rows"] + second["rows"] == 100
+    assert count_women(cursor) == (100, 15)
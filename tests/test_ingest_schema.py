@@ -0,0 +1,37 @@
+"""Parsing of the raw columns by the ingest schema (With_Pandas.read_typed_csv)."""
+import io
+
+import pandas as pd
+
+from db.With_Pandas import read_typed_csv
+
+CSV = (
+    "Age,Gestational_Age,No_of_Checkups,Weight(kg),Last_Checkup_Date\n"
+    "25,24 weeks,5,70.5,2023-06-03\n"
+    "25.5,40000 weeks,-3,61,2023-13-01\n"
+    "300,abc,12.0,x,\n"
+)
+
+
+def test_integer_columns_keep_valid_values():
+    df = read_typed_csv(io.StringIO(CSV))
+    assert df["Age"].iloc[0] == 25
+    assert df["Gestational_Age"].iloc[0] == 24
+    assert df["No_of_Checkups"].tolist() == [5, -3, 12]
+
+
+def test_non_integral_and_out_of_range_values_become_missing():
+    df = read_typed_csv(io.StringIO(CSV))
+    # 25.5 is not an integer, 300 does not fit in Int8, 40000 in Int16
+    assert df["Age"].iloc[1:].isna().all()
+    assert df["Gestational_Age"].iloc[1:].isna().all()
+    assert str(df["Age"].dtype) == "Int8"
+    assert str(df["Gestational_Age"].dtype) == "Int16"
+
+
+def test_other_columns_are_coerced():
+    df = read_typed_csv(io.StringIO(CSV))
+    assert df["Weight(kg)"].iloc[:2].tolist() == [70.5, 61.0]
+    assert pd.isna(df["Weight(kg)"].iloc[2])
+    assert df["Last_Checkup_Date"].iloc[0] == pd.Timestamp("2023-06-03")
+    assert df["Last_Checkup_Date"].iloc[1:].isna().all()
@@ -0,0 +1,65 @@
+"""Background ingestion of uploaded exports (jobs.py)."""
+import io
+import sqlite3
+import sys
+import types
+
+import pytest
+
+from db import jobs
+from db.With_Pandas import create_database
+from db.benchmark import generate_csv
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    """A JobQueue whose workers load into a database file of tmp_path."""
+    database = tmp_path / "test.db"
+    conn = sqlite3.connect(database, isolation_level=None)
+    assert create_database(conn.cursor(), conn)
+    conn.close()
+    monkeypatch.setattr(jobs, "get_db_connexion", lambda profile: sqlite3.connect(database, isolation_level=None))
+    queue = jobs.JobQueue(tmp_path / "uploads")
+    yield queue
+    queue.shutdown()
+
+
+@pytest.fixture
+def export(tmp_path):
+    export = tmp_path / "export.csv"
+    generate_csv(export, 20)
+    return export.read_bytes()
+
+
+def test_upload_is_ingested_and_its_status_polled(queue, export):
+    job_id = queue.submit_upload(io.BytesIO(export), "export.csv")
+    queue.shutdown(wait=True)
+    status = queue.status(job_id)
+    assert status["state"] == jobs.DONE and status["rows"] == 20
+    # the path of the upload on the server is not shown, and the file is gone
+    assert "source" not in status
+    assert not any(queue.upload_dir.iterdir())
+    assert queue.status("unknown") is None
+
+
+def test_upload_without_the_required_columns_is_rejected(queue):
+    with pytest.raises(ValueError, match="missing columns"):
+        queue.submit_upload(io.BytesIO(b"a,b\n1,2\n"), "other.csv")
+    assert not any(queue.upload_dir.iterdir())
+
+
+def test_routes(queue, export, monkeypatch):
+    flask = pytest.importorskip("flask")
+    # the token check of the application is not under test
+    monkeypatch.setitem(sys.modules, "utils", types.SimpleNamespace(token_required=lambda route: route))
+    app = flask.Flask(__name__)
+    jobs.init_app(app, queue)
+    client = app.test_client()
+
+    assert client.post("/uploads", data={"file": (io.BytesIO(b"a,b\n1,2\n"), "other.csv")}).status_code == 400
+    response = client.post("/uploads", data={"file": (io.BytesIO(export), "export.csv")})
+    assert response.status_code == 202
+    queue.shutdown(wait=True)
+    status = client.get(response.get_json()["status_url"])
+    assert status.status_code == 200 and status.get_json()["state"] == jobs.DONE
+    assert client.get("/uploads/unknown").status_code == 404
@@ -0,0 +1,59 @@
+"""Databases created before the *Data tables, migrated by create_database."""
+import sqlite3
+
+import pytest
+
+from db.With_Pandas import create_database
+from db.summaries import check_summaries
+
+# The tables of the former schema, with an index named like the new one
+LEGACY_SCHEMA = """
+    CREATE TABLE Hospital(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT);
+    CREATE TABLE Woman(id INTEGER PRIMARY KEY, name TEXT, birth_date TEXT, blood_type TEXT, hospital_id INTEGER);
+    CREATE TABLE Pregnancy(id INTEGER PRIMARY KEY, woman_id INTEGER, analyst_id INTEGER,
+        first_registration_date TEXT, delivery_date TEXT, baby_gender TEXT, delivery_type TEXT,
+        number_of_checkups INTEGER, number_of_missed_checkups INTEGER);
+    CREATE TABLE Checkup(id INTEGER PRIMARY KEY, pregnancy_id INTEGER, date TEXT, time TEXT, weight REAL,
+        blood_pressure TEXT, gestational_age INTEGER, fetal_heart_rate INTEGER, anomaly_presence INTEGER,
+        maternal_mental_health INTEGER, bp_category TEXT);
+    CREATE INDEX idx_woman_hospital ON Woman(hospital_id);
+    INSERT INTO Hospital(name) VALUES ('North'), ('South');
+    INSERT INTO Woman VALUES (1, 'Anna', '1990-08-08', 'AB+', 1), (2, 'Julie', '1985-07-22', NULL, 2);
+    INSERT INTO Pregnancy VALUES (1, 1, NULL, '2023-06-03', '2023-09-07', 'Male', 'Home delivery', 19, 16),
+        (2, 2, NULL, '2023-06-07', '2023-09-11', 'Female', 'Caesarean', 9, 8);
+    INSERT INTO Checkup VALUES (1, 1, '2023-07-22', '07:28:18', 75, '85/125', 31, 151, 1, 1, 'Normal'),
+        (2, 2, '2023-06-15', '01:50:51', 55.5, 'n/a', 29, 166, 0, 0, 'Unknown'),
+        (3, 2, '2023-06-16', '01:50:51', 56, '120 / 80', 30, 160, 0, 0, 'Custom category');
+"""
+
+VIEWS = ["Woman", "Pregnancy", "Checkup"]
+
+
+@pytest.fixture
+def legacy():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.executescript(LEGACY_SCHEMA)
+    yield conn
+    conn.close()
+
+
+def test_legacy_tables_are_migrated_to_views(legacy):
+    before = {view: legacy.execute(f"SELECT * FROM {view} ORDER BY id").fetchall() for view in VIEWS}
+    assert create_database(legacy.cursor(), legacy)
+
+    types = dict(legacy.execute("SELECT name, type FROM sqlite_master WHERE name IN (?, ?, ?)", VIEWS))
+    assert types == dict.fromkeys(VIEWS, "view")
+    for view in VIEWS:
+        assert legacy.execute(f"SELECT * FROM {view} ORDER BY id").fetchall() == before[view], view
+    assert legacy.execute("SELECT systolic, diastolic FROM CheckupData WHERE id = 1").fetchone() == (85, 125)
+    assert check_summaries(legacy.cursor()) == {}
+    # the index of the former table is replaced by the one of WomanData
+    assert legacy.execute("SELECT tbl_name FROM sqlite_master WHERE name = 'idx_woman_hospital'").fetchone() == (
+        "WomanData",)
+
+
+def test_legacy_tables_and_data_rows_raise(legacy):
+    legacy.execute("CREATE TABLE WomanData(id INTEGER PRIMARY KEY, name TEXT)")
+    legacy.execute("INSERT INTO WomanData VALUES (1, 'Anna')")
+    with pytest.raises(RuntimeError, match="rebuild"):
+        create_database(legacy.cursor(), legacy)
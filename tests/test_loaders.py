@@ -0,0 +1,62 @@
+"""The pandas and SQL loaders store the same rows from the same export."""
+import csv
+import importlib
+import sqlite3
+
+import pytest
+
+from db.With_Pandas import create_database, ingest_raw_csv
+from db.benchmark import generate_csv
+
+sql_loader = importlib.import_module("db.__init__SQL")
+
+VIEWS = ["Woman", "Pregnancy", "Checkup", "Hospital", "HospitalSummary", "BPCategorySummary"]
+
+# Column -> values that the loaders must parse the same way
+EDGE_VALUES = {
+    "Gestational_Age": ["31 weeks", " 31weeks", "-3 weeks", "40000 weeks", "weeks", ""],
+    "Fetal_Heart_Rate": ["151 bpm", "bpm", "n/a"],
+    "Anomaly": [" Yes ", "yes", "Maybe", "NULL"],
+    "Maternal_Mental_Health": ["Concerns ", "stable", ""],
+    "Blood_Pressure": ["n/a", "None", "120", "120/80/1"],
+    "Last_Checkup_Date": ["2023-6-3", "2023-02-30", " 2023-06-21", "N/A"],
+    "Weight(kg)": [" 68 ", "1e1", "68.5x", ""],
+    "No_of_Checkups": ["5.0", " 7 ", "+5", "1_0", "99999999999999999999"],
+    "Age": ["300", "33.5", "nan"],
+    "Name": ["NULL", "nan", ""],
+}
+
+
+@pytest.fixture
+def export(tmp_path):
+    """A generated export whose first rows hold the values of EDGE_VALUES."""
+    generated, export = tmp_path / "generated.csv", tmp_path / "export.csv"
+    generate_csv(generated, 200)
+    with open(generated, encoding="utf-8", newline="") as infile, \
+            open(export, "w", encoding="utf-8", newline="") as outfile:
+        reader, writer = csv.DictReader(infile), None
+        for position, row in enumerate(reader):
+            if writer is None:
+                writer = csv.DictWriter(outfile, reader.fieldnames)
+                writer.writeheader()
+            for column, values in EDGE_VALUES.items():
+                if position < len(values):
+                    row[column] = values[position]
+            writer.writerow(row)
+    return export
+
+
+def load(loader, export):
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    cursor = conn.cursor()
+    assert create_database(cursor, conn)
+    assert loader(cursor, conn, export)
+    return conn
+
+
+def test_sql_and_pandas_loaders_store_the_same_rows(export):
+    with_pandas = load(ingest_raw_csv, export)
+    with_sql = load(sql_loader.populate_database, export)
+    for view in VIEWS:
+        query = f"SELECT * FROM {view} ORDER BY 1"
+        assert with_sql.execute(query).fetchall() == with_pandas.execute(query).fetchall(), view
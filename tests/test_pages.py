@@ -0,0 +1,16 @@
+"""Arguments of the bulk reads, as they come from a query string."""
+import pytest
+
+from db.queries import get_page, iter_rows, stream_ndjson
+
+
+@pytest.mark.parametrize("source, after_id, limit", [
+    ("pregnancies", "abc", 10),
+    ("pregnancies", 0, "ten"),
+    ("unknown", 0, 10),
+])
+@pytest.mark.parametrize("read", [get_page, iter_rows, stream_ndjson])
+def test_bad_arguments_raise_value_error_before_reading(read, source, after_id, limit):
+    # No cursor: the arguments are checked before any query, when read is called
+    with pytest.raises(ValueError):
+        read(None, source, after_id, limit)
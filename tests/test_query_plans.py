@@ -0,0 +1,32 @@
+"""EXPLAIN QUERY PLAN of every query of queries.QUERIES on a fresh database."""
+import sqlite3
+
+import pytest
+
+from db.queries import QUERIES, check_query_plans, explain_query_plan
+from db.With_Pandas import create_database
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(":memory:")
+    cursor = conn.cursor()
+    assert create_database(cursor, conn)
+    yield cursor
+    conn.close()
+
+
+def test_no_unexpected_full_table_scan(cursor):
+    assert check_query_plans(cursor) == {}
+
+
+def test_hospital_pregnancy_count_uses_covering_indexes(cursor):
+    query = QUERIES["hospital_pregnancy_count"]
+    plan = explain_query_plan(cursor, query["sql"], query["params"])
+    assert all("COVERING INDEX" in step for step in plan), plan
+
+
+def test_check_query_plans_reports_full_scans(cursor):
+    cursor.execute("DROP INDEX idx_woman_hospital")
+    problems = check_query_plans(cursor, {"hospital_pregnancy_count": QUERIES["hospital_pregnancy_count"]})
+    assert list(problems) == ["hospital_pregnancy_count"]
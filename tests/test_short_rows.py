@@ -0,0 +1,24 @@
+"""Rows with too few fields, transformed without a quarantine file."""
+import csv
+
+import pytest
+
+from db.CSV import parallel_transform_data, stream_transform_data, transform_data
+from db.benchmark import generate_csv
+
+
+@pytest.mark.parametrize("engine", [transform_data, stream_transform_data, parallel_transform_data])
+def test_short_rows_are_padded_with_empty_fields(tmp_path, engine):
+    input_file_name, output_file_name = tmp_path / "raw.csv", tmp_path / "new.csv"
+    generate_csv(input_file_name, 5)
+    with open(input_file_name, "a", encoding="utf-8", newline="") as outfile:
+        outfile.write("only,three,fields\r\n")
+
+    validation = {}
+    engine(input_file_name, output_file_name, validation=validation)
+
+    with open(output_file_name, encoding="utf-8", newline="") as infile:
+        rows = list(csv.reader(infile))
+    assert len(rows) == 7
+    assert rows[-1] == ["only", "fields", *[""] * (len(rows[0]) - 3), "Unknown"]
+    assert validation["field_count"] == 1
@@ -0,0 +1,276 @@
+"""One entry point for the transform engines.
+
+transform(input, output, engine="auto") writes the transformed CSV file
+(dates swapped when the registration is after the checkup, Checkup and
+BP_Category added, unused columns dropped) with one of the engines:
+
+* "csv-stream": pure Python, streaming, constant memory (CSV.stream_transform_data);
+* "csv-parallel": the same, on every core (CSV.parallel_transform_data);
+* "csv": pure Python, whole file in memory (CSV.transform_data);
+* "pandas": vectorized, whole file in memory (With_Pandas.transform_data);
+* "sql": in SQLite, staging on disk (__init__SQL.transform_data).
+
+All the engines write the same file, byte for byte (checked by the benchmark,
+by tests/test_engines.py and, on a sample of the input, by estimate()),
+including on ragged input: every engine splits the records with csv.reader,
+pads the rows with too few fields with empty fields, truncates the rows
+with too many fields and skips the blank lines. The only known exception
+is the SQL engine, which leaves Checkup empty for integers written with
+non-ASCII digits or beyond 64 bits, and has no quarantine.
+
+With engine="auto", the engine is chosen from the size of the input, the
+number of cores, the available memory and the installed libraries (see
+choose_engine). estimate() runs the engines on a sample of the input and
+extrapolates their time and memory, to choose by hand before a long run.
+"""
+import filecmp
+import importlib
+import importlib.util
+import mmap
+import os
+import tempfile
+
+# name -> (module, function, libraries it needs)
+ENGINES = {
+    "csv-stream": ("CSV", "stream_transform_data", []),
+    "csv-parallel": ("CSV", "parallel_transform_data", []),
+    "csv": ("CSV", "transform_data", []),
+    "pandas": ("With_Pandas", "transform_data", ["pandas", "numpy"]),
+    "sql": ("__init__SQL", "transform_data", []),
+}
+
+# Below this size, starting a pool of processes costs more than it saves
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+
+# Peak memory of a csv-parallel worker: about 8 times the default shard
+# size of CSV.parallel_transform_data (16 MiB), once parsed into lists
+PARALLEL_MEMORY_PER_WORKER = 8 * 16 * 1024 * 1024
+
+DEFAULT_SAMPLE_ROWS = 20000
+
+# An engine measured by estimate() replaces the one of the rule only if it
+# is estimated to take less than ESTIMATE_MARGIN times as long and to save
+# at least ESTIMATE_MIN_GAIN seconds
+ESTIMATE_MARGIN = 0.8
+ESTIMATE_MIN_GAIN = 1.0
+
+
+def _module(name):
+    """Import a module of the package by its name."""
+    return importlib.import_module(f"{__package__}.{name}")
+
+
+def available_engines():
+    """Return the names of the engines whose libraries are installed."""
+    return [name for name, (_, _, libraries) in ENGINES.items()
+            if all(importlib.util.find_spec(library) is not None for library in libraries)]
+
+
+def available_memory():
+    """Return the memory available to a new process, in bytes (None if unknown)."""
+    try:
+        with open("/proc/meminfo", encoding="ascii") as infile:
+            for line in infile:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _cpu_count():
+    """Return the number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def choose_engine(input_file_name, estimates=None):
+    """Choose the engine for a transform.
+
+    Without estimates, the rule comes from the benchmark (benchmark.py):
+    csv-stream is the fastest engine on one core and its memory does not
+    grow with the input; csv-parallel is used for large inputs when several
+    cores are available and its shards fit in memory. pandas and sql are
+    only chosen from measures.
+
+    Parameters
+    ----------
+    input_file_name
+        Name of the raw CSV file.
+    estimates
+        If given, the "engines" entry of estimate(): the fastest engine whose
+        output is identical and whose estimated peak memory fits in the
+        available memory is chosen, if it is clearly faster (see
+        ESTIMATE_MARGIN and ESTIMATE_MIN_GAIN) than the one of the rule.
+
+    Returns
+    -------
+    str
+        The name of the engine, a key of ENGINES.
+    """
+    memory = available_memory()
+    cores = _cpu_count()
+    engine = "csv-stream"
+    if (cores > 1 and os.path.getsize(input_file_name) >= PARALLEL_MIN_BYTES
+            and (memory is None or cores * PARALLEL_MEMORY_PER_WORKER < memory)):
+        engine = "csv-parallel"
+
+    if estimates:
+        fitting = {name: values for name, values in estimates.items()
+                   if "error" not in values and values["identical"]
+                   and (memory is None or values["peak_rss_bytes"] < memory)}
+        fastest = min(fitting, key=lambda name: fitting[name]["seconds"], default=engine)
+        # The estimates are rough: only leave the rule for a clear gain
+        if engine not in fitting:
+            engine = fastest
+        elif (fitting[fastest]["seconds"] < ESTIMATE_MARGIN * fitting[engine]["seconds"]
+              and fitting[engine]["seconds"] - fitting[fastest]["seconds"] >= ESTIMATE_MIN_GAIN):
+            engine = fastest
+    return engine
+
+
+def transform(input_file_name, output_file_name, engine="auto", report=None, **options):
+    """Write the transformed CSV file of a raw export.
+
+    Parameters
+    ----------
+    input_file_name
+        Name of the raw CSV file.
+    output_file_name
+        Name of the transformed CSV file.
+    engine
+        Name of the engine (a key of ENGINES), or "auto" (see choose_engine).
+    report
+        If given, a date correction report updated with the counts (see
+        dates.py).
+    options
+        Other arguments of the engine function (e.g. workers for
+        csv-parallel, columnar_dir for csv, csv-stream and pandas,
+        quarantine_file_name and validation for every engine but sql, see
+        validation.py).
+
+    Returns
+    -------
+    str
+        The name of the engine used.
+
+    Raises
+    ------
+    ValueError
+        If the engine is unknown.
+    ImportError
+        If a library the engine needs is not installed.
+    """
+    if engine == "auto":
+        engine = choose_engine(input_file_name)
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected 'auto' or one of {sorted(ENGINES)}")
+
+    module_name, function_name, libraries = ENGINES[engine]
+    missing = [library for library in libraries if importlib.util.find_spec(library) is None]
+    if missing:
+        raise ImportError(f"The {engine} engine needs {', '.join(missing)}")
+    getattr(_module(module_name), function_name)(input_file_name, output_file_name, report=report, **options)
+    return engine
+
+
+def _write_sample(input_file_name, sample_file_name, nb_rows):
+    """Copy the header and the first nb_rows records of a CSV file, as is.
+
+    Returns
+    -------
+    tuple
+        The number of records copied and their size in bytes.
+    """
+    next_record_end = _module("CSV")._next_record_end
+    with open(input_file_name, "rb") as infile, mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header_end = end = next_record_end(mm, 0)
+        count = 0
+        while count < nb_rows and end < len(mm):
+            end = next_record_end(mm, end)
+            count += 1
+        with open(sample_file_name, "wb") as outfile:
+            outfile.write(mm[:end])
+    return count, end - header_end
+
+
+def estimate(input_file_name, engines=None, sample_rows=DEFAULT_SAMPLE_ROWS, work_dir=None):
+    """Estimate the time and memory of each engine on a file, from a sample.
+
+    Every engine runs, in a fresh process, on the first sample_rows // 4 and
+    then the first sample_rows records of the input; the time and peak
+    memory are extrapolated linearly to the size of the whole file, so that
+    the fixed costs (interpreter, imports, pool start) are not multiplied.
+    The output of each engine on the sample is compared with the one of
+    csv-stream.
+
+    Parameters
+    ----------
+    input_file_name
+        Name of the raw CSV file.
+    engines
+        Names of the engines to measure (by default, every engine whose
+        libraries are installed).
+    sample_rows
+        Number of records of the largest sample.
+    work_dir
+        Directory of the sample files (a temporary directory by default).
+
+    Returns
+    -------
+    dict
+        The size of the input, its estimated number of rows, the available
+        memory, for each engine ("engines") the estimated seconds and peak
+        memory and whether its output is identical to the one of csv-stream,
+        and the engine recommended from these measures ("recommended").
+    """
+    benchmark = _module("benchmark")
+    engines = list(engines or available_engines())
+    input_bytes = os.path.getsize(input_file_name)
+    results = {}
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        samples = []
+        for nb_rows in (max(1, sample_rows // 4), sample_rows):
+            sample_file_name = os.path.join(tmp, f"sample_{nb_rows}.csv")
+            samples.append((sample_file_name, *_write_sample(input_file_name, sample_file_name, nb_rows)))
+        (_, small_rows, small_bytes), (large_file_name, large_rows, large_bytes) = samples
+        bytes_per_row = large_bytes / large_rows if large_rows else 1
+        estimated_rows = round(input_bytes / bytes_per_row)
+
+        reference_file_name = os.path.join(tmp, "reference.csv")
+        _module("CSV").stream_transform_data(large_file_name, reference_file_name)
+
+        for engine in engines:
+            measures = []
+            for sample_file_name, _, _ in samples:
+                output_file_name = os.path.join(tmp, f"output_{engine}.csv")
+                measures.append(benchmark.run_engine(engine, sample_file_name, output_file_name))
+            if any("error" in measure for measure in measures):
+                results[engine] = {"error": next(measure["error"] for measure in measures if "error" in measure)}
+                continue
+
+            # Linear fit on the two samples: fixed cost + cost per byte of input
+            small, large = measures
+            spread = max(large_bytes - small_bytes, 1)
+            seconds_per_byte = max(large["seconds"] - small["seconds"], 0) / spread
+            rss_per_byte = max(large["peak_rss_mib"] - small["peak_rss_mib"], 0) * 1024 * 1024 / spread
+            extra_bytes = max(input_bytes - large_bytes, 0)
+            results[engine] = {
+                "seconds": large["seconds"] + seconds_per_byte * extra_bytes,
+                "peak_rss_bytes": round(large["peak_rss_mib"] * 1024 * 1024 + rss_per_byte * extra_bytes),
+                "identical": filecmp.cmp(reference_file_name, output_file_name, shallow=False),
+            }
+
+    return {
+        "input_bytes": input_bytes,
+        "estimated_rows": estimated_rows,
+        "sample_rows": large_rows,
+        "available_memory_bytes": available_memory(),
+        "engines": results,
+        "recommended": choose_engine(input_file_name, results),
+    }
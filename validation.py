@@ -0,0 +1,244 @@
+"""Validation of the raw rows before the transform, and their quarantine.
+
+Every rule of RULES checks some columns of a raw export against a
+precompiled pattern:
+
+* "field_count": the row has as many fields as the header;
+* "checkups": No_of_Checkups and No_of_Missed_Checkups are integers (as
+  int() reads them), so that Checkup can be computed;
+* "blood_pressure": Blood_Pressure is "systolic/diastolic", two integers,
+  so that BP_Category is not "Unknown";
+* "dates": User_Registration_Date and Last_Checkup_Date are YYYY-MM-DD
+  dates, so that comparing them as text compares them as dates.
+
+The rows are checked a whole batch (RowValidator) or DataFrame
+(validate_dataframe) at a time, with a single pattern for all the rules;
+the rules a row breaks are only looked for in the rows that fail it. The
+valid rows are then transformed without any check nor try/except. The
+invalid rows are either quarantined, i.e. written to a separate CSV file
+with their row number and the rules they break and left out of the output,
+or, without quarantine file, transformed as before (empty Checkup,
+"Unknown" category, dates compared as text, missing fields of the short
+rows left empty and extra fields of the long rows dropped). Either way, the number of
+rows that break each rule is counted in a report.
+"""
+import csv
+import operator
+import re
+
+from .dates import ISO_DATE_PATTERN
+
+# An integer as int() reads it: sign, "_" between digits, surrounding spaces
+INT_DIGITS_PATTERN = r"[+-]?\d+(?:_\d+)*"
+INT_PATTERN = rf"\s*{INT_DIGITS_PATTERN}\s*"
+BP_PATTERN = rf"{INT_PATTERN}/{INT_PATTERN}"
+
+FIELD_COUNT = "field_count"
+
+# Joins the values checked in a row, see _combined_pattern() (not "\0",
+# which numpy strips when pandas adds strings)
+VALUE_SEPARATOR = ","
+
+# rule -> (columns, pattern every value of the columns must match)
+RULES = {
+    "checkups": (["No_of_Checkups", "No_of_Missed_Checkups"], INT_PATTERN),
+    "blood_pressure": (["Blood_Pressure"], BP_PATTERN),
+    "dates": (["User_Registration_Date", "Last_Checkup_Date"], ISO_DATE_PATTERN),
+}
+
+RULE_NAMES = [FIELD_COUNT, *RULES]
+
+# Columns written before the raw columns in the quarantine file
+QUARANTINE_COLUMNS = ["Row", "Reasons"]
+REASON_SEPARATOR = ";"
+
+is_int = re.compile(INT_PATTERN).fullmatch
+is_blood_pressure = re.compile(BP_PATTERN).fullmatch
+
+
+def new_validation_report():
+    """Return an empty validation report: rows checked, invalid rows, rows
+    quarantined and, for each rule, number of rows that break it."""
+    return {"rows": 0, "invalid": 0, "quarantined": 0, **dict.fromkeys(RULE_NAMES, 0)}
+
+
+def print_validation_report(report, quarantine_file_name=None):
+    """Warn about the invalid rows of a report, if any."""
+    if report["invalid"]:
+        counts = ", ".join(f"{rule}: {report[rule]}" for rule in RULE_NAMES if report[rule])
+        where = f", quarantined in {quarantine_file_name}" if quarantine_file_name is not None else ""
+        print(f"Warning: {report['invalid']} invalid row(s) in {report['rows']} rows ({counts}){where}")
+
+
+def _combined_pattern():
+    """Pattern of the values of every column of RULES joined with
+    VALUE_SEPARATOR, which none of the patterns can match: a row is valid if
+    and only if its joined values match, with a single regex call."""
+    return VALUE_SEPARATOR.join(f"(?:{pattern})" for columns, pattern in RULES.values() for _ in columns)
+
+
+class RowValidator:
+    """Check batches of rows (lists of strings) of a raw export.
+
+    Parameters
+    ----------
+    header
+        Header of the raw export.
+    """
+
+    def __init__(self, header):
+        self.nb_fields = len(header)
+        self.rules = [(rule, [header.index(column) for column in columns], re.compile(pattern).fullmatch)
+                      for rule, (columns, pattern) in RULES.items()]
+        self._values = operator.itemgetter(*(position for _, positions, _ in self.rules for position in positions))
+        self._match = re.compile(_combined_pattern()).fullmatch
+
+    def validate(self, rows, report=None):
+        """Check a batch of rows.
+
+        Parameters
+        ----------
+        rows
+            A batch of rows.
+        report
+            If given, a validation report (see new_validation_report())
+            updated with the counts.
+
+        Returns
+        -------
+        dict
+            Position in rows of each invalid row -> list of the rules it
+            breaks (empty if every row is valid).
+        """
+        nb_fields, values, match = self.nb_fields, self._values, self._match
+        failed = [position for position, row in enumerate(rows)
+                  if len(row) != nb_fields or not match(VALUE_SEPARATOR.join(values(row)))]
+
+        # The reasons, rule by rule, only for the few rows that failed
+        invalid = {}
+        for position in failed:
+            row = rows[position]
+            if len(row) != nb_fields:
+                invalid[position] = [FIELD_COUNT]
+            else:
+                invalid[position] = [rule for rule, positions, rule_match in self.rules
+                                     if not all(rule_match(row[column]) for column in positions)]
+
+        if report is not None:
+            report["rows"] += len(rows)
+            report["invalid"] += len(invalid)
+            for reasons in invalid.values():
+                for rule in reasons:
+                    report[rule] += 1
+        return invalid
+
+
+def validate_dataframe(df, report=None, ragged=None):
+    """Vectorized version of RowValidator.validate for a DataFrame read as
+    text (see With_Pandas.read_text_csv).
+
+    The rows with too few or too many fields have been padded or truncated
+    when read: they are given by ragged and, like the rows with missing
+    values (NaN), only reported under "field_count".
+
+    Parameters
+    ----------
+    df
+        The DataFrame of the original CSV file.
+    report
+        If given, a validation report (see new_validation_report()) updated
+        with the counts.
+    ragged
+        If given, positions of the rows whose number of fields differs from
+        the header.
+
+    Returns
+    -------
+    Series
+        The rules each row breaks, joined with REASON_SEPARATOR ("" for
+        valid rows).
+    """
+    import pandas as pd
+
+    # object dtype: the patterns are matched by re, like in RowValidator
+    # (a pyarrow string column would use RE2, whose \d and \s are ASCII only)
+    columns = [df[column].fillna("").astype(object) for columns, _ in RULES.values() for column in columns]
+    joined = columns[0]
+    for column in columns[1:]:
+        joined = joined + VALUE_SEPARATOR + column
+    complete = df.notna().all(axis=1)
+    if ragged:
+        complete.iloc[ragged] = False
+    failed = ~(joined.str.fullmatch(_combined_pattern()).astype(bool) & complete)
+
+    # The reasons, rule by rule, only for the few rows that failed
+    bad = df[failed]
+    masks = {FIELD_COUNT: ~complete[failed]}
+    for rule, (rule_columns, pattern) in RULES.items():
+        broken = pd.Series(False, index=bad.index)
+        for column in rule_columns:
+            broken |= ~bad[column].fillna("").astype(object).str.fullmatch(pattern).astype(bool)
+        masks[rule] = broken & complete[failed]
+
+    reasons = pd.Series("", index=df.index, dtype=object)
+    for rule, mask in masks.items():
+        mask = mask.reindex(df.index, fill_value=False)
+        reasons[mask] = reasons[mask] + REASON_SEPARATOR + rule
+    reasons = reasons.str.removeprefix(REASON_SEPARATOR)
+
+    if report is not None:
+        report["rows"] += len(df)
+        report["invalid"] += int(failed.sum())
+        for rule, mask in masks.items():
+            report[rule] += int(mask.sum())
+    return reasons
+
+
+class QuarantineWriter:
+    """Write the invalid rows of a raw export to a quarantine CSV file.
+
+    Each line holds the row number in the export (1 for the first row after
+    the header, the blank lines skipped by every engine not counted), the rules the row breaks (separated by REASON_SEPARATOR)
+    and the fields of the row, as read.
+
+    Parameters
+    ----------
+    file_name
+        Name of the quarantine file.
+    header
+        Header of the raw export.
+    """
+
+    def __init__(self, file_name, header):
+        self.file_name = file_name
+        self.nb_rows = 0
+        self._file = open(file_name, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([*QUARANTINE_COLUMNS, *header])
+
+    def write_rows(self, rows, invalid, first_row=1):
+        """Append the invalid rows of a batch.
+
+        Parameters
+        ----------
+        rows
+            The batch of rows (or a dict position -> row holding at least
+            the invalid rows).
+        invalid
+            The invalid rows, as returned by RowValidator.validate().
+        first_row
+            Row number of rows[0] in the export.
+        """
+        self._writer.writerows([first_row + position, REASON_SEPARATOR.join(invalid[position]), *rows[position]]
+                               for position in sorted(invalid))
+        self.nb_rows += len(invalid)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False